@@ -0,0 +1,27 @@
+"""
+Benchmark suite for nano-vLLM
+
+- workload: Poisson-arrival synthetic workloads with shared prefixes, JSONL replay
+- runner: Online replay against LLMEngine with TTFT/ITL percentiles and goodput
+- tiny_model: Random-weight model for offline CPU runs
+- quantization: Memory saved and accuracy delta of int8/int4 weight-only quantization
+- tensor_parallel: Token agreement of tensor-parallel and single-process generation
+- compiled_decode: Token agreement and decode throughput of compiled vs eager decode
+
+Usage:
+    python -m benchmarks --model tiny --num-requests 32 --output results.json
+"""
+
+from .workload import BenchmarkRequest, WorkloadConfig, synthesize_workload, load_workload, save_workload
+from .runner import run_benchmark
+from .tiny_model import create_tiny_model
+
+__all__ = [
+    "BenchmarkRequest",
+    "WorkloadConfig",
+    "synthesize_workload",
+    "load_workload",
+    "save_workload",
+    "run_benchmark",
+    "create_tiny_model"
+]
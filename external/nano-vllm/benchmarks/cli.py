@@ -0,0 +1,208 @@
+"""
+Command-line entry point for the nano-vLLM benchmark suite
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from dataclasses import asdict
+from typing import Any, Dict, Optional
+
+from .runner import run_benchmark
+from .tiny_model import create_tiny_model
+from .workload import (
+    WorkloadConfig, load_benchmark_config, load_workload, save_workload, synthesize_workload
+)
+
+TINY_MODEL = "tiny"
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, float]:
+    """Relative change (%) of headline metrics against an earlier results file"""
+    metrics = {
+        'output_throughput': lambda r: r['output_throughput'],
+        'ttft_p95_ms': lambda r: r['ttft']['p95_ms'],
+        'itl_p95_ms': lambda r: r['itl']['p95_ms'],
+        'request_goodput': lambda r: r['goodput']['request_goodput']
+    }
+    comparison = {}
+    for name, get in metrics.items():
+        old, new = get(baseline['results']), get(results)
+        comparison[name] = (new - old) / old * 100 if old else 0.0
+    return comparison
+
+def print_results(results: Dict[str, Any], comparison: Optional[Dict[str, float]] = None):
+    """Display benchmark results"""
+    print("\n" + "=" * 60)
+    print("📈 BENCHMARK RESULTS")
+    print("=" * 60)
+    print(f"Requests: {results['completed']}/{results['num_requests']} in {results['duration_s']:.2f}s")
+    print(f"Input Tokens: {results['total_input_tokens']:,}")
+    print(f"Output Tokens: {results['total_output_tokens']:,}")
+    print(f"Output Throughput: {results['output_throughput']:.2f} tokens/s")
+    print(f"Request Throughput: {results['request_throughput']:.2f} req/s")
+    for name in ('ttft', 'tpot', 'itl', 'e2e_latency'):
+        summary = results[name]
+        print(
+            f"{name.upper():>12}: mean {summary['mean_ms']:.1f}ms  p50 {summary['p50_ms']:.1f}ms  "
+            f"p95 {summary['p95_ms']:.1f}ms  p99 {summary['p99_ms']:.1f}ms"
+        )
+    goodput = results['goodput']
+    print(
+        f"Goodput: {goodput['request_goodput']:.2f} req/s "
+        f"({goodput['slo_attainment'] * 100:.1f}% within TTFT<={goodput['slo_ttft_ms']:.0f}ms, "
+        f"TPOT<={goodput['slo_tpot_ms']:.0f}ms)"
+    )
+    
+    speculative = results['cache'].get('speculative')
+    if speculative:
+        print(
+            f"Speculative: {speculative['acceptance_rate'] * 100:.1f}% drafts accepted, "
+            f"{speculative['tokens_per_target_forward']:.2f} tokens per target forward"
+        )
+        
+    if comparison:
+        print("\nBaseline Comparison:")
+        for name, change in comparison.items():
+            print(f"  {name}: {change:+.2f}%")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="nano-vLLM online serving benchmark")
+    parser.add_argument("--model", default=None, help=f"Model path, or '{TINY_MODEL}' for a random-weight CPU model")
+    parser.add_argument("--config", default=None, help="Project config.yaml with performance.benchmarks")
+    parser.add_argument("--num-requests", type=int, default=None)
+    parser.add_argument("--input-len-range", type=int, nargs=2, default=None, metavar=("MIN", "MAX"))
+    parser.add_argument("--output-len-range", type=int, nargs=2, default=None, metavar=("MIN", "MAX"))
+    parser.add_argument("--request-rate", type=float, default=float('inf'), help="Poisson arrival rate (req/s)")
+    parser.add_argument("--shared-prefix-ratio", type=float, default=0.0)
+    parser.add_argument("--num-shared-prefixes", type=int, default=1)
+    parser.add_argument("--workload", default=None, help="Replay a JSONL workload instead of synthesizing one")
+    parser.add_argument("--save-workload", default=None, help="Write the synthesized workload as JSONL")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--slo-ttft-ms", type=float, default=1000.0)
+    parser.add_argument("--slo-tpot-ms", type=float, default=100.0)
+    parser.add_argument("--max-num-seqs", type=int, default=32)
+    parser.add_argument("--max-num-batched-tokens", type=int, default=8192)
+    parser.add_argument("--max-model-len", type=int, default=None)
+    parser.add_argument("--disable-prefix-caching", action="store_true")
+    parser.add_argument("--speculative-model", default=None, help="Draft model path (n-gram lookup if omitted)")
+    parser.add_argument("--num-speculative-tokens", type=int, default=0)
+    parser.add_argument("--quantization", default=None, choices=["int8", "int4"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results JSON to this path")
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+    
+    from nanovllm import LLM
+    
+    workload_args = {}
+    if args.config is not None:
+        workload_args = load_benchmark_config(args.config)
+    model = args.model or workload_args.pop('model', TINY_MODEL)
+    workload_args.pop('model', None)
+    if args.num_requests is not None:
+        workload_args['num_requests'] = args.num_requests
+    if args.input_len_range is not None:
+        workload_args['input_length_range'] = tuple(args.input_len_range)
+    if args.output_len_range is not None:
+        workload_args['output_length_range'] = tuple(args.output_len_range)
+        
+    workload_config = WorkloadConfig(
+        request_rate=args.request_rate,
+        shared_prefix_ratio=args.shared_prefix_ratio,
+        num_shared_prefixes=args.num_shared_prefixes,
+        seed=args.seed,
+        **workload_args
+    )
+    
+    model_path = model
+    if model == TINY_MODEL:
+        model_path = create_tiny_model(
+            os.path.join(tempfile.gettempdir(), f"nanovllm-tiny-{args.seed}"), seed=args.seed
+        )
+        
+    print("=" * 60)
+    print("🔥 nano-vLLM Performance Benchmark")
+    print("=" * 60)
+    
+    llm = LLM(
+        model_path,
+        max_model_len=args.max_model_len,
+        max_num_seqs=args.max_num_seqs,
+        max_num_batched_tokens=args.max_num_batched_tokens,
+        enable_prefix_caching=not args.disable_prefix_caching,
+        speculative_model=args.speculative_model,
+        num_speculative_tokens=args.num_speculative_tokens,
+        quantization=args.quantization
+    )
+    
+    if args.workload is not None:
+        requests = load_workload(args.workload, llm.tokenizer)
+    else:
+        requests = synthesize_workload(workload_config, len(llm.tokenizer), llm.tokenizer.all_special_ids)
+    if args.save_workload is not None:
+        save_workload(requests, args.save_workload)
+        
+    print(f"📊 Running {len(requests)} requests (rate: {args.request_rate} req/s)...")
+    results = run_benchmark(
+        llm, requests,
+        temperature=args.temperature,
+        slo_ttft=args.slo_ttft_ms / 1000,
+        slo_tpot=args.slo_tpot_ms / 1000
+    )
+    
+    comparison = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            comparison = compare_to_baseline(results, json.load(f))
+    print_results(results, comparison)
+    
+    if args.output is not None:
+        import torch
+        
+        workload = {'path': args.workload}
+        if args.workload is None:
+            workload = asdict(workload_config)
+            if workload['request_rate'] == float('inf'):
+                workload['request_rate'] = None
+                
+        report = {
+            'metadata': {
+                'timestamp': time.time(),
+                'git_commit': _git_commit(),
+                'model': model,
+                'device': str(llm.device),
+                'torch_version': torch.__version__,
+                'python_version': platform.python_version()
+            },
+            'workload': workload,
+            'engine': {
+                'max_num_seqs': args.max_num_seqs,
+                'max_num_batched_tokens': args.max_num_batched_tokens,
+                'max_model_len': llm.max_model_len,
+                'enable_prefix_caching': not args.disable_prefix_caching,
+                'speculative_model': args.speculative_model,
+                'num_speculative_tokens': args.num_speculative_tokens,
+                'quantization': args.quantization
+            },
+            'results': results
+        }
+        if comparison is not None:
+            report['baseline_comparison'] = comparison
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"💾 Results written to {args.output}")
+        
+    return results
@@ -0,0 +1,97 @@
+"""
+Accuracy and memory evaluation for weight-only quantization
+
+Usage:
+    python -m benchmarks.quantization --model tiny --quantization int8 int4
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from typing import Any, Dict, List
+
+from .tiny_model import create_tiny_model
+
+TINY_MODEL = "tiny"
+
+def print_quantization_results(results: List[Dict[str, Any]]):
+    """Display memory saved and accuracy delta per quantization mode"""
+    print("\n" + "=" * 60)
+    print("📈 QUANTIZATION RESULTS")
+    print("=" * 60)
+    for result in results:
+        print(f"{result['quantization']} (group size {result['group_size']}):")
+        print(f"  Quantized Layers: {result['num_quantized_layers']}")
+        print(
+            f"  Model Memory: {result['model_bytes_full_precision'] / 1024**2:.1f} MB -> "
+            f"{result['model_bytes'] / 1024**2:.1f} MB "
+            f"({result['memory_saved_bytes'] / 1024**2:.1f} MB saved, {result['compression_ratio']:.2f}x)"
+        )
+        print(
+            f"  Perplexity: {result['reference_perplexity']:.3f} -> {result['quantized_perplexity']:.3f} "
+            f"({result['perplexity_delta_pct']:+.2f}%)"
+        )
+        print(f"  Top-1 Agreement: {result['top1_agreement'] * 100:.1f}% over {result['num_eval_tokens']} tokens")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="nano-vLLM weight-only quantization evaluation")
+    parser.add_argument("--model", default=TINY_MODEL, help=f"Model path, or '{TINY_MODEL}' for a random-weight CPU model")
+    parser.add_argument("--quantization", nargs="+", default=["int8", "int4"], choices=["int8", "int4"])
+    parser.add_argument("--group-size", type=int, default=128)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--eval-file", default=None, help="Text file with one evaluation sample per line")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results JSON to this path")
+    args = parser.parse_args(argv)
+    
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from nanovllm.quantization import DEFAULT_EVAL_TEXTS, compare_quantization
+    
+    model_path = args.model
+    if args.model == TINY_MODEL:
+        model_path = create_tiny_model(
+            os.path.join(tempfile.gettempdir(), f"nanovllm-tiny-{args.seed}"), seed=args.seed
+        )
+        
+    texts = DEFAULT_EVAL_TEXTS
+    if args.eval_file is not None:
+        with open(args.eval_file) as f:
+            texts = [line.strip() for line in f if line.strip()]
+            
+    print("=" * 60)
+    print("🔥 nano-vLLM Quantization Evaluation")
+    print("=" * 60)
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    results = []
+    for mode in args.quantization:
+        # Fresh full-precision copy per mode: quantization is in place
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path, torch_dtype=getattr(torch, args.dtype), trust_remote_code=True
+        ).to(args.device).eval()
+        print(f"📊 Evaluating {mode} on {len(texts)} texts...")
+        results.append(compare_quantization(
+            model, tokenizer, mode, args.group_size, texts=texts, max_length=args.max_length
+        ))
+        del model
+        
+    print_quantization_results(results)
+    
+    if args.output is not None:
+        report = {
+            'model': args.model,
+            'dtype': args.dtype,
+            'device': args.device,
+            'num_eval_texts': len(texts),
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
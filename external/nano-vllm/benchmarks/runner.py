@@ -0,0 +1,164 @@
+"""
+Online benchmark runner for nano-vLLM
+Replays a workload against the continuous-batching engine and measures real token latencies
+"""
+
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from nanovllm import LLM, SamplingParams
+from .workload import BenchmarkRequest
+
+PERCENTILES = (50, 90, 95, 99)
+
+@dataclass
+class RequestResult:
+    """Measured timings of one benchmark request"""
+    prompt_len: int
+    output_len: int = 0
+    arrival_time: float = 0.0
+    token_times: List[float] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+    
+    @property
+    def ttft(self) -> float:
+        return self.token_times[0] - self.arrival_time
+        
+    @property
+    def e2e_latency(self) -> float:
+        return self.token_times[-1] - self.arrival_time
+        
+    @property
+    def itls(self) -> List[float]:
+        return [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+        
+    @property
+    def tpot(self) -> float:
+        """Mean time per output token after the first"""
+        if len(self.token_times) < 2:
+            return 0.0
+        return (self.token_times[-1] - self.token_times[0]) / (len(self.token_times) - 1)
+
+def percentile(values: List[float], q: float) -> float:
+    """Linearly interpolated percentile (q in [0, 100])"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Mean and percentiles of a latency sample, in milliseconds"""
+    summary = {'mean_ms': 1000 * sum(values) / len(values) if values else 0.0}
+    for q in PERCENTILES:
+        summary[f'p{q}_ms'] = 1000 * percentile(values, q)
+    return summary
+
+def run_benchmark(
+    llm: LLM,
+    requests: List[BenchmarkRequest],
+    temperature: float = 0.0,
+    slo_ttft: float = 1.0,
+    slo_tpot: float = 0.1
+) -> Dict[str, Any]:
+    """
+    Replay requests at their arrival times against llm.engine
+    
+    Requests are added when their arrival time passes, the engine is stepped
+    in between, and a timestamp is taken for every generated token. EOS is
+    suppressed until each request's output_len (min_tokens == max_tokens) so
+    output lengths follow the workload.
+    
+    Args:
+        llm: Engine under test
+        requests: Workload sorted by arrival_time
+        temperature: Sampling temperature for all requests
+        slo_ttft: Time-to-first-token SLO in seconds for goodput
+        slo_tpot: Time-per-output-token SLO in seconds for goodput
+        
+    Returns:
+        JSON-serializable summary
+    """
+    engine = llm.engine
+    pending = sorted(requests, key=lambda request: request.arrival_time)
+    results: Dict[int, RequestResult] = {}
+    seqs = []
+    next_request = 0
+    
+    start = time.time()
+    while next_request < len(pending) or engine.has_unfinished_requests():
+        now = time.time()
+        while next_request < len(pending) and start + pending[next_request].arrival_time <= now:
+            request = pending[next_request]
+            sampling_params = SamplingParams(
+                temperature=temperature,
+                max_tokens=request.output_len,
+                min_tokens=request.output_len
+            )
+            seq = engine.add_request(
+                request.prompt, sampling_params, request.prompt_token_ids,
+                arrival_time=start + request.arrival_time
+            )
+            results[seq.seq_id] = RequestResult(request.prompt_len, arrival_time=seq.arrival_time)
+            seqs.append(seq)
+            next_request += 1
+            
+        if not engine.has_unfinished_requests():
+            time.sleep(max(0.0, start + pending[next_request].arrival_time - time.time()))
+            continue
+            
+        stepped = engine.step()
+        step_end = time.time()
+        for seq in stepped:
+            result = results[seq.seq_id]
+            new_tokens = len(seq.output_token_ids) - result.output_len
+            result.token_times.extend([step_end] * new_tokens)
+            result.output_len = len(seq.output_token_ids)
+            
+    duration = time.time() - start
+    for seq in seqs:
+        results[seq.seq_id].finish_reason = seq.finish_reason
+        
+    completed = [result for result in results.values() if result.token_times]
+    good = [result for result in completed if result.ttft <= slo_ttft and result.tpot <= slo_tpot]
+    total_input = sum(result.prompt_len for result in results.values())
+    total_output = sum(result.output_len for result in results.values())
+    
+    return {
+        'num_requests': len(requests),
+        'completed': len(completed),
+        'duration_s': duration,
+        'total_input_tokens': total_input,
+        'total_output_tokens': total_output,
+        'request_throughput': len(completed) / duration,
+        'output_throughput': total_output / duration,
+        'total_token_throughput': (total_input + total_output) / duration,
+        'ttft': summarize([result.ttft for result in completed]),
+        'tpot': summarize([result.tpot for result in completed if result.output_len > 1]),
+        'itl': summarize([itl for result in completed for itl in result.itls]),
+        'e2e_latency': summarize([result.e2e_latency for result in completed]),
+        'goodput': {
+            'slo_ttft_ms': 1000 * slo_ttft,
+            'slo_tpot_ms': 1000 * slo_tpot,
+            'requests_within_slo': len(good),
+            'slo_attainment': len(good) / len(completed) if completed else 0.0,
+            'request_goodput': len(good) / duration,
+            'token_goodput': sum(result.output_len for result in good) / duration
+        },
+        'scheduler': llm.get_scheduler_stats(),
+        'cache': _cache_summary(llm)
+    }
+
+def _cache_summary(llm: LLM) -> Dict[str, Any]:
+    """JSON-friendly subset of LLM.get_cache_stats()"""
+    stats = llm.get_cache_stats()
+    summary = {'kv_cache_blocks': stats['kv_cache_blocks']}
+    if 'cache_efficiency' in stats:
+        summary['prefix_cache'] = stats['cache_efficiency']
+    speculative = llm.get_speculative_stats()
+    if speculative:
+        summary['speculative'] = speculative
+    return summary
@@ -0,0 +1,124 @@
+"""
+Tensor-parallel equivalence check
+
+Runs the same greedy requests single-process and with tensor parallelism
+(worker processes over gloo when there is no GPU per rank) and compares the
+generated tokens.
+
+Usage:
+    python -m benchmarks.tensor_parallel --model tiny --tensor-parallel-size 2
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from .tiny_model import create_tiny_model
+
+TINY_MODEL = "tiny"
+
+DEFAULT_PROMPTS = [
+    "The capital of France is",
+    "def quicksort(items):",
+    "Once upon a time, in a small village,",
+    "1, 2, 3, 5, 8, 13,"
+]
+
+def _generate_token_ids(llm, prompts: List[str], max_tokens: int) -> List[List[int]]:
+    """Greedy output token IDs of each prompt, EOS suppressed until max_tokens"""
+    from nanovllm import SamplingParams
+    
+    sampling_params = SamplingParams(temperature=0.0, max_tokens=max_tokens, min_tokens=max_tokens)
+    seqs = [llm.engine.add_request(prompt, sampling_params) for prompt in prompts]
+    while llm.engine.has_unfinished_requests():
+        llm.engine.step()
+    return [list(seq.output_token_ids) for seq in seqs]
+
+def compare_tensor_parallel(
+    model_path: str,
+    tensor_parallel_size: int,
+    prompts: List[str],
+    max_tokens: int = 32,
+    **llm_kwargs
+) -> Dict[str, Any]:
+    """
+    Generate with tensor_parallel_size=1 and tensor_parallel_size, then compare
+    
+    Returns:
+        Token agreement, the first diverging position of each prompt (None if
+        identical) and the wall time of both runs
+    """
+    from nanovllm import LLM
+    
+    results = {}
+    outputs = {}
+    for size in (1, tensor_parallel_size):
+        llm = LLM(model_path, tensor_parallel_size=size, **llm_kwargs)
+        start = time.time()
+        outputs[size] = _generate_token_ids(llm, prompts, max_tokens)
+        results[f'time_tp{size}_s'] = time.time() - start
+        llm.close()
+        
+    divergence = []
+    num_matching = num_tokens = 0
+    for reference, parallel in zip(outputs[1], outputs[tensor_parallel_size]):
+        position = next((i for i, (a, b) in enumerate(zip(reference, parallel)) if a != b), None)
+        if position is None and len(reference) != len(parallel):
+            position = min(len(reference), len(parallel))
+        divergence.append(position)
+        num_matching += position if position is not None else len(reference)
+        num_tokens += len(reference)
+        
+    results.update({
+        'tensor_parallel_size': tensor_parallel_size,
+        'num_prompts': len(prompts),
+        'token_agreement': num_matching / num_tokens if num_tokens else 1.0,
+        'identical': all(position is None for position in divergence),
+        'first_divergence': divergence
+    })
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="nano-vLLM tensor-parallel equivalence check")
+    parser.add_argument("--model", default=TINY_MODEL, help=f"Model path, or '{TINY_MODEL}' for a random-weight CPU model")
+    parser.add_argument("--tensor-parallel-size", type=int, default=2)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--max-model-len", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results JSON to this path")
+    args = parser.parse_args(argv)
+    
+    model_path = args.model
+    if args.model == TINY_MODEL:
+        model_path = create_tiny_model(
+            os.path.join(tempfile.gettempdir(), f"nanovllm-tiny-{args.seed}"), seed=args.seed
+        )
+        
+    print("=" * 60)
+    print("🔥 nano-vLLM Tensor-Parallel Equivalence")
+    print("=" * 60)
+    
+    results = compare_tensor_parallel(
+        model_path, args.tensor_parallel_size, DEFAULT_PROMPTS,
+        max_tokens=args.max_tokens,
+        max_model_len=args.max_model_len,
+        max_num_kv_tokens=len(DEFAULT_PROMPTS) * args.max_model_len
+    )
+    
+    print(f"Token Agreement: {results['token_agreement'] * 100:.1f}% over {results['num_prompts']} prompts")
+    print(f"Identical Outputs: {results['identical']}")
+    print(
+        f"Time: {results['time_tp1_s']:.2f}s single-process, "
+        f"{results[f'time_tp{args.tensor_parallel_size}_s']:.2f}s with {args.tensor_parallel_size} ranks"
+    )
+    
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'model': args.model, 'results': results}, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
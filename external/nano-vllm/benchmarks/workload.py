@@ -0,0 +1,146 @@
+"""
+Benchmark workloads for nano-vLLM
+Synthesizes Poisson-arrival requests with shared prefixes, or replays them from JSONL
+"""
+
+import json
+import random
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Sequence as SequenceType, Tuple
+
+@dataclass
+class BenchmarkRequest:
+    """One request of a workload"""
+    arrival_time: float
+    prompt_token_ids: List[int]
+    output_len: int
+    prompt: str = ""
+    
+    @property
+    def prompt_len(self) -> int:
+        return len(self.prompt_token_ids)
+
+@dataclass
+class WorkloadConfig:
+    """
+    Parameters of a synthetic workload
+    
+    Args:
+        num_requests: Number of requests
+        input_length_range: Inclusive [min, max] prompt length in tokens
+        output_length_range: Inclusive [min, max] generated tokens per request
+        request_rate: Mean arrivals per second (Poisson); inf sends all at t=0
+        shared_prefix_ratio: Fraction of each prompt taken from a shared prefix
+        num_shared_prefixes: Number of distinct shared prefixes
+        seed: Random seed
+    """
+    num_requests: int = 256
+    input_length_range: Tuple[int, int] = (100, 1024)
+    output_length_range: Tuple[int, int] = (100, 1024)
+    request_rate: float = float('inf')
+    shared_prefix_ratio: float = 0.0
+    num_shared_prefixes: int = 1
+    seed: int = 0
+    
+    def __post_init__(self):
+        self.input_length_range = tuple(self.input_length_range)
+        self.output_length_range = tuple(self.output_length_range)
+        if not 0.0 <= self.shared_prefix_ratio <= 1.0:
+            raise ValueError("shared_prefix_ratio must be between 0 and 1")
+        if self.request_rate <= 0:
+            raise ValueError("request_rate must be positive")
+        if self.num_shared_prefixes < 1:
+            raise ValueError("num_shared_prefixes must be at least 1")
+
+def load_benchmark_config(config_path: str) -> Dict[str, Any]:
+    """Read performance.benchmarks from the project config.yaml"""
+    import yaml
+    
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+        
+    benchmarks = config.get('performance', {}).get('benchmarks', {}) or {}
+    overrides = {}
+    if 'test_sequences' in benchmarks:
+        overrides['num_requests'] = int(benchmarks['test_sequences'])
+    if 'input_length_range' in benchmarks:
+        overrides['input_length_range'] = tuple(benchmarks['input_length_range'])
+    if 'output_length_range' in benchmarks:
+        overrides['output_length_range'] = tuple(benchmarks['output_length_range'])
+    if 'baseline_model' in benchmarks:
+        overrides['model'] = benchmarks['baseline_model']
+    return overrides
+
+def synthesize_workload(
+    config: WorkloadConfig,
+    vocab_size: int,
+    special_token_ids: SequenceType[int] = ()
+) -> List[BenchmarkRequest]:
+    """
+    Generate random token prompts with Poisson arrivals
+    
+    Prompt lengths and output lengths are drawn uniformly from their ranges.
+    The first shared_prefix_ratio of each prompt is the head of one of
+    num_shared_prefixes fixed random prefixes, so prefix caching sees a
+    controlled amount of reuse.
+    """
+    rng = random.Random(config.seed)
+    special = set(special_token_ids)
+    token_pool = [token for token in range(vocab_size) if token not in special]
+    
+    def random_tokens(n: int) -> List[int]:
+        return [rng.choice(token_pool) for _ in range(n)]
+        
+    max_input = config.input_length_range[1]
+    prefixes = [random_tokens(max_input) for _ in range(config.num_shared_prefixes)]
+    
+    requests = []
+    arrival_time = 0.0
+    for _ in range(config.num_requests):
+        prompt_len = rng.randint(*config.input_length_range)
+        output_len = rng.randint(*config.output_length_range)
+        
+        shared_len = int(prompt_len * config.shared_prefix_ratio)
+        prefix = rng.choice(prefixes)[:shared_len]
+        prompt_token_ids = prefix + random_tokens(prompt_len - shared_len)
+        
+        requests.append(BenchmarkRequest(arrival_time, prompt_token_ids, output_len))
+        if config.request_rate != float('inf'):
+            arrival_time += rng.expovariate(config.request_rate)
+            
+    return requests
+
+def save_workload(requests: List[BenchmarkRequest], path: str):
+    """Write a workload as JSONL so it can be replayed"""
+    with open(path, 'w') as f:
+        for request in requests:
+            f.write(json.dumps(asdict(request)) + "\n")
+
+def load_workload(path: str, tokenizer=None) -> List[BenchmarkRequest]:
+    """
+    Read a JSONL workload
+    
+    Each line needs arrival_time and output_len, plus prompt_token_ids or a
+    prompt string (tokenized with tokenizer).
+    """
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            prompt = record.get('prompt', "")
+            prompt_token_ids = record.get('prompt_token_ids')
+            if prompt_token_ids is None:
+                if tokenizer is None:
+                    raise ValueError("Workload has text prompts but no tokenizer was given")
+                prompt_token_ids = tokenizer.encode(prompt)
+            requests.append(BenchmarkRequest(
+                arrival_time=float(record.get('arrival_time', 0.0)),
+                prompt_token_ids=list(prompt_token_ids),
+                output_len=int(record['output_len']),
+                prompt=prompt
+            ))
+            
+    requests.sort(key=lambda request: request.arrival_time)
+    return requests
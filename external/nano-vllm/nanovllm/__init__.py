@@ -5,9 +5,16 @@ nano-vLLM: A lightweight vLLM implementation built from scratch
 Core components:
 - LLM: Main inference engine
 - SamplingParams: Sampling configuration
-- Model loading and management
+- LLMEngine / Scheduler: Continuous batching
+- Model loading and management, multi-model serving
 - KV cache optimization
 - Tensor parallelism support
+- Speculative decoding
+- Weight-only quantization
+- Parallel tokenization and incremental detokenization
+- Stop strings and regex / JSON schema constrained decoding
+- On-disk result cache for deterministic requests
+- Compiled decode with padded batch-size buckets
 """
 
 from .llm import LLM
@@ -15,6 +22,22 @@ from .sampling_params import SamplingParams
 from .model_manager import ModelManager
 from .cache_manager import KVCacheManager
 from .optimizations import PrefixCache, TensorParallel
+from .sequence import Sequence, SequenceStatus
+from .scheduler import Scheduler
+from .engine import LLMEngine
+from .sampler import Sampler
+from .metrics import StatsRecorder, StepStats
+from .multi_model import MultiModelLLM
+from .loader import ArtifactCache, StartupTimer
+from .speculative import NgramProposer, DraftModelProposer, SpeculativeDecoder
+from .quantization import QuantizedLinear, quantize_model, compare_quantization
+from .tokenization import TokenizerPool, IncrementalDetokenizer
+from .tensor_parallel import TensorParallelWorkers, shard_model
+from .kv_offload import KVSwapper, PersistentPrefixStore
+from .stop_strings import StopStringDetokenizer
+from .constrained import GuideCompiler, json_schema_to_regex
+from .result_cache import ResultCache
+from .compilation import CompiledDecoder
 
 __version__ = "0.1.0"
 __author__ = "GeeeekExplorer"
@@ -25,5 +48,32 @@ __all__ = [
     "ModelManager",
     "KVCacheManager",
     "PrefixCache",
-    "TensorParallel"
+    "TensorParallel",
+    "Sequence",
+    "SequenceStatus",
+    "Scheduler",
+    "LLMEngine",
+    "Sampler",
+    "StatsRecorder",
+    "StepStats",
+    "MultiModelLLM",
+    "ArtifactCache",
+    "StartupTimer",
+    "NgramProposer",
+    "DraftModelProposer",
+    "SpeculativeDecoder",
+    "QuantizedLinear",
+    "quantize_model",
+    "compare_quantization",
+    "TokenizerPool",
+    "IncrementalDetokenizer",
+    "TensorParallelWorkers",
+    "shard_model",
+    "KVSwapper",
+    "PersistentPrefixStore",
+    "StopStringDetokenizer",
+    "GuideCompiler",
+    "json_schema_to_regex",
+    "ResultCache",
+    "CompiledDecoder"
 ]
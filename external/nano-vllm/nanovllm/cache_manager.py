@@ -1,117 +1,407 @@
 """
 KV Cache management for nano-vLLM
-Optimizes memory usage and speeds up inference
+Paged block allocator that bounds KV memory and lets sequences share blocks
 """
 
+import os
 import torch
-from typing import Dict, Tuple, Optional
-import hashlib
+from collections import deque
+from typing import Dict, List, Tuple, Optional
 
 class KVCacheManager:
     """
-    Manages Key-Value cache for transformer models
+    Block-based Key-Value cache for transformer models
     
     Features:
-    - Dynamic cache allocation
-    - Memory-efficient storage
-    - Cache reuse across requests
+    - Fixed pool preallocated from a memory budget
+    - Fixed-size token blocks with per-sequence block tables
+    - O(1) block allocation and free
+    - Reference-counted blocks with copy-on-write for forked sequences
+    
+    The pool is laid out as [num_layers, 2, num_blocks + 1, block_size,
+    num_kv_heads, head_dim]. The extra last block is kept zeroed and is used
+    as the padding slot when gathering sequences of different lengths.
     """
     
-    def __init__(self, max_cache_size: int = 1000):
-        self.max_cache_size = max_cache_size
-        self.cache_storage: Dict[str, Tuple[torch.Tensor, torch.Tensor]] = {}
-        self.cache_usage_count: Dict[str, int] = {}
-        self.total_hits = 0
-        self.total_requests = 0
-        
-    def get_cache_key(self, input_ids: torch.Tensor) -> str:
-        """Generate cache key from input token IDs"""
-        # Use hash of input_ids as cache key
-        ids_str = str(input_ids.cpu().tolist())
-        return hashlib.md5(ids_str.encode()).hexdigest()
-        
-    def get_cached_kv(self, cache_key: str) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
-        """Retrieve cached key-value pairs"""
-        self.total_requests += 1
-        
-        if cache_key in self.cache_storage:
-            self.total_hits += 1
-            self.cache_usage_count[cache_key] += 1
-            return self.cache_storage[cache_key]
+    def __init__(
+        self,
+        num_blocks: int,
+        num_layers: int,
+        num_kv_heads: int,
+        head_dim: int,
+        block_size: int = 16,
+        dtype: torch.dtype = torch.float16,
+        device: Optional[torch.device] = None
+    ):
+        self.num_blocks = num_blocks
+        self.num_layers = num_layers
+        self.num_kv_heads = num_kv_heads
+        self.head_dim = head_dim
+        self.block_size = block_size
+        self.dtype = dtype
+        self.device = device or torch.device('cpu')
+        
+        self.kv_pool = torch.empty(
+            (num_layers, 2, num_blocks + 1, block_size, num_kv_heads, head_dim),
+            dtype=dtype, device=self.device
+        )
+        self.null_block = num_blocks
+        self.kv_pool[:, :, self.null_block].zero_()
+        # Flat per-slot view: slot = block_id * block_size + offset
+        self.kv_slots = self.kv_pool.view(
+            num_layers, 2, (num_blocks + 1) * block_size, num_kv_heads, head_dim
+        )
+        
+        self.free_blocks = deque(range(num_blocks))
+        self.ref_counts: List[int] = [0] * num_blocks
+        self.block_tables: Dict[int, List[int]] = {}
+        self.seq_lens: Dict[int, int] = {}
+        
+        self.total_allocations = 0
+        self.total_cow_copies = 0
+        # Slots read back by get_gather_slots, padding included
+        self.total_gathered_slots = 0
+        # Block copies made since the last drain, when tracked (None: not tracked)
+        self.block_copies: Optional[List[Tuple[int, int]]] = None
+        
+    @staticmethod
+    def get_kv_shape(config, tensor_parallel_size: int = 1) -> Tuple[int, int, int]:
+        """Return (num_layers, num_kv_heads, head_dim) from a model config, per tensor-parallel rank"""
+        num_layers = config.num_hidden_layers
+        num_heads = config.num_attention_heads
+        num_kv_heads = getattr(config, 'num_key_value_heads', None) or num_heads
+        head_dim = getattr(config, 'head_dim', None) or config.hidden_size // num_heads
+        return num_layers, num_kv_heads // tensor_parallel_size, head_dim
+        
+    @classmethod
+    def get_block_bytes(
+        cls,
+        config,
+        block_size: int,
+        dtype: torch.dtype,
+        tensor_parallel_size: int = 1
+    ) -> int:
+        """Bytes needed by one block across all layers (on one tensor-parallel rank)"""
+        num_layers, num_kv_heads, head_dim = cls.get_kv_shape(config, tensor_parallel_size)
+        element_size = torch.tensor([], dtype=dtype).element_size()
+        return 2 * num_layers * block_size * num_kv_heads * head_dim * element_size
+        
+    @classmethod
+    def from_model(
+        cls,
+        model: torch.nn.Module,
+        block_size: int = 16,
+        memory_utilization: float = 0.8,
+        max_num_tokens: Optional[int] = None,
+        tensor_parallel_size: int = 1
+    ) -> 'KVCacheManager':
+        """
+        Size a block pool for a loaded model
+        
+        The pool takes what is left of memory_utilization of the device
+        (or host RAM on CPU) after the weights, capped at max_num_tokens.
+        With tensor parallelism the model is this rank's shard and the pool
+        holds this rank's KV heads.
+        """
+        param = next(model.parameters())
+        num_layers, num_kv_heads, head_dim = cls.get_kv_shape(model.config, tensor_parallel_size)
+        block_bytes = cls.get_block_bytes(model.config, block_size, param.dtype, tensor_parallel_size)
+        
+        if param.device.type == 'cuda':
+            free_bytes, total_bytes = torch.cuda.mem_get_info(param.device)
+            budget = total_bytes * memory_utilization - (total_bytes - free_bytes)
+        else:
+            total_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+            model_bytes = sum(
+                t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers())
+            )
+            budget = total_bytes * memory_utilization - model_bytes
             
-        return None
+        num_blocks = int(budget // block_bytes)
+        if max_num_tokens is not None:
+            num_blocks = min(num_blocks, -(-max_num_tokens // block_size))
+            
+        if num_blocks <= 0:
+            raise ValueError(
+                f"Not enough memory for the KV cache: budget {budget / 1024**2:.0f} MB, "
+                f"block size {block_bytes / 1024**2:.2f} MB"
+            )
+            
+        return cls(
+            num_blocks,
+            num_layers,
+            num_kv_heads,
+            head_dim,
+            block_size=block_size,
+            dtype=param.dtype,
+            device=param.device
+        )
+        
+    def get_num_free_blocks(self) -> int:
+        """Number of unallocated blocks"""
+        return len(self.free_blocks)
+        
+    def get_num_required_blocks(self, num_tokens: int) -> int:
+        """Blocks needed to hold num_tokens tokens"""
+        return -(-num_tokens // self.block_size)
+        
+    def can_allocate(self, num_tokens: int, num_prefix_blocks: int = 0) -> bool:
+        """Whether a new sequence of num_tokens tokens fits"""
+        num_new_blocks = self.get_num_required_blocks(num_tokens) - num_prefix_blocks
+        return num_new_blocks <= len(self.free_blocks)
+        
+    def _allocate_block(self) -> int:
+        """Pop a free block and give it one reference"""
+        block_id = self.free_blocks.popleft()
+        self.ref_counts[block_id] = 1
+        self.total_allocations += 1
+        return block_id
+        
+    def allocate_block(self) -> int:
+        """Take a free block held outside any block table (e.g. by the prefix cache)"""
+        return self._allocate_block()
+        
+    def acquire_block(self, block_id: int):
+        """Add a reference to an allocated block"""
+        self.ref_counts[block_id] += 1
+        
+    def release_block(self, block_id: int):
+        """Drop one reference and recycle the block when unused"""
+        self.ref_counts[block_id] -= 1
+        if self.ref_counts[block_id] == 0:
+            self.free_blocks.append(block_id)
+            
+    def allocate(self, seq_id: int, num_tokens: int, prefix_blocks: Optional[List[int]] = None):
+        """
+        Allocate a block table with room for num_tokens tokens
+        
+        Args:
+            seq_id: Sequence to allocate for
+            num_tokens: Total number of token slots needed
+            prefix_blocks: Already-filled full blocks (e.g. from the prefix
+                cache) to share as the start of the table
+        """
+        if seq_id in self.block_tables:
+            raise ValueError(f"Sequence {seq_id} already has a block table")
+            
+        prefix_blocks = prefix_blocks or []
+        if not self.can_allocate(num_tokens, len(prefix_blocks)):
+            raise RuntimeError("Out of KV cache blocks")
+            
+        for block_id in prefix_blocks:
+            self.acquire_block(block_id)
+            
+        num_new_blocks = self.get_num_required_blocks(num_tokens) - len(prefix_blocks)
+        self.block_tables[seq_id] = list(prefix_blocks) + [
+            self._allocate_block() for _ in range(num_new_blocks)
+        ]
+        self.seq_lens[seq_id] = num_tokens
+        
+    def get_num_append_blocks(self, seq_id: int) -> int:
+        """Blocks append_slot would need: a new block or a copy-on-write copy"""
+        seq_len = self.seq_lens[seq_id]
+        if seq_len % self.block_size == 0:
+            return 1
+        last_block = self.block_tables[seq_id][-1]
+        return 1 if self.ref_counts[last_block] > 1 else 0
+        
+    def append_slot(self, seq_id: int) -> int:
+        """
+        Reserve the slot for the next token of a sequence
+        
+        Copies the last block first if it is shared with another sequence.
+        
+        Returns:
+            Flat slot index of the reserved position
+        """
+        block_table = self.block_tables[seq_id]
+        seq_len = self.seq_lens[seq_id]
         
-    def store_kv(self, cache_key: str, key_states: torch.Tensor, value_states: torch.Tensor):
-        """Store key-value pairs in cache"""
-        # Check cache size limit
-        if len(self.cache_storage) >= self.max_cache_size:
-            self._evict_least_used()
+        if seq_len % self.block_size == 0:
+            block_table.append(self._allocate_block())
+        elif self.ref_counts[block_table[-1]] > 1:
+            # Copy-on-write: this sequence is about to diverge from its fork
+            shared_block = block_table[-1]
+            new_block = self._allocate_block()
+            self.copy_block(shared_block, new_block)
+            self.release_block(shared_block)
+            block_table[-1] = new_block
+            self.total_cow_copies += 1
             
-        self.cache_storage[cache_key] = (key_states.clone(), value_states.clone())
-        self.cache_usage_count[cache_key] = 1
+        self.seq_lens[seq_id] = seq_len + 1
+        return self.get_slot(seq_id, seq_len)
         
-    def _evict_least_used(self):
-        """Evict least recently used cache entry"""
-        if not self.cache_storage:
+    def copy_block(self, src_block: int, dst_block: int):
+        """Copy one block's keys and values into another block"""
+        self.kv_pool[:, :, dst_block].copy_(self.kv_pool[:, :, src_block])
+        if self.block_copies is not None:
+            self.block_copies.append((src_block, dst_block))
+            
+    def trim(self, seq_id: int, num_tokens: int):
+        """Shrink a sequence to its first num_tokens slots, freeing trailing blocks"""
+        block_table = self.block_tables[seq_id]
+        num_blocks = self.get_num_required_blocks(num_tokens)
+        while len(block_table) > num_blocks:
+            self.release_block(block_table.pop())
+        self.seq_lens[seq_id] = num_tokens
+        
+    def fork(self, parent_seq_id: int, child_seq_id: int):
+        """Share all blocks of a parent sequence with a new child sequence"""
+        block_table = self.block_tables[parent_seq_id]
+        for block_id in block_table:
+            self.acquire_block(block_id)
+            
+        self.block_tables[child_seq_id] = list(block_table)
+        self.seq_lens[child_seq_id] = self.seq_lens[parent_seq_id]
+        
+    def free(self, seq_id: int):
+        """Release all blocks held by a sequence"""
+        block_table = self.block_tables.pop(seq_id, None)
+        self.seq_lens.pop(seq_id, None)
+        if block_table is None:
             return
             
-        # Find least used entry
-        least_used_key = min(self.cache_usage_count.items(), key=lambda x: x[1])[0]
+        for block_id in block_table:
+            self.release_block(block_id)
+            
+    def has_sequence(self, seq_id: int) -> bool:
+        """Whether a sequence currently holds blocks"""
+        return seq_id in self.block_tables
         
-        # Remove from cache
-        del self.cache_storage[least_used_key]
-        del self.cache_usage_count[least_used_key]
+    def get_slot(self, seq_id: int, position: int) -> int:
+        """Flat slot index of a token position within a sequence"""
+        block_id = self.block_tables[seq_id][position // self.block_size]
+        return block_id * self.block_size + position % self.block_size
         
-    def clear_cache(self):
-        """Clear all cached data"""
-        self.cache_storage.clear()
-        self.cache_usage_count.clear()
+    def get_slots(self, seq_id: int, start: int, end: int) -> List[int]:
+        """Flat slot indices for positions [start, end) of a sequence"""
+        block_table = self.block_tables[seq_id]
+        block_size = self.block_size
+        return [
+            block_table[position // block_size] * block_size + position % block_size
+            for position in range(start, end)
+        ]
+        
+    def write(self, slots: torch.Tensor, keys: torch.Tensor, values: torch.Tensor):
+        """
+        Store keys and values into the given slots
+        
+        Args:
+            slots: Flat slot indices of shape [num_tokens]
+            keys: Tensor of shape [num_layers, num_tokens, num_kv_heads, head_dim]
+            values: Tensor of the same shape as keys
+        """
+        self.kv_slots[:, 0, slots] = keys.to(self.dtype)
+        self.kv_slots[:, 1, slots] = values.to(self.dtype)
+        
+    def gather(self, seq_ids: List[int], lengths: List[int], max_len: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Read the first lengths[i] tokens of each sequence into a padded batch
+        
+        Sequences are right-aligned; padding positions read the zeroed null
+        block.
+        
+        Returns:
+            (keys, values), each of shape [num_layers, batch, num_kv_heads, max_len, head_dim]
+        """
+        return self.gather_slots(self.get_gather_slots(seq_ids, lengths, max_len))
+        
+    def get_gather_slots(self, seq_ids: List[int], lengths: List[int], max_len: int) -> torch.Tensor:
+        """
+        Right-aligned slot indices of shape [batch, max_len]; padding points at the null block
+        
+        Each sequence's whole KV history is listed, so a decode step copies
+        O(batch x context) slots out of the pool. This is the price of
+        running HF attention on dense past_key_values rather than a paged
+        attention kernel; total_gathered_slots counts it.
+        """
+        self.total_gathered_slots += len(seq_ids) * max_len
+        null_slot = self.null_block * self.block_size
+        slot_rows = []
+        for seq_id, length in zip(seq_ids, lengths):
+            slot_rows.append([null_slot] * (max_len - length) + self.get_slots(seq_id, 0, length))
+        return torch.tensor(slot_rows, dtype=torch.long, device=self.device)
+        
+    def gather_slots(self, slots: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Read the given slots into a batch
         
-        # Free GPU memory
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        Args:
+            slots: Slot indices of shape [batch, max_len]
             
+        Returns:
+            (keys, values), each of shape [num_layers, batch, num_kv_heads, max_len, head_dim]
+        """
+        batch_size, max_len = slots.shape
+        kv = self.kv_slots.index_select(2, slots.reshape(-1))
+        kv = kv.view(self.num_layers, 2, batch_size, max_len, self.num_kv_heads, self.head_dim)
+        kv = kv.permute(0, 1, 2, 4, 3, 5).contiguous()
+        return kv[:, 0], kv[:, 1]
+        
+    def get_utilization(self) -> float:
+        """Fraction of blocks in use"""
+        return 1.0 - len(self.free_blocks) / max(self.num_blocks, 1)
+        
+    def clear_cache(self):
+        """Release every block table (any PrefixCache on this pool must be cleared too)"""
+        self.block_tables.clear()
+        self.seq_lens.clear()
+        self.ref_counts = [0] * self.num_blocks
+        self.free_blocks = deque(range(self.num_blocks))
+        
     def get_cache_stats(self) -> Dict[str, float]:
         """Get cache performance statistics"""
-        hit_rate = self.total_hits / max(self.total_requests, 1)
-        memory_usage = self._calculate_memory_usage()
+        used_blocks = self.num_blocks - len(self.free_blocks)
+        shared_blocks = sum(1 for count in self.ref_counts if count > 1)
         
         return {
-            'hit_rate': hit_rate,
-            'total_entries': len(self.cache_storage),
-            'max_entries': self.max_cache_size,
-            'memory_usage_mb': memory_usage,
-            'total_hits': self.total_hits,
-            'total_requests': self.total_requests
+            'num_blocks': self.num_blocks,
+            'block_size': self.block_size,
+            'used_blocks': used_blocks,
+            'free_blocks': len(self.free_blocks),
+            'shared_blocks': shared_blocks,
+            'utilization': self.get_utilization(),
+            'num_sequences': len(self.block_tables),
+            'memory_usage_mb': self.get_memory_usage(),
+            'pool_size_mb': self._block_bytes() * self.num_blocks / (1024 * 1024),
+            'total_allocations': self.total_allocations,
+            'total_cow_copies': self.total_cow_copies,
+            'total_gathered_slots': self.total_gathered_slots
         }
         
-    def _calculate_memory_usage(self) -> float:
-        """Calculate memory usage of cached tensors in MB"""
-        total_bytes = 0
-        
-        for key_tensor, value_tensor in self.cache_storage.values():
-            total_bytes += key_tensor.element_size() * key_tensor.numel()
-            total_bytes += value_tensor.element_size() * value_tensor.numel()
-            
-        return total_bytes / (1024 * 1024)  # Convert to MB
+    def _block_bytes(self) -> int:
+        """Bytes used by one block across all layers"""
+        return self.kv_pool[:, :, 0].numel() * self.kv_pool.element_size()
         
     def get_memory_usage(self) -> float:
-        """Get current memory usage in MB"""
-        return self._calculate_memory_usage()
+        """Get memory held by allocated blocks in MB"""
+        used_blocks = self.num_blocks - len(self.free_blocks)
+        return used_blocks * self._block_bytes() / (1024 * 1024)
+
+def to_legacy_cache(past_key_values) -> Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]]:
+    """Convert a HuggingFace cache into a tuple of (key, value) per layer"""
+    if past_key_values is None:
+        return None
         
-    def optimize_cache(self):
-        """Optimize cache by removing unused entries"""
-        # Remove entries with very low usage
-        min_usage_threshold = max(1, self.total_requests // 100)
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        return past_key_values.to_legacy_cache()
         
-        keys_to_remove = [
-            key for key, usage in self.cache_usage_count.items()
-            if usage < min_usage_threshold
-        ]
+    if hasattr(past_key_values, 'layers'):
+        return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+        
+    return tuple((layer[0], layer[1]) for layer in past_key_values)
+
+def from_legacy_cache(legacy_cache):
+    """Wrap legacy (key, value) tuples in the cache type the model expects"""
+    if legacy_cache is None:
+        return None
+        
+    try:
+        from transformers.cache_utils import DynamicCache
+    except ImportError:
+        return legacy_cache
+        
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(legacy_cache)
         
-        for key in keys_to_remove:
-            if key in self.cache_storage:
-                del self.cache_storage[key]
-                del self.cache_usage_count[key]
-                
-        print(f"🧹 Cache optimized: removed {len(keys_to_remove)} entries")
+    return DynamicCache(legacy_cache)
@@ -0,0 +1,278 @@
+"""
+Compiled decode for nano-vLLM
+Runs decode steps through torch.compile graphs specialized to padded batch-size and KV-length buckets
+"""
+
+import bisect
+import os
+import time
+import torch
+import torch.nn as nn
+from typing import Dict, List, Optional, Tuple
+
+from .sequence import Sequence
+from .cache_manager import KVCacheManager, from_legacy_cache
+from .model_runner import stack_cache
+
+def configure_compile_cache(cache_dir: str) -> str:
+    """
+    Keep inductor's compiled graphs and kernels on disk under cache_dir
+    
+    An explicit TORCHINDUCTOR_CACHE_DIR is left alone. Must run before the
+    first compilation in the process.
+    
+    Returns:
+        Directory holding the compiled artifacts
+    """
+    path = os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(cache_dir, "inductor"))
+    os.makedirs(path, exist_ok=True)
+    
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+    if hasattr(inductor_config, 'autotune_local_cache'):
+        inductor_config.autotune_local_cache = True
+    return path
+
+def get_batch_buckets(max_num_seqs: int) -> List[int]:
+    """Padded batch sizes: 1, 2, 4, 8, then every multiple of 8 up to max_num_seqs"""
+    buckets = [size for size in (1, 2, 4) if size < max_num_seqs]
+    buckets += list(range(8, max_num_seqs, 8))
+    return buckets + [max_num_seqs]
+
+def get_length_buckets(block_size: int, max_len: int) -> List[int]:
+    """Padded KV lengths: block_size times powers of two, up to max_len rounded up to a block"""
+    max_len = -(-max_len // block_size) * block_size
+    buckets = []
+    length = block_size
+    while length < max_len:
+        buckets.append(length)
+        length *= 2
+    return buckets + [max_len]
+
+class _DecodeStep(nn.Module):
+    """
+    One decode step over a padded batch, as a module for torch.compile
+    
+    The KV pool is a buffer of this module, so compiled graphs (and CUDA
+    graphs) read it in place at a fixed address instead of taking it as an
+    input. The new tokens' KV is returned rather than written, so padding
+    rows never touch the pool.
+    """
+    
+    def __init__(self, model: nn.Module, kv_cache: KVCacheManager):
+        super().__init__()
+        self.model = model
+        self.register_buffer('kv_slots', kv_cache.kv_slots, persistent=False)
+        self.num_layers = kv_cache.num_layers
+        self.num_kv_heads = kv_cache.num_kv_heads
+        self.head_dim = kv_cache.head_dim
+        
+    def forward(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        position_ids: torch.Tensor,
+        gather_slots: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            (logits [batch, vocab], keys and values of the new tokens, each
+            [layers, batch, kv heads, head dim])
+        """
+        batch_size, max_len = gather_slots.shape
+        kv = self.kv_slots.index_select(2, gather_slots.reshape(-1))
+        kv = kv.view(self.num_layers, 2, batch_size, max_len, self.num_kv_heads, self.head_dim)
+        kv = kv.permute(0, 1, 2, 4, 3, 5).contiguous()
+        past_key_values = from_legacy_cache(
+            tuple((kv[layer, 0], kv[layer, 1]) for layer in range(self.num_layers))
+        )
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        keys, values = stack_cache(outputs.past_key_values, -1)
+        return outputs.logits[:, -1, :], keys, values
+
+class _BucketInputs:
+    """Static input tensors of one (batch, KV length) bucket, refilled every step"""
+    
+    def __init__(self, batch_size: int, max_len: int, pad_token_id: int, null_slot: int, device: torch.device):
+        self.input_ids = torch.full((batch_size, 1), pad_token_id, dtype=torch.long, device=device)
+        self.attention_mask = torch.zeros((batch_size, max_len + 1), dtype=torch.long, device=device)
+        self.position_ids = torch.zeros((batch_size, 1), dtype=torch.long, device=device)
+        self.gather_slots = torch.full((batch_size, max_len), null_slot, dtype=torch.long, device=device)
+        # Padding rows attend only to themselves
+        self.attention_mask[:, -1] = 1
+
+class CompiledDecoder:
+    """
+    Decode steps dispatched to graphs compiled for fixed shapes
+    
+    Features:
+    - Each batch is padded to the nearest batch-size bucket and its KV to
+      the nearest length bucket, so steps replay one of a small set of
+      graphs instead of retracing
+    - On CUDA each bucket is captured as a CUDA graph (mode
+      "reduce-overhead"), removing per-kernel launch overhead; on CPU the
+      inductor backend generates fused C++ kernels
+    - Inputs live in static per-bucket buffers and the KV pool is read in
+      place, so replays copy nothing but the step's token IDs and slots
+    - Batches longer than the largest bucket run eagerly
+    """
+    
+    def __init__(
+        self,
+        model: nn.Module,
+        kv_cache: KVCacheManager,
+        pad_token_id: int,
+        max_num_seqs: int,
+        max_len: int,
+        mode: Optional[str] = None,
+        backend: str = "inductor"
+    ):
+        """
+        Args:
+            model: Model to compile (the eager model keeps serving prefill)
+            kv_cache: Paged KV cache whose pool the graphs read
+            pad_token_id: Token fed to padding rows
+            max_num_seqs: Largest batch bucket
+            max_len: Longest cached length run through a graph; longer
+                batches run eagerly
+            mode: torch.compile mode (default "reduce-overhead" on CUDA,
+                "default" elsewhere)
+            backend: torch.compile backend
+        """
+        self.kv_cache = kv_cache
+        self.pad_token_id = pad_token_id
+        self.device = kv_cache.device
+        self.batch_buckets = get_batch_buckets(max_num_seqs)
+        self.length_buckets = get_length_buckets(kv_cache.block_size, max_len)
+        self.null_slot = kv_cache.null_block * kv_cache.block_size
+        if mode is None:
+            mode = "reduce-overhead" if self.device.type == 'cuda' else "default"
+        self.mode = mode
+        
+        # Every bucket is its own specialization; allow all of them without recompile warnings
+        num_buckets = len(self.batch_buckets) * len(self.length_buckets)
+        dynamo_config = torch._dynamo.config
+        for name in ('cache_size_limit', 'recompile_limit', 'accumulated_cache_size_limit'):
+            if hasattr(dynamo_config, name):
+                setattr(dynamo_config, name, max(getattr(dynamo_config, name), num_buckets + 8))
+                
+        self.step_module = _DecodeStep(model, kv_cache)
+        self.compiled_step = torch.compile(self.step_module, mode=mode, backend=backend, dynamic=False)
+        self.inputs: Dict[Tuple[int, int], _BucketInputs] = {}
+        
+        self.num_compiled_steps = 0
+        self.num_eager_steps = 0
+        self.warmup_time = 0.0
+        
+    def _bucket(self, batch_size: int, max_len: int) -> Optional[Tuple[int, int]]:
+        """Smallest (batch, length) bucket that fits, or None"""
+        batch_index = bisect.bisect_left(self.batch_buckets, batch_size)
+        length_index = bisect.bisect_left(self.length_buckets, max_len)
+        if batch_index == len(self.batch_buckets) or length_index == len(self.length_buckets):
+            return None
+        return self.batch_buckets[batch_index], self.length_buckets[length_index]
+        
+    def _get_inputs(self, bucket: Tuple[int, int]) -> _BucketInputs:
+        inputs = self.inputs.get(bucket)
+        if inputs is None:
+            inputs = _BucketInputs(*bucket, self.pad_token_id, self.null_slot, self.device)
+            self.inputs[bucket] = inputs
+        return inputs
+        
+    def can_run(self, batch_size: int, max_len: int) -> bool:
+        """Whether a decode batch fits a bucket"""
+        return self._bucket(batch_size, max_len) is not None
+        
+    @torch.no_grad()
+    def decode(self, seqs: List[Sequence], kv_lens: List[int]) -> torch.Tensor:
+        """
+        Run one decode step through the graph of the nearest bucket
+        
+        Writes the new tokens' KV to the slots reserved by append_slot.
+        
+        Returns:
+            Next-token logits of shape [len(seqs), vocab]
+        """
+        batch_size = len(seqs)
+        bucket = self._bucket(batch_size, max(kv_lens))
+        inputs = self._get_inputs(bucket)
+        max_len = bucket[1]
+        
+        # Only the rows of this batch change; padding rows keep their null inputs
+        slots = self.kv_cache.get_gather_slots([seq.seq_id for seq in seqs], kv_lens, max_len)
+        cached_mask = torch.arange(max_len, device=self.device).unsqueeze(0) >= (
+            max_len - torch.tensor(kv_lens, dtype=torch.long, device=self.device).unsqueeze(-1)
+        )
+        inputs.gather_slots[:batch_size].copy_(slots)
+        inputs.attention_mask[:batch_size, :max_len].copy_(cached_mask)
+        inputs.input_ids[:batch_size, 0].copy_(
+            torch.tensor([seq.token_ids[-1] for seq in seqs], dtype=torch.long)
+        )
+        inputs.position_ids[:batch_size, 0].copy_(torch.tensor(kv_lens, dtype=torch.long))
+        
+        logits, keys, values = self.compiled_step(
+            inputs.input_ids, inputs.attention_mask, inputs.position_ids, inputs.gather_slots
+        )
+        write_slots = torch.tensor(
+            [self.kv_cache.get_slot(seq.seq_id, kv_len) for seq, kv_len in zip(seqs, kv_lens)],
+            dtype=torch.long, device=self.device
+        )
+        self.kv_cache.write(write_slots, keys[:, :batch_size], values[:, :batch_size])
+        
+        # Clear this batch's rows so a smaller batch in the same bucket pads with null inputs
+        inputs.gather_slots[:batch_size].fill_(self.null_slot)
+        inputs.attention_mask[:batch_size, :max_len].zero_()
+        inputs.input_ids[:batch_size].fill_(self.pad_token_id)
+        self.num_compiled_steps += 1
+        # Outputs of a CUDA graph are overwritten by its next replay
+        return logits[:batch_size].clone()
+        
+    @torch.no_grad()
+    def warmup(self, max_len: Optional[int] = None) -> float:
+        """
+        Compile (and on CUDA capture) every (batch, length) bucket ahead of the first request
+        
+        Args:
+            max_len: Compile only the length buckets needed up to this cached
+                length (default: all of them)
+                
+        Returns:
+            Seconds spent; much less once the graphs are in the disk cache
+        """
+        start = time.time()
+        lengths = self.length_buckets
+        if max_len is not None:
+            lengths = lengths[:bisect.bisect_left(lengths, max_len) + 1]
+        for length in lengths:
+            for batch_size in self.batch_buckets:
+                inputs = self._get_inputs((batch_size, length))
+                # Run twice: CUDA graph trees record on the second call of a new shape
+                for _ in range(2):
+                    self.compiled_step(
+                        inputs.input_ids, inputs.attention_mask, inputs.position_ids, inputs.gather_slots
+                    )
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        elapsed = time.time() - start
+        self.warmup_time += elapsed
+        return elapsed
+        
+    def get_stats(self) -> Dict[str, float]:
+        """Get bucket and dispatch statistics"""
+        total = self.num_compiled_steps + self.num_eager_steps
+        return {
+            'mode': self.mode,
+            'batch_buckets': self.batch_buckets,
+            'length_buckets': self.length_buckets,
+            'num_warm_buckets': len(self.inputs),
+            'num_compiled_steps': self.num_compiled_steps,
+            'num_eager_steps': self.num_eager_steps,
+            'compiled_fraction': self.num_compiled_steps / total if total else 0.0,
+            'warmup_time_s': self.warmup_time
+        }
@@ -0,0 +1,844 @@
+"""
+Constrained decoding for nano-vLLM
+Compiles a regex or JSON schema into a token-level FSM whose per-state vocabulary masks are applied to logits
+"""
+
+import re
+import json
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+import torch
+
+from .sampling_params import SamplingParams
+
+# State of a DFA or token FSM once the text can no longer match
+DEAD_STATE = -1
+
+class _CharSet:
+    """Set of characters given as code point ranges, optionally negated"""
+    
+    __slots__ = ('ranges', 'negated')
+    
+    def __init__(self, ranges: List[Tuple[int, int]], negated: bool = False):
+        self.ranges = tuple(ranges)
+        self.negated = negated
+        
+    def matches(self, char: str) -> bool:
+        code = ord(char)
+        return any(low <= code <= high for low, high in self.ranges) != self.negated
+        
+    def intersects(self, low: int, high: int) -> bool:
+        """Whether any code point in [low, high] is in the set"""
+        if not self.negated:
+            return any(start <= high and low <= end for start, end in self.ranges)
+        # Negated: look for a code point in [low, high] outside every range
+        code = low
+        for start, end in sorted(self.ranges):
+            if start > code:
+                break
+            code = max(code, end + 1)
+            if code > high:
+                return False
+        return code <= high
+
+_DIGITS = [(ord('0'), ord('9'))]
+_WORD = [(ord('a'), ord('z')), (ord('A'), ord('Z')), (ord('0'), ord('9')), (ord('_'), ord('_'))]
+_SPACE = [(ord(c), ord(c)) for c in " \t\n\r\f\v"]
+_CLASS_ESCAPES = {'d': (_DIGITS, False), 'D': (_DIGITS, True), 'w': (_WORD, False),
+                  'W': (_WORD, True), 's': (_SPACE, False), 'S': (_SPACE, True)}
+_CHAR_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', '0': '\0'}
+
+class _RegexParser:
+    """
+    Recursive-descent parser for the regex subset used by constrained decoding
+    
+    Supports literals, escapes (\\d \\w \\s, \\xHH, \\uHHHH), character
+    classes, '.', groups, alternation and the * + ? {m} {m,} {m,n}
+    quantifiers. The whole text must match, so leading '^' and trailing '$'
+    are accepted and ignored. Produces an AST of ('set', _CharSet),
+    ('concat', [nodes]), ('alt', [nodes]) and ('repeat', node, min, max).
+    """
+    
+    def __init__(self, pattern: str):
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+        if pattern.endswith('$') and not pattern.endswith('\\$'):
+            pattern = pattern[:-1]
+        self.pattern = pattern
+        self.pos = 0
+        
+    def parse(self):
+        node = self._alternation()
+        if self.pos != len(self.pattern):
+            self._error("unbalanced ')'")
+        return node
+        
+    def _error(self, message: str):
+        raise ValueError(f"Invalid regex {self.pattern!r} at position {self.pos}: {message}")
+        
+    def _peek(self) -> Optional[str]:
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+        
+    def _next(self) -> str:
+        if self.pos >= len(self.pattern):
+            self._error("unexpected end of pattern")
+        char = self.pattern[self.pos]
+        self.pos += 1
+        return char
+        
+    def _alternation(self):
+        branches = [self._sequence()]
+        while self._peek() == '|':
+            self.pos += 1
+            branches.append(self._sequence())
+        return branches[0] if len(branches) == 1 else ('alt', branches)
+        
+    def _sequence(self):
+        items = []
+        while self._peek() not in (None, '|', ')'):
+            items.append(self._quantified(self._atom()))
+        return items[0] if len(items) == 1 else ('concat', items)
+        
+    def _quantified(self, node):
+        while True:
+            char = self._peek()
+            if char == '*':
+                bounds = (0, None)
+            elif char == '+':
+                bounds = (1, None)
+            elif char == '?':
+                bounds = (0, 1)
+            elif char == '{' and self._is_counted_repeat():
+                bounds = self._counted_repeat()
+            else:
+                return node
+            if char != '{':
+                self.pos += 1
+            # Lazy quantifiers match the same language
+            if self._peek() == '?':
+                self.pos += 1
+            node = ('repeat', node) + bounds
+            
+    def _is_counted_repeat(self) -> bool:
+        end = self.pattern.find('}', self.pos)
+        body = self.pattern[self.pos + 1:end] if end > 0 else ''
+        return bool(body) and all(part.isdigit() or part == '' for part in body.split(',', 1)) and body[0] != ','
+        
+    def _counted_repeat(self) -> Tuple[int, Optional[int]]:
+        end = self.pattern.index('}', self.pos)
+        body = self.pattern[self.pos + 1:end]
+        self.pos = end + 1
+        if ',' not in body:
+            return int(body), int(body)
+        low, high = body.split(',', 1)
+        bounds = (int(low), int(high) if high else None)
+        if bounds[1] is not None and bounds[1] < bounds[0]:
+            self._error(f"bad repeat {{{body}}}")
+        return bounds
+        
+    def _atom(self):
+        char = self._next()
+        if char == '(':
+            if self.pattern.startswith('?:', self.pos):
+                self.pos += 2
+            elif self._peek() == '?':
+                self._error("only (?:...) groups are supported")
+            node = self._alternation()
+            if self._next() != ')':
+                self._error("missing ')'")
+            return node
+        if char == '[':
+            return ('set', self._char_class())
+        if char == '.':
+            return ('set', _CharSet([(ord('\n'), ord('\n'))], negated=True))
+        if char == '\\':
+            return ('set', self._escape())
+        if char in '*+?':
+            self._error(f"nothing to repeat before {char!r}")
+        return ('set', _CharSet([(ord(char), ord(char))]))
+        
+    def _escape(self) -> _CharSet:
+        """Character set of the escape after a backslash"""
+        char = self._next()
+        if char in _CLASS_ESCAPES:
+            ranges, negated = _CLASS_ESCAPES[char]
+            return _CharSet(ranges, negated)
+        code = ord(self._escaped_char(char))
+        return _CharSet([(code, code)])
+        
+    def _escaped_char(self, char: str) -> str:
+        if char in _CHAR_ESCAPES:
+            return _CHAR_ESCAPES[char]
+        if char in 'xu':
+            width = 2 if char == 'x' else 4
+            digits = self.pattern[self.pos:self.pos + width]
+            if len(digits) != width or any(d not in '0123456789abcdefABCDEF' for d in digits):
+                self._error(f"bad \\{char} escape")
+            self.pos += width
+            return chr(int(digits, 16))
+        return char
+        
+    def _char_class(self) -> _CharSet:
+        negated = self._peek() == '^'
+        if negated:
+            self.pos += 1
+        ranges = []
+        first = True
+        while True:
+            char = self._next()
+            if char == ']' and not first:
+                break
+            first = False
+            if char == '\\':
+                escape = self._next()
+                if escape in _CLASS_ESCAPES:
+                    class_ranges, class_negated = _CLASS_ESCAPES[escape]
+                    if class_negated:
+                        self._error("negated escapes are not supported inside [...]")
+                    ranges.extend(class_ranges)
+                    continue
+                char = self._escaped_char(escape)
+            low = ord(char)
+            if self._peek() == '-' and self.pattern[self.pos + 1:self.pos + 2] not in ('', ']'):
+                self.pos += 1
+                high_char = self._next()
+                if high_char == '\\':
+                    high_char = self._escaped_char(self._next())
+                if ord(high_char) < low:
+                    self._error("bad character range")
+                ranges.append((low, ord(high_char)))
+            else:
+                ranges.append((low, low))
+        return _CharSet(ranges, negated)
+
+class RegexDFA:
+    """
+    Character-level DFA for a regex, built lazily from a Thompson NFA
+    
+    DFA states are sets of NFA states, created and memoized the first time
+    a (state, character) transition is taken, so large character classes
+    never have to be expanded.
+    """
+    
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.edges: List[List[Tuple[_CharSet, int]]] = []
+        self.epsilon: List[List[int]] = []
+        start, self.accept = self._build(_RegexParser(pattern).parse())
+        
+        self.states: List[FrozenSet[int]] = []
+        self.state_ids: Dict[FrozenSet[int], int] = {}
+        self.accepting: List[bool] = []
+        self.transitions: Dict[Tuple[int, str], int] = {}
+        self.start_state = self._intern(self._closure([start]))
+        
+    def _new_state(self) -> int:
+        self.edges.append([])
+        self.epsilon.append([])
+        return len(self.edges) - 1
+        
+    def _build(self, node) -> Tuple[int, int]:
+        """Add NFA states for an AST node; returns its (start, end) states"""
+        kind = node[0]
+        if kind == 'set':
+            start, end = self._new_state(), self._new_state()
+            self.edges[start].append((node[1], end))
+            return start, end
+        if kind == 'concat':
+            start = end = self._new_state()
+            for item in node[1]:
+                item_start, item_end = self._build(item)
+                self.epsilon[end].append(item_start)
+                end = item_end
+            return start, end
+        if kind == 'alt':
+            start, end = self._new_state(), self._new_state()
+            for branch in node[1]:
+                branch_start, branch_end = self._build(branch)
+                self.epsilon[start].append(branch_start)
+                self.epsilon[branch_end].append(end)
+            return start, end
+            
+        _, item, low, high = node
+        start = current = self._new_state()
+        for _ in range(low):
+            item_start, item_end = self._build(item)
+            self.epsilon[current].append(item_start)
+            current = item_end
+        end = self._new_state()
+        if high is None:
+            item_start, item_end = self._build(item)
+            self.epsilon[current].extend([item_start, end])
+            self.epsilon[item_end].extend([item_start, end])
+        else:
+            for _ in range(high - low):
+                item_start, item_end = self._build(item)
+                self.epsilon[current].extend([item_start, end])
+                current = item_end
+            self.epsilon[current].append(end)
+        return start, end
+        
+    def _closure(self, states) -> FrozenSet[int]:
+        closure = set(states)
+        stack = list(states)
+        while stack:
+            for target in self.epsilon[stack.pop()]:
+                if target not in closure:
+                    closure.add(target)
+                    stack.append(target)
+        return frozenset(closure)
+        
+    def _intern(self, nfa_states: FrozenSet[int]) -> int:
+        state = self.state_ids.get(nfa_states)
+        if state is None:
+            state = len(self.states)
+            self.states.append(nfa_states)
+            self.state_ids[nfa_states] = state
+            self.accepting.append(self.accept in nfa_states)
+        return state
+        
+    def next_state(self, state: int, char: str) -> int:
+        """State after reading char, or DEAD_STATE if no match can follow"""
+        key = (state, char)
+        next_state = self.transitions.get(key)
+        if next_state is None:
+            targets = [
+                target
+                for nfa_state in self.states[state]
+                for char_set, target in self.edges[nfa_state]
+                if char_set.matches(char)
+            ]
+            next_state = self._intern(self._closure(targets)) if targets else DEAD_STATE
+            self.transitions[key] = next_state
+        return next_state
+        
+    def can_read(self, state: int, low: int, high: int) -> bool:
+        """Whether some character with a code point in [low, high] can follow"""
+        return state != DEAD_STATE and any(
+            char_set.intersects(low, high)
+            for nfa_state in self.states[state]
+            for char_set, _ in self.edges[nfa_state]
+        )
+        
+    def walk(self, state: int, text: str) -> int:
+        """State after reading text"""
+        for char in text:
+            if state == DEAD_STATE:
+                break
+            state = self.next_state(state, char)
+        return state
+        
+    def is_accepting(self, state: int) -> bool:
+        return state != DEAD_STATE and self.accepting[state]
+
+_REGEX_SPECIAL = set('\\^$.|?*+()[]{}')
+
+def escape_regex(text: str) -> str:
+    """Regex matching text literally"""
+    return ''.join('\\' + char if char in _REGEX_SPECIAL else char for char in text)
+
+# JSON building blocks; a single optional space keeps the model from padding forever
+_JSON_WS = r"[ ]?"
+_JSON_STRING_CHAR = r'([^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})'
+_JSON_INTEGER = r"-?(0|[1-9][0-9]*)"
+_JSON_TYPES = {
+    'string': f'"{_JSON_STRING_CHAR}*"',
+    'integer': _JSON_INTEGER,
+    'number': _JSON_INTEGER + r"(\.[0-9]+)?([eE][+-]?[0-9]+)?",
+    'boolean': r"(true|false)",
+    'null': "null"
+}
+
+def json_schema_to_regex(schema: Dict[str, Any], definitions: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Regex matching compact JSON documents valid under a schema
+    
+    Supports the subset of JSON Schema that maps onto a regular language:
+    type (including lists of types), properties and required, items with
+    minItems / maxItems, string pattern / minLength / maxLength, enum,
+    const, anyOf / oneOf and local $ref. Object properties are generated in
+    declaration order; optional ones may be left out.
+    
+    Raises:
+        ValueError: If the schema uses an unsupported construct
+    """
+    if definitions is None:
+        definitions = schema.get('$defs', schema.get('definitions', {}))
+        
+    if '$ref' in schema:
+        ref = schema['$ref']
+        for prefix in ('#/$defs/', '#/definitions/'):
+            if ref.startswith(prefix) and ref[len(prefix):] in definitions:
+                return json_schema_to_regex(definitions[ref[len(prefix):]], definitions)
+        raise ValueError(f"Unsupported $ref {ref!r}: only local definitions are supported")
+    if 'const' in schema:
+        return escape_regex(json.dumps(schema['const']))
+    if 'enum' in schema:
+        return '(' + '|'.join(escape_regex(json.dumps(value)) for value in schema['enum']) + ')'
+    for key in ('anyOf', 'oneOf'):
+        if key in schema:
+            return '(' + '|'.join(json_schema_to_regex(sub, definitions) for sub in schema[key]) + ')'
+            
+    schema_type = schema.get('type')
+    if isinstance(schema_type, list):
+        return '(' + '|'.join(json_schema_to_regex({**schema, 'type': t}, definitions) for t in schema_type) + ')'
+        
+    if schema_type == 'object':
+        properties = schema.get('properties')
+        if not properties:
+            raise ValueError("Object schemas must list their properties")
+        required = set(schema.get('required', []))
+        items = [
+            (f'{escape_regex(json.dumps(name))}{_JSON_WS}:{_JSON_WS}{json_schema_to_regex(sub, definitions)}',
+             name in required)
+            for name, sub in properties.items()
+        ]
+        return rf"\{{{_JSON_WS}{_json_members(items, first=True)}{_JSON_WS}\}}"
+        
+    if schema_type == 'array':
+        if 'items' not in schema:
+            raise ValueError("Array schemas must define items")
+        item = json_schema_to_regex(schema['items'], definitions)
+        min_items = schema.get('minItems', 0)
+        max_items = schema.get('maxItems')
+        separator = f'{_JSON_WS},{_JSON_WS}'
+        if max_items == 0:
+            return rf"\[{_JSON_WS}\]"
+        high = '' if max_items is None else str(max_items - 1)
+        elements = f'({item})({separator}({item})){{{max(min_items - 1, 0)},{high}}}'
+        if min_items == 0:
+            elements = f'({elements})?'
+        return rf"\[{_JSON_WS}{elements}{_JSON_WS}\]"
+        
+    if schema_type == 'string' and ('pattern' in schema or 'minLength' in schema or 'maxLength' in schema):
+        if 'pattern' in schema:
+            pattern = schema['pattern']
+            pattern = pattern[1:] if pattern.startswith('^') else pattern
+            pattern = pattern[:-1] if pattern.endswith('$') and not pattern.endswith('\\$') else pattern
+            return f'"({pattern})"'
+        max_length = schema.get('maxLength')
+        return f'"{_JSON_STRING_CHAR}{{{schema.get("minLength", 0)},{"" if max_length is None else max_length}}}"'
+        
+    if schema_type in _JSON_TYPES:
+        return _JSON_TYPES[schema_type]
+    raise ValueError(f"Unsupported JSON schema: {json.dumps(schema)[:200]}")
+
+def _json_members(items: List[Tuple[str, bool]], first: bool) -> str:
+    """Regex for object members in order; first means no comma is needed before the next one"""
+    if not items:
+        return ''
+    (member, required), rest = items[0], items[1:]
+    separator = '' if first else f'{_JSON_WS},{_JSON_WS}'
+    if required:
+        return separator + member + _json_members(rest, first=False)
+    if not first:
+        return f'({separator}{member})?' + _json_members(rest, first=False)
+    return f'({member}{_json_members(rest, first=False)}|{_json_members(rest, first=True)})'
+
+class _VocabTrie:
+    """Character trie of the vocabulary, so tokens sharing a prefix share its DFA walk"""
+    
+    def __init__(self, token_strings: List[Optional[str]]):
+        self.children: List[Dict[str, int]] = [{}]
+        self.token_ids: List[List[int]] = [[]]
+        for token_id, text in enumerate(token_strings):
+            if not text:
+                continue
+            node = 0
+            for char in text:
+                child = self.children[node].get(char)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][char] = child
+                    self.children.append({})
+                    self.token_ids.append([])
+                node = child
+            self.token_ids[node].append(token_id)
+
+def token_strings(tokenizer) -> List[Optional[str]]:
+    """
+    Text each token adds when appended to a sequence
+    
+    Special tokens and pieces that are not valid UTF-8 on their own (part
+    of a multi-byte character) map to None; token_bytes covers the latter.
+    """
+    special_ids = set(tokenizer.all_special_ids)
+    pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    strings = []
+    for token_id, piece in enumerate(pieces):
+        if piece is None or token_id in special_ids:
+            strings.append(None)
+            continue
+        text = tokenizer.convert_tokens_to_string([piece])
+        # SentencePiece drops the leading space of a sequence's first piece
+        if piece.startswith('\u2581') and not text.startswith(' '):
+            text = ' ' + text
+        strings.append(text if text and '\ufffd' not in text else None)
+    return strings
+
+def _byte_level_decoder() -> Dict[str, int]:
+    """Byte of each character in the GPT-2 byte-level BPE alphabet"""
+    printable = [*range(ord('!'), ord('~') + 1), *range(ord('¡'), ord('¬') + 1), *range(ord('®'), ord('ÿ') + 1)]
+    decoder = {chr(byte): byte for byte in printable}
+    shifted = 256
+    for byte in range(256):
+        if byte not in printable:
+            decoder[chr(shifted)] = byte
+            shifted += 1
+    return decoder
+
+_BYTE_LEVEL_DECODER = _byte_level_decoder()
+_BYTE_FALLBACK = re.compile(r'<0x([0-9A-Fa-f]{2})>')
+
+def token_bytes(tokenizer, strings: List[Optional[str]]) -> Dict[int, bytes]:
+    """
+    Raw bytes of the tokens that hold part of a multi-byte UTF-8 character
+    
+    Covers byte-level BPE pieces and SentencePiece byte-fallback pieces
+    that token_strings could not decode on their own.
+    """
+    special_ids = set(tokenizer.all_special_ids)
+    pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    partial = {}
+    for token_id, piece in enumerate(pieces):
+        if not piece or strings[token_id] is not None or token_id in special_ids:
+            continue
+        match = _BYTE_FALLBACK.fullmatch(piece)
+        if match:
+            data = bytes([int(match.group(1), 16)])
+        elif all(char in _BYTE_LEVEL_DECODER for char in piece):
+            data = bytes(_BYTE_LEVEL_DECODER[char] for char in piece)
+        else:
+            continue
+        try:
+            data.decode('utf-8')
+        except UnicodeDecodeError:
+            partial[token_id] = data
+    return partial
+
+def _utf8_length(lead: int) -> int:
+    """Length of the UTF-8 sequence a byte starts, 0 if it cannot start one"""
+    if lead < 0x80:
+        return 1
+    if 0xC2 <= lead <= 0xDF:
+        return 2
+    if 0xE0 <= lead <= 0xEF:
+        return 3
+    if 0xF0 <= lead <= 0xF4:
+        return 4
+    return 0
+
+def _split_utf8(data: bytes) -> Optional[Tuple[str, bytes]]:
+    """Decode bytes up to a trailing incomplete character; None if they are not UTF-8"""
+    cut = len(data)
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:
+            if _utf8_length(byte) > back:
+                cut -= back
+            break
+    try:
+        return data[:cut].decode('utf-8'), data[cut:]
+    except UnicodeDecodeError:
+        return None
+
+_MIN_CODE_POINTS = {2: 0x80, 3: 0x800, 4: 0x10000}
+
+def _code_point_range(pending: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Lowest and highest code point whose UTF-8 encoding starts with pending
+    
+    Returns:
+        None if no valid character does (overlong forms, surrogates or
+        code points past U+10FFFF)
+    """
+    length = _utf8_length(pending[0])
+    code = pending[0] & (0x7F >> length)
+    for byte in pending[1:]:
+        code = code << 6 | byte & 0x3F
+    shift = 6 * (length - len(pending))
+    low = max(code << shift, _MIN_CODE_POINTS[length])
+    high = min((code << shift) | ((1 << shift) - 1), 0x10FFFF)
+    if low > high or 0xD800 <= low <= high <= 0xDFFF:
+        return None
+    return low, high
+
+class TokenFSM:
+    """
+    Token-level view of a RegexDFA
+    
+    Features:
+    - The allowed tokens of a DFA state are found by walking the vocabulary
+      trie from that state, pruning every branch the DFA rejects
+    - Tokens holding part of a multi-byte character are allowed when some
+      completion of it can match; their bytes are carried in the state
+    - Per-state vocabulary masks are kept on the logits device in an LRU
+    - States reachable from the start are precompiled breadth-first
+    - EOS is allowed exactly in accepting states
+    
+    A state is a (DFA state, pending bytes) pair, interned as an int.
+    """
+    
+    def __init__(
+        self,
+        dfa: RegexDFA,
+        vocab: _VocabTrie,
+        token_texts: List[Optional[str]],
+        token_bytes: Dict[int, bytes],
+        vocab_size: int,
+        eos_token_id: Optional[int],
+        device: torch.device,
+        max_cached_masks: int = 512
+    ):
+        self.dfa = dfa
+        self.vocab = vocab
+        self.token_texts = token_texts
+        self.token_bytes = token_bytes
+        self.vocab_size = vocab_size
+        self.eos_token_id = eos_token_id
+        self.device = device
+        self.max_cached_masks = max_cached_masks
+        self.masks: 'OrderedDict[int, torch.Tensor]' = OrderedDict()
+        self.successors: Dict[int, Set[int]] = {}
+        self.lock = threading.Lock()
+        self.states: List[Tuple[int, bytes]] = []
+        self.state_ids: Dict[Tuple[int, bytes], int] = {}
+        self.state_lock = threading.Lock()
+        self._start_state = self._intern(dfa.start_state, b'')
+        
+        self.num_mask_hits = 0
+        self.num_mask_misses = 0
+        
+    @property
+    def start_state(self) -> int:
+        return self._start_state
+        
+    def _intern(self, dfa_state: int, pending: bytes) -> int:
+        """State ID of a DFA state with pending bytes, or DEAD_STATE if no character can complete them"""
+        if dfa_state == DEAD_STATE:
+            return DEAD_STATE
+        if pending:
+            code_points = _code_point_range(pending)
+            if code_points is None or not self.dfa.can_read(dfa_state, *code_points):
+                return DEAD_STATE
+        key = (dfa_state, pending)
+        with self.state_lock:
+            state = self.state_ids.get(key)
+            if state is None:
+                state = len(self.states)
+                self.states.append(key)
+                self.state_ids[key] = state
+            return state
+            
+    def is_accepting(self, state: int) -> bool:
+        if state == DEAD_STATE:
+            return False
+        dfa_state, pending = self.states[state]
+        return not pending and self.dfa.is_accepting(dfa_state)
+                
+    def precompile(self, max_states: int):
+        """Build masks for up to max_states states reachable from the start, nearest first"""
+        seen = {self.start_state}
+        queue = deque([self.start_state])
+        while queue and len(seen) <= max_states:
+            state = queue.popleft()
+            self.get_mask(state)
+            for successor in self.successors.get(state, ()):
+                if successor not in seen:
+                    seen.add(successor)
+                    queue.append(successor)
+                    
+    def next_state(self, state: int, token_id: int) -> int:
+        """State after generating a token"""
+        if state == DEAD_STATE:
+            return DEAD_STATE
+        dfa_state, pending = self.states[state]
+        text = self.token_texts[token_id] if token_id < len(self.token_texts) else None
+        if text is not None and not pending:
+            return self._intern(self.dfa.walk(dfa_state, text), b'')
+            
+        # Part of a multi-byte character: decode what is complete, carry the rest
+        data = self.token_bytes.get(token_id)
+        split = _split_utf8(pending + data) if data is not None else None
+        if split is None:
+            return DEAD_STATE
+        text, pending = split
+        return self._intern(self.dfa.walk(dfa_state, text), pending)
+        
+    def get_mask(self, state: int) -> torch.Tensor:
+        """Boolean [vocab_size] mask of the tokens allowed in a state"""
+        with self.lock:
+            mask = self.masks.get(state)
+            if mask is not None:
+                self.masks.move_to_end(state)
+                self.num_mask_hits += 1
+                return mask
+                
+            self.num_mask_misses += 1
+            allowed = self._allowed_tokens(state)
+            mask = torch.zeros(self.vocab_size, dtype=torch.bool)
+            mask[torch.tensor([t for t in allowed if t < self.vocab_size], dtype=torch.long)] = True
+            mask = mask.to(self.device)
+            self.masks[state] = mask
+            if len(self.masks) > self.max_cached_masks:
+                self.masks.popitem(last=False)
+            return mask
+            
+    def _allowed_tokens(self, state: int) -> List[int]:
+        allowed = []
+        successors = set()
+        if state != DEAD_STATE:
+            dfa_state, pending = self.states[state]
+            # Whole-character tokens cannot follow an incomplete character
+            if not pending:
+                children, token_ids = self.vocab.children, self.vocab.token_ids
+                stack = [(0, dfa_state)]
+                while stack:
+                    node, node_state = stack.pop()
+                    for char, child in children[node].items():
+                        child_state = self.dfa.next_state(node_state, char)
+                        if child_state == DEAD_STATE:
+                            continue
+                        if token_ids[child]:
+                            allowed.extend(token_ids[child])
+                            successors.add(self._intern(child_state, b''))
+                        stack.append((child, child_state))
+            for token_id in self.token_bytes:
+                next_state = self.next_state(state, token_id)
+                if next_state != DEAD_STATE:
+                    allowed.append(token_id)
+                    successors.add(next_state)
+            self.successors[state] = successors
+            
+        # EOS ends a complete match; it is also the only way out of a dead end
+        if self.eos_token_id is not None and (self.is_accepting(state) or not allowed):
+            allowed.append(self.eos_token_id)
+        return allowed
+
+class TokenGuide:
+    """Position of one sequence in a TokenFSM"""
+    
+    __slots__ = ('fsm', 'state')
+    
+    def __init__(self, fsm: TokenFSM):
+        self.fsm = fsm
+        self.state = fsm.start_state
+        
+    def allowed_mask(self) -> torch.Tensor:
+        """Boolean mask of the tokens that keep the output matching"""
+        return self.fsm.get_mask(self.state)
+        
+    def advance(self, token_id: int):
+        """Move past a generated token"""
+        self.state = self.fsm.next_state(self.state, token_id)
+        
+    @property
+    def is_complete(self) -> bool:
+        """Whether the output so far is a full match"""
+        return self.fsm.is_accepting(self.state)
+
+class GuideCompiler:
+    """
+    Compiles the constraints of SamplingParams into shared TokenFSMs
+    
+    Features:
+    - One FSM per distinct regex, kept in an LRU, so repeated schemas pay
+      for compilation and mask building once
+    - The vocabulary is decoded into a character trie on first use
+    - precompile_states masks are built when an FSM is compiled, the rest
+      on first visit
+    """
+    
+    def __init__(
+        self,
+        tokenizer,
+        vocab_size: int,
+        device: torch.device,
+        max_cached_fsms: int = 32,
+        precompile_states: int = 16,
+        max_cached_masks: int = 512
+    ):
+        """
+        Args:
+            tokenizer: HuggingFace tokenizer
+            vocab_size: Width of the model's logits
+            device: Device the masks are applied on
+            max_cached_fsms: Compiled constraints kept for reuse
+            precompile_states: States whose masks are built at compile time
+            max_cached_masks: Vocabulary masks kept per FSM
+        """
+        self.tokenizer = tokenizer
+        self.vocab_size = vocab_size
+        self.device = device
+        self.max_cached_fsms = max_cached_fsms
+        self.precompile_states = precompile_states
+        self.max_cached_masks = max_cached_masks
+        self.token_texts: Optional[List[Optional[str]]] = None
+        self.token_bytes: Optional[Dict[int, bytes]] = None
+        self.vocab: Optional[_VocabTrie] = None
+        self.fsms: 'OrderedDict[str, TokenFSM]' = OrderedDict()
+        self.lock = threading.Lock()
+        
+        self.num_compiled = 0
+        self.num_cache_hits = 0
+        
+    def compile(self, pattern: str) -> TokenFSM:
+        """Shared TokenFSM for a regex"""
+        with self.lock:
+            fsm = self.fsms.get(pattern)
+            if fsm is not None:
+                self.fsms.move_to_end(pattern)
+                self.num_cache_hits += 1
+                return fsm
+                
+            if self.vocab is None:
+                self.token_texts = token_strings(self.tokenizer)
+                self.token_bytes = token_bytes(self.tokenizer, self.token_texts)
+                self.vocab = _VocabTrie(self.token_texts)
+            fsm = TokenFSM(
+                RegexDFA(pattern), self.vocab, self.token_texts, self.token_bytes, self.vocab_size,
+                self.tokenizer.eos_token_id, self.device, self.max_cached_masks
+            )
+            self.fsms[pattern] = fsm
+            if len(self.fsms) > self.max_cached_fsms:
+                self.fsms.popitem(last=False)
+            self.num_compiled += 1
+            
+        fsm.precompile(self.precompile_states)
+        return fsm
+        
+    def create_guide(self, sampling_params: SamplingParams) -> Optional[TokenGuide]:
+        """Guide for a request, or None if it has no regex or JSON schema"""
+        if sampling_params.regex is not None:
+            pattern = sampling_params.regex
+        elif sampling_params.json_schema is not None:
+            pattern = json_schema_to_regex(sampling_params.json_schema)
+        else:
+            return None
+        return TokenGuide(self.compile(pattern))
+        
+    def get_stats(self) -> Dict[str, int]:
+        """Get compilation and mask cache statistics"""
+        with self.lock:
+            fsms = list(self.fsms.values())
+        return {
+            'num_compiled': self.num_compiled,
+            'num_cache_hits': self.num_cache_hits,
+            'num_cached_fsms': len(fsms),
+            'num_cached_masks': sum(len(fsm.masks) for fsm in fsms),
+            'num_mask_hits': sum(fsm.num_mask_hits for fsm in fsms),
+            'num_mask_misses': sum(fsm.num_mask_misses for fsm in fsms)
+        }
+
+def apply_guides(logits: torch.Tensor, guides: List[Optional[TokenGuide]]) -> torch.Tensor:
+    """Mask out, in one batched op, every token that would break a row's constraint"""
+    rows = [row for row, guide in enumerate(guides) if guide is not None]
+    masks = torch.stack([guides[row].allowed_mask() for row in rows]).to(logits.device)
+    if len(rows) == len(guides):
+        allowed = masks
+    else:
+        allowed = torch.ones_like(logits, dtype=torch.bool)
+        allowed[torch.tensor(rows, device=logits.device)] = masks
+    return logits.masked_fill(~allowed, float('-inf'))
@@ -0,0 +1,314 @@
+"""
+Continuous-batching engine for nano-vLLM
+Drives the scheduler and model runner one iteration at a time
+"""
+
+import time
+import torch
+from typing import Dict, List, Optional
+
+from .sampling_params import SamplingParams
+from .sequence import Sequence
+from .scheduler import Scheduler
+from .cache_manager import KVCacheManager
+from .model_runner import ModelRunner
+from .sampler import make_generator
+from .metrics import StatsRecorder, StepStats
+from .speculative import Proposer, SpeculativeDecoder
+from .optimizations import AdaptiveBatching, PrefixCache
+from .tokenization import TokenizerPool
+from .kv_offload import KVSwapper
+from .stop_strings import StopStringDetokenizer
+from .constrained import GuideCompiler, TokenGuide
+
+class LLMEngine:
+    """
+    Iteration-level generation loop
+    
+    Features:
+    - Requests can be added between any two steps
+    - Prefill of new requests and decode of running ones in every step;
+      long prompts are prefilled in chunks interleaved with decode steps
+    - Finished sequences leave the batch as soon as they stop; stop strings
+      are matched in the detokenized text as tokens arrive
+    - Optional regex / JSON schema constraints applied to the logits
+    - Optional speculative decoding of running sequences
+    """
+    
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        tokenizer,
+        kv_cache: KVCacheManager,
+        max_model_len: int,
+        max_num_seqs: int = 32,
+        max_num_batched_tokens: int = 8192,
+        adaptive_batching: Optional[AdaptiveBatching] = None,
+        prefix_cache: Optional[PrefixCache] = None,
+        stats_recorder: Optional[StatsRecorder] = None,
+        proposer: Optional[Proposer] = None,
+        num_speculative_tokens: int = 0,
+        tokenizer_pool: Optional[TokenizerPool] = None,
+        parallel_workers=None,
+        prefill_chunk_size: Optional[int] = None,
+        kv_swapper: Optional[KVSwapper] = None,
+        guide_compiler: Optional[GuideCompiler] = None
+    ):
+        self.tokenizer = tokenizer
+        self.guide_compiler = guide_compiler
+        self.tokenizer_pool = tokenizer_pool
+        self.kv_cache = kv_cache
+        self.prefix_cache = prefix_cache
+        self.max_model_len = max_model_len
+        self.adaptive_batching = adaptive_batching
+        self.stats_recorder = stats_recorder
+        self.model_runner = ModelRunner(
+            model, kv_cache, tokenizer.pad_token_id, tokenizer.eos_token_id, workers=parallel_workers
+        )
+        self.speculative_decoder = None
+        if proposer is not None and num_speculative_tokens > 0:
+            self.speculative_decoder = SpeculativeDecoder(
+                proposer, kv_cache, self.model_runner, num_speculative_tokens, max_model_len
+            )
+        
+        self.scheduler = Scheduler(
+            kv_cache,
+            max_num_seqs=max_num_seqs,
+            max_num_batched_tokens=max_num_batched_tokens,
+            prefix_cache=prefix_cache,
+            prefill_chunk_size=prefill_chunk_size,
+            kv_swapper=kv_swapper
+        )
+        self.sequences: Dict[int, Sequence] = {}
+        
+    def add_request(
+        self,
+        prompt: str,
+        sampling_params: SamplingParams,
+        prompt_token_ids: Optional[List[int]] = None,
+        arrival_time: Optional[float] = None,
+        guide: Optional[TokenGuide] = None
+    ) -> Sequence:
+        """
+        Queue a prompt for generation
+        
+        Args:
+            guide: Guide already built with create_guide (e.g. off the event
+                loop); built here when None
+                
+        Returns:
+            The Sequence tracking this request
+        """
+        if prompt_token_ids is None:
+            max_length = self.max_model_len - sampling_params.max_tokens
+            if self.tokenizer_pool is not None:
+                prompt_token_ids = self.tokenizer_pool.encode(prompt, max_length)
+            else:
+                prompt_token_ids = self.tokenizer(prompt, truncation=True, max_length=max_length)['input_ids']
+            
+        seq = Sequence(prompt, prompt_token_ids, sampling_params, arrival_time=arrival_time)
+        seq.generator = make_generator(sampling_params, self.model_runner.device)
+        seq.stop_token_ids = [[token_id] for token_id in sampling_params.stop_token_ids]
+        if sampling_params.stop_sequences:
+            seq.detokenizer = StopStringDetokenizer(
+                self.tokenizer, seq.prompt_token_ids, sampling_params.stop_sequences
+            )
+        seq.guide = guide if guide is not None else self.create_guide(sampling_params)
+        
+        self.sequences[seq.seq_id] = seq
+        self.scheduler.add_sequence(seq)
+        return seq
+        
+    def create_guide(self, sampling_params: SamplingParams):
+        """
+        Constrained-decoding guide for a request, or None if it is unconstrained
+        
+        Raises:
+            ValueError: If the request is constrained but no GuideCompiler is
+                configured, or its regex or schema is unsupported
+        """
+        if sampling_params.regex is None and sampling_params.json_schema is None:
+            return None
+        if self.guide_compiler is None:
+            raise ValueError("Constrained decoding is not enabled for this engine")
+        return self.guide_compiler.create_guide(sampling_params)
+                
+    def abort_request(self, seq_id: int) -> bool:
+        """Cancel a queued or running request"""
+        self.sequences.pop(seq_id, None)
+        if self.speculative_decoder is not None:
+            self.speculative_decoder.free(seq_id)
+        return self.scheduler.abort_sequence(seq_id)
+        
+    def has_unfinished_requests(self) -> bool:
+        """Whether any request is still waiting or running"""
+        return self.scheduler.has_unfinished()
+        
+    def has_waiting_requests(self) -> bool:
+        """Whether any request is still waiting for admission"""
+        return bool(self.scheduler.waiting)
+        
+    def step(self) -> List[Sequence]:
+        """
+        Run one scheduling and execution iteration
+        
+        Returns:
+            Sequences that produced a token in this step (sequences that
+            only prefilled a chunk are not included)
+        """
+        step_start = time.time()
+        scheduled = self.scheduler.schedule()
+        if scheduled.is_empty:
+            return []
+            
+        recorder = self.stats_recorder
+        prefill_time = decode_time = 0.0
+        prefilled_seqs = []
+        
+        if scheduled.prefill_seqs:
+            for seq in scheduled.prefill_seqs:
+                if seq.first_scheduled_time is None:
+                    seq.first_scheduled_time = step_start
+                    if recorder is not None:
+                        recorder.record_scheduled(seq)
+                        
+            prefill_start = time.time()
+            logits = self.model_runner.prefill(scheduled.prefill_seqs, scheduled.prefill_chunks)
+            self._cache_prefixes(scheduled.prefill_seqs)
+            
+            # Sequences with prefill chunks left sample nothing this step
+            rows = [row for row, seq in enumerate(scheduled.prefill_seqs) if not seq.is_prefilling]
+            prefilled_seqs = [scheduled.prefill_seqs[row] for row in rows]
+            if rows:
+                self._process_logits(prefilled_seqs, logits[rows])
+            prefill_time = time.time() - prefill_start
+            
+        if scheduled.decode_seqs:
+            decode_start = time.time()
+            if self.speculative_decoder is not None:
+                self.speculative_decoder.step(scheduled.decode_seqs, self._append_tokens)
+            else:
+                logits = self.model_runner.decode(scheduled.decode_seqs)
+                self._process_logits(scheduled.decode_seqs, logits)
+            decode_time = time.time() - decode_start
+            
+        self.scheduler.update()
+        
+        if self.speculative_decoder is not None:
+            for seq in scheduled.preempted_seqs:
+                self.speculative_decoder.free(seq.seq_id)
+                
+        stepped = prefilled_seqs + scheduled.decode_seqs
+        for seq in stepped:
+            if seq.is_finished:
+                if seq.detokenizer is not None:
+                    # Release text held back as a possible stop string prefix
+                    seq.detokenizer.flush()
+                self.sequences.pop(seq.seq_id, None)
+                if self.speculative_decoder is not None:
+                    self.speculative_decoder.free(seq.seq_id)
+                if recorder is not None:
+                    recorder.record_finished(seq)
+                    
+        if recorder is not None:
+            recorder.record_step(StepStats(
+                num_prefill_seqs=len(scheduled.prefill_seqs),
+                num_decode_seqs=len(scheduled.decode_seqs),
+                num_prefill_tokens=sum(scheduled.prefill_chunks),
+                num_cached_tokens=scheduled.num_cached_tokens,
+                num_preempted=len(scheduled.preempted_seqs),
+                num_waiting=len(self.scheduler.waiting),
+                prefill_time=prefill_time,
+                decode_time=decode_time,
+                kv_utilization=self.kv_cache.get_utilization()
+            ))
+            
+        step_time = time.time() - step_start
+        if self.adaptive_batching is not None and step_time > 0:
+            self.adaptive_batching.update_performance(len(stepped), len(stepped) / step_time)
+            
+        return stepped
+        
+    def _cache_prefixes(self, seqs: List[Sequence]):
+        """Publish freshly prefilled blocks so concurrent requests can share them"""
+        if self.prefix_cache is None:
+            return
+            
+        for seq in seqs:
+            self.prefix_cache.insert(
+                seq.token_ids[:seq.num_computed_tokens],
+                self.kv_cache.block_tables[seq.seq_id]
+            )
+            
+    def _process_logits(self, seqs: List[Sequence], logits: torch.Tensor):
+        """Sample and record the next token of each sequence"""
+        tokens, stopped = self.model_runner.sample_sequences(logits, seqs)
+        
+        for seq, token, stop in zip(seqs, tokens, stopped):
+            if token == self.tokenizer.eos_token_id:
+                self._finish_at_eos(seq)
+                continue
+                
+            self._append_token(seq, token)
+            if stop:
+                seq.finish('stop')
+            elif not seq.is_finished:
+                self._check_length(seq)
+                
+    def _append_tokens(self, seq: Sequence, tokens: List[int]) -> int:
+        """
+        Append several tokens accepted in one speculative step
+        
+        Stop conditions are checked after every token, so tokens past EOS,
+        a stop token, a stop string or the length limit are dropped.
+        
+        Returns:
+            Number of tokens appended
+        """
+        for num_appended, token in enumerate(tokens):
+            if token == self.tokenizer.eos_token_id:
+                self._finish_at_eos(seq)
+                return num_appended
+                
+            self._append_token(seq, token)
+            token_ids = seq.token_ids
+            if any(token_ids[-len(stop):] == stop for stop in seq.stop_token_ids):
+                seq.finish('stop')
+            elif not seq.is_finished:
+                self._check_length(seq)
+            if seq.is_finished:
+                return num_appended + 1
+        return len(tokens)
+        
+    def _finish_at_eos(self, seq: Sequence):
+        """Finish on EOS, reporting 'constraint' when the guide forced EOS before a full match"""
+        # Before a full match, the guide only allows EOS when no token can continue it
+        seq.finish('stop' if seq.guide is None or seq.guide.is_complete else 'constraint')
+        
+    def _append_token(self, seq: Sequence, token: int):
+        """Append a generated token, advance its stop-string and constraint state and record its latency"""
+        previous_token_time = seq.last_token_time
+        seq.append_token(token)
+        if seq.guide is not None:
+            seq.guide.advance(token)
+        if seq.detokenizer is not None:
+            seq.detokenizer.step(seq.output_token_ids)
+            if seq.detokenizer.stopped:
+                seq.finish('stop')
+        recorder = self.stats_recorder
+        if recorder is not None:
+            if previous_token_time is None:
+                recorder.record_first_token(seq)
+            else:
+                recorder.record_inter_token(seq, seq.last_token_time - previous_token_time)
+                
+    def _check_length(self, seq: Sequence):
+        """Finish a sequence that reached max_tokens or the model length"""
+        if len(seq.output_token_ids) >= seq.sampling_params.max_tokens:
+            seq.finish('length')
+        elif seq.num_tokens >= self.max_model_len:
+            seq.finish('length')
+                            
+    def get_stats(self) -> Dict[str, float]:
+        """Get engine and scheduler statistics"""
+        return self.scheduler.get_stats()
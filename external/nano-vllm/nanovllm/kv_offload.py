@@ -0,0 +1,436 @@
+"""
+Tiered KV storage for nano-vLLM
+Swaps preempted sequences' KV blocks to pinned host memory or memory-mapped disk and persists prefix-cache blocks across restarts
+"""
+
+import os
+import math
+import json
+import fcntl
+import hashlib
+import torch
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cache_manager import KVCacheManager
+
+def block_digest(parent: bytes, token_ids: Sequence[int]) -> bytes:
+    """Chained hash of one full block of token IDs and every token before it"""
+    return hashlib.sha1(parent + array('q', token_ids).tobytes()).digest()
+
+def _block_checksum(block: torch.Tensor) -> str:
+    """Hash of a stored block's bytes, to detect blocks overwritten after the index was written"""
+    return hashlib.blake2b(block.contiguous().view(torch.uint8).numpy(), digest_size=16).hexdigest()
+
+def get_num_blocks(kv_cache: KVCacheManager, space_gb: float) -> int:
+    """Number of kv_cache blocks that fit in space_gb GiB"""
+    block = kv_cache.kv_pool[:, :, 0]
+    return int(space_gb * 1024**3 // (block.numel() * block.element_size()))
+
+class KVBlockPool:
+    """
+    Fixed pool of KV blocks outside the device block pool
+    
+    Backed by host memory (pinned when blocks move to and from a GPU) or by
+    a memory-mapped file. Each block is contiguous and laid out as
+    [num_layers, 2, block_size, num_kv_heads, head_dim].
+    """
+    
+    def __init__(
+        self,
+        num_blocks: int,
+        block_shape: Tuple[int, ...],
+        dtype: torch.dtype,
+        path: Optional[str] = None,
+        pin_memory: bool = False
+    ):
+        self.num_blocks = num_blocks
+        self.path = path
+        shape = (num_blocks, *block_shape)
+        
+        if path is None:
+            self.blocks = torch.empty(shape, dtype=dtype, pin_memory=pin_memory)
+        else:
+            numel = math.prod(shape)
+            nbytes = numel * torch.tensor([], dtype=dtype).element_size()
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, 'ab') as f:
+                if f.tell() < nbytes:
+                    # Sparse: disk is only used as blocks are written
+                    f.truncate(nbytes)
+            self.blocks = torch.from_file(path, shared=True, size=numel, dtype=dtype).view(shape)
+            
+        self.free_blocks = deque(range(num_blocks))
+        
+    def get_num_free_blocks(self) -> int:
+        """Number of unused blocks"""
+        return len(self.free_blocks)
+        
+    def allocate(self, num_blocks: int) -> Optional[List[int]]:
+        """Take num_blocks free blocks, or None if there are not enough"""
+        if num_blocks > len(self.free_blocks):
+            return None
+        return [self.free_blocks.popleft() for _ in range(num_blocks)]
+        
+    def free(self, block_ids: List[int]):
+        """Return blocks to the pool"""
+        self.free_blocks.extend(block_ids)
+
+class SwapEntry:
+    """Where a swapped-out sequence's KV blocks live"""
+    
+    __slots__ = ('pool', 'block_ids', 'seq_len', 'pending')
+    
+    def __init__(self, pool: KVBlockPool, block_ids: List[int], seq_len: int, pending: Optional[Future] = None):
+        self.pool = pool
+        self.block_ids = block_ids
+        self.seq_len = seq_len
+        # Background disk write that must finish before the blocks are read
+        self.pending = pending
+
+class KVSwapper:
+    """
+    Moves whole sequences between the device block pool and slower tiers
+    
+    Features:
+    - Tiers: device -> pinned host memory -> memory-mapped disk file; a
+      sequence goes to the fastest tier with room for all its blocks
+    - On GPU, copies run on a side stream and the compute stream waits on
+      it, so the host never blocks on a swap to or from host memory
+    - Disk writes are staged in pinned memory and finished on a background
+      thread; swapping a sequence back in waits only for its own write
+      
+    Swapped-out blocks are private copies, so blocks shared with the prefix
+    cache or a forked sequence are copied too and unshared on swap-in.
+    """
+    
+    def __init__(
+        self,
+        kv_cache: KVCacheManager,
+        num_host_blocks: int,
+        num_disk_blocks: int = 0,
+        disk_path: Optional[str] = None
+    ):
+        """
+        Args:
+            kv_cache: Device block pool to swap out of
+            num_host_blocks: Capacity of the host memory tier in blocks
+            num_disk_blocks: Capacity of the disk tier in blocks (0 disables it)
+            disk_path: File backing the disk tier; deleted on close
+        """
+        self.kv_cache = kv_cache
+        self.block_shape = tuple(kv_cache.kv_pool[:, :, 0].shape)
+        device = kv_cache.device
+        self.stream = torch.cuda.Stream(device) if device.type == 'cuda' else None
+        
+        self.tiers: List[KVBlockPool] = []
+        if num_host_blocks > 0:
+            self.tiers.append(KVBlockPool(
+                num_host_blocks, self.block_shape, kv_cache.dtype, pin_memory=self.stream is not None
+            ))
+        self.disk = None
+        self.writer = None
+        if num_disk_blocks > 0:
+            if disk_path is None:
+                raise ValueError("disk_path is required for a disk swap tier")
+            self.disk = KVBlockPool(num_disk_blocks, self.block_shape, kv_cache.dtype, path=disk_path)
+            self.tiers.append(self.disk)
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kv-swap")
+            
+        self.swapped: Dict[int, SwapEntry] = {}
+        self.num_swap_outs = 0
+        self.num_swap_ins = 0
+        self.blocks_swapped_out = 0
+        self.blocks_swapped_in = 0
+        self.disk_blocks_written = 0
+        
+    def can_swap_out(self, seq_id: int) -> bool:
+        """Whether some tier has room for all blocks of a sequence"""
+        num_blocks = len(self.kv_cache.block_tables[seq_id])
+        return any(pool.get_num_free_blocks() >= num_blocks for pool in self.tiers)
+        
+    def swap_out(self, seq_id: int) -> bool:
+        """
+        Copy a sequence's blocks to the fastest tier with room and free them on the device
+        
+        Returns:
+            False if no tier has room (the sequence is left untouched)
+        """
+        device_blocks = self.kv_cache.block_tables[seq_id]
+        for pool in self.tiers:
+            block_ids = pool.allocate(len(device_blocks))
+            if block_ids is not None:
+                break
+        else:
+            return False
+            
+        pending = self._copy_out(device_blocks, pool, block_ids)
+        self.swapped[seq_id] = SwapEntry(pool, block_ids, self.kv_cache.seq_lens[seq_id], pending)
+        self.kv_cache.free(seq_id)
+        
+        self.num_swap_outs += 1
+        self.blocks_swapped_out += len(block_ids)
+        return True
+        
+    def get_num_swap_in_blocks(self, seq_id: int) -> int:
+        """Device blocks needed to swap a sequence back in"""
+        return len(self.swapped[seq_id].block_ids)
+        
+    def swap_in(self, seq_id: int):
+        """Allocate device blocks for a swapped-out sequence and copy its KV back"""
+        entry = self.swapped.pop(seq_id)
+        self.kv_cache.allocate(seq_id, entry.seq_len)
+        if entry.pending is not None:
+            entry.pending.result()
+            
+        device_blocks = self.kv_cache.block_tables[seq_id]
+        kv_pool = self.kv_cache.kv_pool
+        if self.stream is None:
+            kv_pool[:, :, device_blocks] = entry.pool.blocks[entry.block_ids].permute(1, 2, 0, 3, 4, 5)
+        else:
+            compute_stream = torch.cuda.current_stream(self.kv_cache.device)
+            self.stream.wait_stream(compute_stream)
+            with torch.cuda.stream(self.stream):
+                for device_block, block_id in zip(device_blocks, entry.block_ids):
+                    kv_pool[:, :, device_block].copy_(entry.pool.blocks[block_id], non_blocking=True)
+            compute_stream.wait_stream(self.stream)
+            
+        # Later copies into these blocks are queued behind this one on the same stream
+        entry.pool.free(entry.block_ids)
+        self.num_swap_ins += 1
+        self.blocks_swapped_in += len(entry.block_ids)
+        
+    def free(self, seq_id: int):
+        """Drop a swapped-out sequence's blocks (e.g. after an abort)"""
+        entry = self.swapped.pop(seq_id, None)
+        if entry is None:
+            return
+        if entry.pending is not None:
+            entry.pending.result()
+        entry.pool.free(entry.block_ids)
+        
+    def is_swapped(self, seq_id: int) -> bool:
+        """Whether a sequence's KV currently lives outside the device"""
+        return seq_id in self.swapped
+        
+    def _copy_out(self, device_blocks: List[int], pool: KVBlockPool, block_ids: List[int]) -> Optional[Future]:
+        """Queue the device -> tier copies; returns the pending disk write, if any"""
+        kv_pool = self.kv_cache.kv_pool
+        if self.stream is None:
+            pool.blocks[block_ids] = kv_pool[:, :, device_blocks].permute(2, 0, 1, 3, 4, 5)
+            if pool is self.disk:
+                self.disk_blocks_written += len(block_ids)
+            return None
+            
+        # Wait for the forward pass that wrote these blocks; the freed blocks
+        # must not be overwritten before the copies are done
+        compute_stream = torch.cuda.current_stream(self.kv_cache.device)
+        self.stream.wait_stream(compute_stream)
+        with torch.cuda.stream(self.stream):
+            if pool is self.disk:
+                target = torch.empty((len(block_ids), *self.block_shape), dtype=kv_pool.dtype, pin_memory=True)
+                rows = range(len(block_ids))
+            else:
+                target = pool.blocks
+                rows = block_ids
+            for row, device_block in zip(rows, device_blocks):
+                target[row].copy_(kv_pool[:, :, device_block], non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        compute_stream.wait_stream(self.stream)
+        
+        if pool is not self.disk:
+            return None
+        return self.writer.submit(self._write_disk, event, target, block_ids)
+        
+    def _write_disk(self, event: 'torch.cuda.Event', staging: torch.Tensor, block_ids: List[int]):
+        """Background thread: move staged blocks into the memory-mapped file"""
+        event.synchronize()
+        self.disk.blocks[block_ids] = staging
+        self.disk_blocks_written += len(block_ids)
+        
+    def close(self):
+        """Finish pending writes and remove the disk swap file"""
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)
+            self.writer = None
+        self.swapped.clear()
+        if self.disk is not None:
+            self.disk.blocks = None
+            try:
+                os.remove(self.disk.path)
+            except FileNotFoundError:
+                pass
+            self.disk = None
+            
+    def get_stats(self) -> Dict[str, float]:
+        """Swap counts and tier occupancy"""
+        stats = {
+            'num_swapped': len(self.swapped),
+            'num_swap_outs': self.num_swap_outs,
+            'num_swap_ins': self.num_swap_ins,
+            'blocks_swapped_out': self.blocks_swapped_out,
+            'blocks_swapped_in': self.blocks_swapped_in,
+            'disk_blocks_written': self.disk_blocks_written
+        }
+        for pool in self.tiers:
+            name = 'host' if pool.path is None else 'disk'
+            stats[f'{name}_blocks'] = pool.num_blocks
+            stats[f'{name}_free_blocks'] = pool.get_num_free_blocks()
+        return stats
+
+class PersistentPrefixStore:
+    """
+    Prefix-cache blocks kept in a memory-mapped file across restarts
+    
+    Blocks are keyed by a chained hash of every token up to the end of the
+    block (block_digest), so a key identifies the whole prefix. Entries are
+    evicted least recently used once the file is full. flush() replaces the
+    index atomically, so a process that dies keeps the last flushed index.
+    Each entry records a checksum of its block; a block overwritten after
+    that flush fails the check when loaded and is dropped. One process owns
+    a store directory at a time.
+    """
+    
+    INDEX = "index.json"
+    DATA = "blocks.bin"
+    LOCK = "lock"
+    
+    def __init__(self, path: str, num_blocks: int, block_shape: Tuple[int, ...], dtype: torch.dtype):
+        """
+        Raises:
+            RuntimeError: If another process holds the store directory
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock_file = open(os.path.join(path, self.LOCK), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise RuntimeError(f"Prefix store {path} is in use by another process")
+            
+        self.layout = {'num_blocks': num_blocks, 'block_shape': list(block_shape), 'dtype': str(dtype)}
+        self.pool = KVBlockPool(num_blocks, block_shape, dtype, path=os.path.join(path, self.DATA))
+        self.entries: 'OrderedDict[bytes, int]' = OrderedDict()
+        self.checksums: Dict[bytes, str] = {}
+        
+        index = self._read_index(os.path.join(path, self.INDEX))
+        if index.get('layout') == self.layout:
+            for entry in index['entries']:
+                # Entries without a checksum cannot be validated
+                if len(entry) == 3 and 0 <= entry[1] < num_blocks:
+                    digest = bytes.fromhex(entry[0])
+                    self.entries[digest] = entry[1]
+                    self.checksums[digest] = entry[2]
+            used = set(self.entries.values())
+            self.pool.free_blocks = deque(b for b in range(num_blocks) if b not in used)
+            
+        self.num_loaded = len(self.entries)
+        self.hits = 0
+        self.blocks_written = 0
+        self.num_corrupt = 0
+        
+    @staticmethod
+    def _read_index(index_path: str) -> dict:
+        try:
+            with open(index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+            
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.entries
+        
+    def load(self, digest: bytes, kv_cache: KVCacheManager, block_id: int) -> bool:
+        """
+        Copy a stored block into a device block
+        
+        Returns:
+            False if digest is not stored or its block fails the checksum
+        """
+        file_block = self.entries.get(digest)
+        if file_block is None:
+            return False
+        block = self.pool.blocks[file_block]
+        if _block_checksum(block) != self.checksums[digest]:
+            self._remove(digest)
+            self.num_corrupt += 1
+            return False
+        self.entries.move_to_end(digest)
+        kv_cache.kv_pool[:, :, block_id].copy_(block)
+        self.hits += 1
+        return True
+        
+    def save(self, digests: List[bytes], kv_cache: KVCacheManager, block_ids: List[int]) -> int:
+        """
+        Write device blocks under their digests, evicting the oldest entries if full
+        
+        Returns:
+            Number of blocks written (already stored digests are only touched)
+        """
+        new = []
+        for digest, block_id in zip(digests, block_ids):
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+            else:
+                new.append((digest, block_id))
+        new = new[-self.pool.num_blocks:]
+        if not new:
+            return 0
+            
+        while self.pool.get_num_free_blocks() < len(new):
+            self._remove(next(iter(self.entries)))
+            
+        file_blocks = self.pool.allocate(len(new))
+        data = kv_cache.kv_pool[:, :, [block_id for _, block_id in new]].permute(2, 0, 1, 3, 4, 5)
+        self.pool.blocks[file_blocks] = data.to('cpu')
+        for (digest, _), file_block in zip(new, file_blocks):
+            self.entries[digest] = file_block
+            self.checksums[digest] = _block_checksum(self.pool.blocks[file_block])
+            
+        self.blocks_written += len(new)
+        return len(new)
+        
+    def _remove(self, digest: bytes):
+        """Drop an entry and return its block to the pool"""
+        self.pool.free([self.entries.pop(digest)])
+        del self.checksums[digest]
+        
+    def flush(self):
+        """Atomically replace the index so the stored blocks are found after a restart"""
+        index_path = os.path.join(self.path, self.INDEX)
+        staging = f"{index_path}.{os.getpid()}.tmp"
+        with open(staging, 'w') as f:
+            json.dump({
+                'layout': self.layout,
+                'entries': [
+                    [digest.hex(), block_id, self.checksums[digest]]
+                    for digest, block_id in self.entries.items()
+                ]
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(staging, index_path)
+        
+    def close(self):
+        """Flush the index and release the store directory"""
+        if self._lock_file.closed:
+            return
+        self.flush()
+        self.pool.blocks = None
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        
+    def get_stats(self) -> Dict[str, float]:
+        """Stored blocks, restart carry-over and hits"""
+        return {
+            'stored_blocks': len(self.entries),
+            'max_blocks': self.pool.num_blocks,
+            'loaded_at_start': self.num_loaded,
+            'disk_hits': self.hits,
+            'blocks_written': self.blocks_written,
+            'corrupt_blocks': self.num_corrupt
+        }
@@ -3,16 +3,29 @@ LLM: Core inference engine for nano-vLLM
 Lightweight implementation focusing on performance and readability
 """
 
+import os
 import torch
 import torch.nn as nn
 from typing import List, Dict, Any, Optional
-from transformers import AutoTokenizer, AutoModelForCausalLM
 import time
+from collections import deque
 
 from .sampling_params import SamplingParams
 from .model_manager import ModelManager
 from .cache_manager import KVCacheManager
-from .optimizations import PrefixCache, TensorParallel
+from .optimizations import PrefixCache, AdaptiveBatching
+from .engine import LLMEngine
+from .sampler import Sampler, SamplingTensors, make_generator
+from .metrics import StatsRecorder
+from .loader import ArtifactCache, StartupTimer, get_cache_dir
+from .speculative import DraftModelProposer, NgramProposer
+from .tokenization import TokenizerPool, IncrementalDetokenizer
+from .tensor_parallel import TensorParallelWorkers, load_sharded_model
+from .kv_offload import KVSwapper, PersistentPrefixStore, get_num_blocks
+from .stop_strings import StopStringDetokenizer
+from .constrained import GuideCompiler
+from .result_cache import ResultCache, is_deterministic, result_key
+from .compilation import CompiledDecoder, configure_compile_cache
 
 class LLM:
     """
@@ -20,9 +33,19 @@ class LLM:
     
     Features:
     - Fast offline inference comparable to vLLM
-    - Prefix caching for repeated prompts
-    - Tensor parallelism support
+    - Continuous batching with iteration-level scheduling
+    - Chunked prefill so long prompts do not stall running requests
+    - Token-level prefix caching that reuses computed KV blocks
+    - Tensor parallelism across worker processes (NCCL, or gloo on CPU)
     - Memory-efficient KV cache management
+    - KV swap to pinned host memory or disk on preemption, and a prefix
+      cache that persists on disk across restarts
+    - Speculative decoding with a draft model or n-gram prompt lookup
+    - Prompt tokenization on a worker pool, overlapped with generation
+    - Stop strings matched in the streamed text, and regex / JSON schema
+      constrained decoding through cached per-state vocabulary masks
+    - Deterministic requests deduplicated within a call and optionally
+      served from an on-disk result cache
     """
     
     def __init__(
@@ -32,6 +55,32 @@ class LLM:
         enforce_eager: bool = True,
         max_model_len: Optional[int] = None,
         gpu_memory_utilization: float = 0.8,
+        max_num_seqs: int = 32,
+        max_num_batched_tokens: int = 8192,
+        prefill_chunk_size: Optional[int] = 512,
+        max_num_kv_tokens: Optional[int] = None,
+        block_size: int = 16,
+        enable_prefix_caching: bool = True,
+        prefix_cache_max_blocks: Optional[int] = None,
+        stats_recorder: Optional[StatsRecorder] = None,
+        dtype: Optional[torch.dtype] = None,
+        speculative_model: Optional[str] = None,
+        num_speculative_tokens: int = 0,
+        ngram_prompt_lookup_max: int = 4,
+        ngram_prompt_lookup_min: int = 1,
+        load_format: str = "auto",
+        cache_dir: Optional[str] = None,
+        num_load_workers: int = 8,
+        model_manager: Optional[ModelManager] = None,
+        quantization: Optional[str] = None,
+        quantization_group_size: int = 128,
+        num_tokenizer_workers: int = 4,
+        tokenizer_cache_size: int = 1024,
+        swap_space: Optional[float] = None,
+        disk_swap_space: float = 0.0,
+        prefix_cache_disk_space: float = 0.0,
+        result_cache_disk_space: float = 0.0,
+        max_seq_len_to_capture: int = 1024,
         **kwargs
     ):
         """
@@ -39,58 +88,323 @@ class LLM:
         
         Args:
             model_path: Path to model (local or HuggingFace)
-            tensor_parallel_size: Number of GPUs for tensor parallelism
-            enforce_eager: Force eager execution (disable graph compilation)
+            tensor_parallel_size: Ranks sharing each attention/MLP layer; ranks
+                1.. run in spawned worker processes (one GPU each, or CPU/gloo)
+            enforce_eager: Run decode eagerly; False compiles decode steps for
+                padded batch-size and KV-length buckets (CUDA graphs on GPU,
+                inductor C++ kernels on CPU), cached under cache_dir
             max_model_len: Maximum sequence length
             gpu_memory_utilization: GPU memory usage ratio
+            max_num_seqs: Maximum number of sequences per batch
+            max_num_batched_tokens: Token budget per engine step: decode tokens
+                plus padded prefill tokens (lower it to bound inter-token latency)
+            prefill_chunk_size: Most prompt tokens prefilled per sequence in one
+                step; longer prompts are prefilled over several steps between
+                decode steps (None prefills each prompt in one step)
+            max_num_kv_tokens: Cap on KV cache capacity in tokens
+            block_size: Tokens per KV cache block
+            enable_prefix_caching: Reuse KV blocks of shared prompt prefixes
+            prefix_cache_max_blocks: Cap on KV blocks held by the prefix cache
+            stats_recorder: Receives per-step and per-token timings (disabled if None)
+            dtype: Weight dtype (default float16 on GPU, float32 on CPU)
+            speculative_model: Draft model path; with num_speculative_tokens > 0
+                and no draft model, n-gram prompt lookup proposes the drafts
+            num_speculative_tokens: Draft tokens verified per decode step (0 disables)
+            ngram_prompt_lookup_max: Longest suffix n-gram matched by prompt lookup
+            ngram_prompt_lookup_min: Shortest suffix n-gram matched by prompt lookup
+            load_format: "auto", "safetensors" (memory-mapped) or "hf" (from_pretrained)
+            cache_dir: Local cache for tokenizer and config (default ~/.cache/nanovllm)
+            num_load_workers: Threads loading safetensors shards in parallel
+            model_manager: Shared model registry (a private one is created if None;
+                load_format, cache_dir and num_load_workers then come from it)
+            quantization: Weight-only quantization of Linear layers, "int8"
+                (per channel) or "int4" (per group); None keeps dtype weights
+            quantization_group_size: Input features per int4 scale
+            num_tokenizer_workers: Threads tokenizing prompts and decoding outputs
+            tokenizer_cache_size: Prompts whose tokenization is cached (0 disables
+                the prompt and prefix tokenization caches)
+            swap_space: GiB of pinned host memory for the KV of preempted
+                sequences (default 4 on GPU, 0 on CPU; 0 preempts by recompute)
+            disk_swap_space: GiB of memory-mapped disk for preempted sequences
+                once swap_space is full
+            prefix_cache_disk_space: GiB of prefix-cache blocks kept on disk
+                under cache_dir and reused after a restart (0 disables)
+            result_cache_disk_space: GiB of generate() outputs for greedy or
+                seeded requests kept under cache_dir and reused by later
+                runs (0 disables)
+            max_seq_len_to_capture: Longest cached length decoded through a
+                compiled graph; longer batches decode eagerly
         """
         self.model_path = model_path
         self.tensor_parallel_size = tensor_parallel_size
         self.enforce_eager = enforce_eager
         self.max_model_len = max_model_len
         self.gpu_memory_utilization = gpu_memory_utilization
+        self.dtype = dtype or (torch.float16 if torch.cuda.is_available() else torch.float32)
+        self.quantization = quantization
+        self.quantization_group_size = quantization_group_size
+        self.prefill_chunk_size = prefill_chunk_size
+        
+        self.startup_timer = StartupTimer()
+        self._pinned_models: List[str] = []
         
         # Initialize components
-        self.model_manager = ModelManager()
-        self.kv_cache = KVCacheManager()
-        self.prefix_cache = PrefixCache()
+        self.model_manager = model_manager or ModelManager(
+            cache_dir=cache_dir, load_format=load_format, num_load_workers=num_load_workers
+        )
+        self.adaptive_batching = AdaptiveBatching(
+            max_batch_size=max_num_seqs,
+            max_num_batched_tokens=max_num_batched_tokens
+        )
         self.tensor_parallel = None
+        self.parallel_workers = None
         
         if tensor_parallel_size > 1:
-            self.tensor_parallel = TensorParallel(tensor_parallel_size)
-        
+            # Workers load their own shards while this process loads rank 0's
+            self.parallel_workers = TensorParallelWorkers(
+                tensor_parallel_size,
+                model_path,
+                {
+                    'dtype': self.dtype,
+                    'quantization': quantization,
+                    'quantization_group_size': quantization_group_size,
+                    'cache_dir': self.model_manager.cache_dir,
+                    'load_format': self.model_manager.load_format,
+                    'num_load_workers': self.model_manager.num_load_workers
+                }
+            )
+            self.tensor_parallel = self.parallel_workers.tensor_parallel
+            
         # Load model and tokenizer
         self._load_model()
+        self.tokenizer_pool = TokenizerPool(
+            self.tokenizer, num_workers=num_tokenizer_workers, cache_size=tokenizer_cache_size
+        )
         
+        # The draft model and its KV cache come before the target pool takes the rest
+        proposer = None
+        if num_speculative_tokens > 0:
+            with self.startup_timer.phase('draft_model'):
+                proposer = self._create_proposer(
+                    speculative_model, block_size, max_num_seqs,
+                    ngram_prompt_lookup_max, ngram_prompt_lookup_min
+                )
+                
+        # Preallocate the paged KV cache from what is left of the memory budget
+        with self.startup_timer.phase('kv_cache'):
+            self.kv_cache = KVCacheManager.from_model(
+                self.model,
+                block_size=block_size,
+                memory_utilization=gpu_memory_utilization,
+                max_num_tokens=max_num_kv_tokens or max_num_seqs * self.max_model_len,
+                tensor_parallel_size=tensor_parallel_size
+            )
+            if self.parallel_workers is not None:
+                self.parallel_workers.init_kv_cache(self.kv_cache.num_blocks, block_size)
+            
+        # Lower KV tiers: swap space for preemption and the on-disk prefix store
+        self.kv_swapper = None
+        prefix_store = None
+        if swap_space is None:
+            swap_space = 4.0 if self.device.type == 'cuda' and self.parallel_workers is None else 0.0
+        if self.parallel_workers is not None and (swap_space or disk_swap_space or prefix_cache_disk_space):
+            print("⚠️  KV swap and prefix persistence are not supported with tensor parallelism")
+        else:
+            self.kv_swapper = self._create_kv_swapper(swap_space, disk_swap_space)
+            if enable_prefix_caching and prefix_cache_disk_space > 0:
+                prefix_store = self._open_prefix_store(prefix_cache_disk_space, block_size)
+                
+        self.prefix_cache = None
+        if enable_prefix_caching:
+            self.prefix_cache = PrefixCache(self.kv_cache, max_blocks=prefix_cache_max_blocks, store=prefix_store)
+            
+        # Vocabulary masks are built on first use of a regex or JSON schema
+        self.guide_compiler = GuideCompiler(
+            self.tokenizer, getattr(self.model.config, 'vocab_size', len(self.tokenizer)), self.device
+        )
+                        
+        with self.startup_timer.phase('engine'):
+            self.engine = LLMEngine(
+                self.model,
+                self.tokenizer,
+                self.kv_cache,
+                self.max_model_len,
+                max_num_seqs=max_num_seqs,
+                max_num_batched_tokens=max_num_batched_tokens,
+                adaptive_batching=self.adaptive_batching,
+                prefix_cache=self.prefix_cache,
+                stats_recorder=stats_recorder,
+                proposer=proposer,
+                num_speculative_tokens=num_speculative_tokens,
+                tokenizer_pool=self.tokenizer_pool,
+                parallel_workers=self.parallel_workers,
+                prefill_chunk_size=prefill_chunk_size,
+                kv_swapper=self.kv_swapper,
+                guide_compiler=self.guide_compiler
+            )
+        self.model_runner = self.engine.model_runner
+        self.speculative_decoder = self.engine.speculative_decoder
+        
+        self.compiled_decoder = None
+        if not enforce_eager:
+            if self.speculative_decoder is not None or self.parallel_workers is not None:
+                print("⚠️  Compiled decode is not supported with speculative decoding or tensor parallelism; running eagerly")
+            else:
+                with self.startup_timer.phase('compile'):
+                    self.compiled_decoder = self._create_compiled_decoder(max_num_seqs, max_seq_len_to_capture)
+                self.model_runner.compiled_decoder = self.compiled_decoder
+        
+        # Everything besides the prompt and SamplingParams that can change an output
+        artifact_cache = ArtifactCache(model_path, self.model_manager.cache_dir)
+        self.model_identity = "|".join([
+            artifact_cache.identity,
+            self._weight_layout(self.dtype),
+            f"tp{tensor_parallel_size}",
+            f"len{self.max_model_len}",
+            f"spec-{speculative_model or 'ngram'}-{num_speculative_tokens}" if num_speculative_tokens else "spec-none"
+        ])
+        self.result_cache = None
+        if result_cache_disk_space > 0:
+            self.result_cache = ResultCache(
+                artifact_cache.result_cache_path(self._weight_layout(self.dtype)), result_cache_disk_space
+            )
+        self.num_deduplicated = 0
+                
         print(f"✅ nano-vLLM initialized: {model_path}")
         print(f"   Tensor Parallel: {tensor_parallel_size}")
         print(f"   Max Length: {self.max_model_len}")
         print(f"   GPU Memory: {gpu_memory_utilization*100}%")
-        
+        print(f"   KV Cache: {self.kv_cache.num_blocks} blocks x {block_size} tokens")
+        if self.quantization is not None:
+            saved = self.quantization_stats['memory_saved_bytes'] / 1024**3
+            print(f"   Quantization: {self.quantization} ({saved:.2f} GB saved)")
+        if self.speculative_decoder is not None:
+            print(f"   Speculative: {speculative_model or 'ngram'} x {num_speculative_tokens} tokens")
+        if self.kv_swapper is not None:
+            swap_stats = self.kv_swapper.get_stats()
+            print(
+                f"   KV Swap: {swap_stats.get('host_blocks', 0)} host + "
+                f"{swap_stats.get('disk_blocks', 0)} disk blocks"
+            )
+        if prefix_store is not None:
+            print(f"   Prefix Store: {len(prefix_store.entries)} blocks loaded from {prefix_store.path}")
+        if self.result_cache is not None:
+            print(f"   Result Cache: {self.result_cache.get_stats()['entries']} results in {self.result_cache.path}")
+        if self.compiled_decoder is not None:
+            print(
+                f"   Compiled Decode: {len(self.compiled_decoder.batch_buckets)} batch x "
+                f"{len(self.compiled_decoder.length_buckets)} length buckets ({self.compiled_decoder.mode})"
+            )
+        self.startup_timer.report()
+                            
     def _load_model(self):
         """Load model and tokenizer"""
-        print(f"📥 Loading model: {self.model_path}")
-        
-        # Load tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        # Memory-mapped safetensors when available; tokenizer and config from the local cache
+        load_kwargs = {
+            'dtype': self.dtype,
+            'timer': self.startup_timer,
+            'quantization': self.quantization,
+            'quantization_group_size': self.quantization_group_size
+        }
+        if self.tensor_parallel is not None:
+            model_info = load_sharded_model(
+                self.model_manager, self.model_path, self.tensor_parallel, **load_kwargs
+            )
+        else:
+            model_info = self.model_manager.load_model(self.model_path, load_weights=True, **load_kwargs)
+        self.model = model_info.model
+        self.quantization_stats = model_info.quantization_stats
+        self.tokenizer = model_info.tokenizer
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
             
-        # Load model
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_path,
-            torch_dtype=torch.float16,
-            device_map="auto",
-            trust_remote_code=True
-        )
-        
-        # Setup for inference
-        self.model.eval()
+        self.device = next(self.model.parameters()).device
         
         # Configure max length
         if self.max_model_len is None:
             self.max_model_len = getattr(self.model.config, 'max_position_embeddings', 2048)
             
+    def _create_kv_swapper(self, swap_space: float, disk_swap_space: float) -> Optional[KVSwapper]:
+        """Host and disk swap tiers for preempted sequences (None if both are empty)"""
+        num_host_blocks = get_num_blocks(self.kv_cache, swap_space)
+        num_disk_blocks = get_num_blocks(self.kv_cache, disk_swap_space)
+        if num_host_blocks == 0 and num_disk_blocks == 0:
+            return None
+            
+        disk_path = os.path.join(
+            get_cache_dir(self.model_manager.cache_dir), "kv", f"swap-{os.getpid()}-{id(self)}.bin"
+        )
+        return KVSwapper(self.kv_cache, num_host_blocks, num_disk_blocks, disk_path)
+        
+    def _create_compiled_decoder(self, max_num_seqs: int, max_seq_len_to_capture: int) -> CompiledDecoder:
+        """Compile the decode step for every batch bucket, reusing graphs cached on disk"""
+        cache_path = configure_compile_cache(get_cache_dir(self.model_manager.cache_dir))
+        max_len = min(max_seq_len_to_capture, self.max_model_len)
+        decoder = CompiledDecoder(
+            self.model,
+            self.kv_cache,
+            self.model_runner.pad_token_id,
+            max_num_seqs=max_num_seqs,
+            max_len=max_len
+        )
+        # Every bucket up front, so no request waits on a compile or capture
+        seconds = decoder.warmup(max_len=max_len)
+        print(
+            f"🔥 Compiled decode for batch sizes {decoder.batch_buckets} x KV lengths "
+            f"{decoder.length_buckets} in {seconds:.1f}s ({cache_path})"
+        )
+        return decoder
+        
+    def _weight_layout(self, dtype: torch.dtype) -> str:
+        """Quantization and dtype of the weights or KV, e.g. int4-g128-float16"""
+        quantization = f"{self.quantization}-g{self.quantization_group_size}" if self.quantization else "none"
+        return f"{quantization}-{str(dtype).replace('torch.', '')}"
+        
+    def _open_prefix_store(self, space_gb: float, block_size: int) -> Optional[PersistentPrefixStore]:
+        """On-disk prefix-cache blocks for this model, quantization, dtype and block size"""
+        path = ArtifactCache(self.model_path, self.model_manager.cache_dir).prefix_store_path(
+            f"{self._weight_layout(self.kv_cache.dtype)}-b{block_size}"
+        )
+        try:
+            return PersistentPrefixStore(
+                path,
+                get_num_blocks(self.kv_cache, space_gb),
+                tuple(self.kv_cache.kv_pool[:, :, 0].shape),
+                self.kv_cache.dtype
+            )
+        except RuntimeError as e:
+            print(f"⚠️  {e}; the prefix cache will not persist")
+            return None
+            
+    def _create_proposer(
+        self,
+        speculative_model: Optional[str],
+        block_size: int,
+        max_num_seqs: int,
+        ngram_max: int,
+        ngram_min: int
+    ):
+        """Build the draft token proposer for speculative decoding"""
+        if speculative_model is None:
+            return NgramProposer(max_ngram=ngram_max, min_ngram=ngram_min)
+            
+        print(f"📥 Loading draft model: {speculative_model}")
+        # Pinned for the lifetime of this LLM so a shared registry never evicts it
+        draft_info = self.model_manager.acquire(speculative_model, dtype=self.dtype)
+        self._pinned_models.append(speculative_model)
+        draft_kv_cache = KVCacheManager.from_model(
+            draft_info.model,
+            block_size=block_size,
+            memory_utilization=self.gpu_memory_utilization,
+            max_num_tokens=max_num_seqs * self.max_model_len
+        )
+        return DraftModelProposer(
+            draft_info.model,
+            draft_kv_cache,
+            Sampler(self.tokenizer.eos_token_id),
+            self.tokenizer.pad_token_id
+        )
+        
     def generate(
         self, 
         prompts: List[str], 
@@ -103,6 +417,10 @@ class LLM:
             prompts: List of input prompts
             sampling_params: Sampling configuration
             
+        Greedy and seeded requests are deterministic: identical prompts in
+        one call are generated once, and with result_cache_disk_space their
+        outputs are stored and reused by later calls.
+        
         Returns:
             List of generation results
         """
@@ -111,66 +429,121 @@ class LLM:
             
         print(f"🚀 Generating for {len(prompts)} prompts...")
         start_time = time.time()
+        deterministic = is_deterministic(sampling_params)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        # Key of each deterministic prompt, and the first prompt with each key
+        keys: Dict[int, bytes] = {}
+        owners: Dict[bytes, int] = {}
         
-        results = []
+        # Tokenize in chunks on the worker pool; each chunk is admitted as soon as
+        # it is ready, so later prompts are tokenized while earlier ones run
+        max_length = self.max_model_len - sampling_params.max_tokens
+        chunk_size = self.adaptive_batching.max_batch_size
+        pending = deque(
+            (start, self.tokenizer_pool.submit(prompts[start:start + chunk_size], max_length))
+            for start in range(0, len(prompts), chunk_size)
+        )
         
-        for i, prompt in enumerate(prompts):
-            # Check prefix cache
-            cache_key = self.prefix_cache.get_cache_key(prompt)
-            cached_tokens = self.prefix_cache.get_cached_tokens(cache_key)
-            
-            if cached_tokens is not None:
-                print(f"💾 Using prefix cache for prompt {i+1}")
-                
-            # Tokenize
-            inputs = self.tokenizer(
-                prompt, 
-                return_tensors="pt",
-                truncation=True,
-                max_length=self.max_model_len - sampling_params.max_tokens
-            )
-            
-            # Move to GPU
-            if torch.cuda.is_available():
-                inputs = {k: v.cuda() for k, v in inputs.items()}
+        seqs = [None] * len(prompts)
+        # Length-bucketed batches not yet handed to the engine, as (position, token IDs) lists
+        planned = deque()
+        while pending or planned or self.engine.has_unfinished_requests():
+            # Wait for tokenization only when there is nothing else to run
+            while pending and (
+                pending[0][1].done() or not (planned or self.engine.has_unfinished_requests())
+            ):
+                start, future = pending.popleft()
+                prompt_token_ids = future.result()
                 
-            # Generate
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=sampling_params.max_tokens,
-                    temperature=sampling_params.temperature,
-                    top_k=sampling_params.top_k,
-                    top_p=sampling_params.top_p,
-                    do_sample=sampling_params.temperature > 0,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id
+                # Only the first copy of a deterministic prompt runs, unless its result is stored
+                indices = []
+                for index, ids in enumerate(prompt_token_ids):
+                    if deterministic:
+                        key = result_key(self.model_identity, ids, sampling_params)
+                        keys[start + index] = key
+                        if key in owners:
+                            continue
+                        owners[key] = start + index
+                        stored = self.result_cache.get(key) if self.result_cache is not None else None
+                        if stored is not None:
+                            results[start + index] = {
+                                'text': stored[0],
+                                'prompt': prompts[start + index],
+                                'tokens_generated': len(stored[1]),
+                                'input_tokens': len(ids),
+                                'finish_reason': stored[2]
+                            }
+                            continue
+                    indices.append(index)
+                    
+                batches = self.adaptive_batching.plan_batches(
+                    [len(prompt_token_ids[index]) for index in indices],
+                    sampling_params.max_tokens,
+                    self._available_memory_fraction()
+                )
+                planned.extend(
+                    [(start + indices[i], prompt_token_ids[indices[i]]) for i in batch] for batch in batches
                 )
                 
-            # Decode response
-            input_length = inputs['input_ids'].shape[1]
-            generated_tokens = outputs[0][input_length:]
-            response = self.tokenizer.decode(generated_tokens, skip_special_tokens=True)
-            
-            # Store in prefix cache
-            self.prefix_cache.store_tokens(cache_key, generated_tokens)
-            
-            results.append({
+            # Hand over the next batch only once the previous one has been admitted,
+            # so the prompts prefilled together come from one length bucket
+            if planned and not self.engine.has_waiting_requests():
+                for position, ids in planned.popleft():
+                    seqs[position] = self.engine.add_request(prompts[position], sampling_params, ids)
+                    
+            if self.engine.has_unfinished_requests():
+                self.engine.step()
+                
+        generated = [(position, seq) for position, seq in enumerate(seqs) if seq is not None]
+        responses = self.tokenizer_pool.decode_batch([seq.output_token_ids for _, seq in generated])
+        stored = []
+        
+        for (position, seq), response in zip(generated, responses):
+            if seq.detokenizer is not None:
+                # Text up to the first stop string, already decoded while generating
+                response = seq.detokenizer.output_text
+            results[position] = {
                 'text': response,
-                'prompt': prompt,
-                'tokens_generated': len(generated_tokens),
-                'input_tokens': input_length
-            })
+                'prompt': seq.prompt,
+                'tokens_generated': len(seq.output_token_ids),
+                'input_tokens': seq.num_prompt_tokens,
+                'finish_reason': seq.finish_reason
+            }
+            # Aborted or dead-ended outputs are not the request's result; only store complete ones
+            if position in keys and seq.finish_reason in ('stop', 'length'):
+                stored.append((keys[position], response, list(seq.output_token_ids), seq.finish_reason))
+        if self.result_cache is not None:
+            self.result_cache.put_many(stored)
+            
+        # Duplicates share the result of the first copy
+        num_duplicates = 0
+        for position, key in keys.items():
+            if owners[key] != position:
+                results[position] = dict(results[owners[key]], prompt=prompts[position])
+                num_duplicates += 1
+        self.num_deduplicated += num_duplicates
             
         end_time = time.time()
         total_time = end_time - start_time
-        total_tokens = sum(r['tokens_generated'] for r in results)
+        total_tokens = sum(len(seq.output_token_ids) for _, seq in generated)
         throughput = total_tokens / total_time if total_time > 0 else 0
         
         print(f"✅ Generation complete: {total_tokens} tokens in {total_time:.2f}s ({throughput:.2f} tok/s)")
-        
         return results
         
+    def _available_memory_fraction(self) -> float:
+        """
+        Fraction of KV cache blocks not held by any sequence
+        
+        The KV pool is preallocated up to gpu_memory_utilization, so free
+        device memory says nothing about room for more sequences. Blocks kept
+        only by the prefix cache count as free; they are evicted on demand.
+        """
+        in_use = set()
+        for block_table in self.kv_cache.block_tables.values():
+            in_use.update(block_table)
+        return 1.0 - len(in_use) / max(self.kv_cache.num_blocks, 1)
+        
     def generate_stream(
         self, 
         prompt: str, 
@@ -184,64 +557,130 @@ class LLM:
             sampling_params: Sampling configuration
             
         Yields:
-            Generated tokens as they are produced
+            Text deltas as they are produced; multi-byte characters split
+            across tokens are yielded once complete, and text that may start
+            a stop string once it is ruled out
         """
+        if (
+            self.speculative_decoder is not None
+            or self.parallel_workers is not None
+            or self.compiled_decoder is not None
+        ):
+            # Speculative steps live in the engine and may yield several tokens at once;
+            # tensor-parallel and compiled passes must go through the engine's model runner
+            yield from self._generate_stream_engine(prompt, sampling_params)
+            return
+            
         # Tokenize
-        inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True)
+        prompt_token_ids = self.tokenizer_pool.encode(prompt, self.max_model_len - sampling_params.max_tokens)
+        prompt_ids = torch.tensor([prompt_token_ids], dtype=torch.long, device=self.device)
+        prompt_length = prompt_ids.shape[1]
+        detokenizer = StopStringDetokenizer(self.tokenizer, prompt_token_ids, sampling_params.stop_sequences)
+        guide = self.engine.create_guide(sampling_params)
+        output_token_ids = []
+        max_length = prompt_length + sampling_params.max_tokens
         
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
-            
-        input_length = inputs['input_ids'].shape[1]
+        # Preallocated buffers: each step writes one token instead of concatenating
+        token_buffer = torch.empty((1, max_length), dtype=torch.long, device=self.device)
+        token_buffer[:, :prompt_length] = prompt_ids
+        attention_mask = torch.ones((1, max_length), dtype=torch.long, device=self.device)
+        position_ids = torch.arange(max_length, dtype=torch.long, device=self.device).unsqueeze(0)
         
-        # Generate tokens one by one
+        sampler = self.model_runner.sampler
+        sampling_tensors = SamplingTensors.build(
+            [sampling_params],
+            [make_generator(sampling_params, self.device)],
+            [0],
+            [prompt_token_ids],
+            [[[token_id] for token_id in sampling_params.stop_token_ids]],
+            self.device,
+            [guide]
+        )
+        past_key_values = None
+        chunk_size = self.prefill_chunk_size or prompt_length
+        start, end = 0, min(chunk_size, prompt_length)
+        
+        # Prefill in chunks, then feed only the newest token against the KV cache
         with torch.no_grad():
+            while end < prompt_length:
+                past_key_values = self.model(
+                    input_ids=token_buffer[:, start:end],
+                    attention_mask=attention_mask[:, :end],
+                    position_ids=position_ids[:, start:end],
+                    past_key_values=past_key_values,
+                    use_cache=True
+                ).past_key_values
+                start, end = end, min(end + chunk_size, prompt_length)
+                
             for _ in range(sampling_params.max_tokens):
-                outputs = self.model(**inputs)
+                outputs = self.model(
+                    input_ids=token_buffer[:, start:end],
+                    attention_mask=attention_mask[:, :end],
+                    position_ids=position_ids[:, start:end],
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                past_key_values = outputs.past_key_values
                 logits = outputs.logits[:, -1, :]
                 
-                # Apply sampling
-                if sampling_params.temperature > 0:
-                    logits = logits / sampling_params.temperature
-                    
-                    if sampling_params.top_k > 0:
-                        # Top-k sampling
-                        top_k_logits, top_k_indices = torch.topk(logits, sampling_params.top_k)
-                        logits = torch.full_like(logits, float('-inf'))
-                        logits.scatter_(1, top_k_indices, top_k_logits)
-                        
-                    if sampling_params.top_p < 1.0:
-                        # Top-p (nucleus) sampling
-                        sorted_logits, sorted_indices = torch.sort(logits, descending=True)
-                        cumulative_probs = torch.cumsum(torch.softmax(sorted_logits, dim=-1), dim=-1)
-                        sorted_indices_to_remove = cumulative_probs > sampling_params.top_p
-                        sorted_indices_to_remove[:, 1:] = sorted_indices_to_remove[:, :-1].clone()
-                        sorted_indices_to_remove[:, 0] = 0
-                        indices_to_remove = sorted_indices_to_remove.scatter(1, sorted_indices, sorted_indices_to_remove)
-                        logits[indices_to_remove] = float('-inf')
-                        
-                    probs = torch.softmax(logits, dim=-1)
-                    next_token = torch.multinomial(probs, num_samples=1)
-                else:
-                    # Greedy sampling
-                    next_token = torch.argmax(logits, dim=-1, keepdim=True)
-                    
+                next_token, stopped = sampler(logits, sampling_tensors)
+                
                 # Check for EOS
                 if next_token.item() == self.tokenizer.eos_token_id:
                     break
                     
-                # Decode and yield token
-                token_text = self.tokenizer.decode(next_token[0], skip_special_tokens=True)
-                yield token_text
-                
-                # Update inputs for next iteration
-                inputs['input_ids'] = torch.cat([inputs['input_ids'], next_token], dim=1)
-                if 'attention_mask' in inputs:
-                    inputs['attention_mask'] = torch.cat([
-                        inputs['attention_mask'], 
-                        torch.ones_like(next_token)
-                    ], dim=1)
+                # Yield whatever text this token completes
+                output_token_ids.append(next_token.item())
+                if guide is not None:
+                    guide.advance(output_token_ids[-1])
+                delta = detokenizer.step(output_token_ids)
+                if delta:
+                    yield delta
+                    
+                if stopped.item() or detokenizer.stopped:
+                    break
                     
+                # Append the token in place for the next iteration
+                token_buffer[:, end] = next_token
+                start, end = end, end + 1
+                self._advance_sampling_tensors(sampling_tensors, token_buffer[:, :end])
+                
+        delta = detokenizer.flush()
+        if delta:
+            yield delta
+                            
+    def _generate_stream_engine(self, prompt: str, sampling_params: SamplingParams):
+        """Stream one request through the continuous-batching engine"""
+        seq = self.engine.add_request(prompt, sampling_params)
+        # With stop strings the engine already detokenizes; stream its released text
+        detokenizer = seq.detokenizer or IncrementalDetokenizer(self.tokenizer, seq.prompt_token_ids)
+        num_streamed = 0
+        try:
+            while not seq.is_finished:
+                self.engine.step()
+                if seq.detokenizer is None:
+                    delta = detokenizer.step(seq.output_token_ids)
+                    if seq.is_finished:
+                        delta += detokenizer.flush()
+                else:
+                    delta = detokenizer.output_text[num_streamed:]
+                    num_streamed = len(detokenizer.output_text)
+                if delta:
+                    yield delta
+        finally:
+            if not seq.is_finished:
+                self.engine.abort_request(seq.seq_id)
+                
+    def _advance_sampling_tensors(self, tensors: SamplingTensors, token_ids: torch.Tensor):
+        """Update single-row sampling tensors after a token is appended"""
+        tensors.output_lens += 1
+        if tensors.token_ids is not None:
+            tensors.token_ids = token_ids
+        if tensors.stop_context is not None and tensors.stop_context.size(1) > 0:
+            tensors.stop_context = torch.cat(
+                [tensors.stop_context[:, 1:], token_ids[:, -1:]], dim=1
+            )
+            
     def get_model_info(self) -> Dict[str, Any]:
         """Get model information and statistics"""
         total_params = sum(p.numel() for p in self.model.parameters())
@@ -254,13 +693,86 @@ class LLM:
             'max_length': self.max_model_len,
             'tensor_parallel_size': self.tensor_parallel_size,
             'device': next(self.model.parameters()).device,
-            'dtype': next(self.model.parameters()).dtype
+            'dtype': next(self.model.parameters()).dtype,
+            'quantization': self.quantization,
+            'quantization_stats': self.quantization_stats
         }
         
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """Get continuous batching statistics, including batch occupancy"""
+        return self.engine.get_stats()
+        
+    def save_prefix_cache(self) -> int:
+        """
+        Write the prefix cache to its on-disk store so it survives a restart
+        
+        Returns:
+            Number of blocks written (0 without prefix_cache_disk_space)
+        """
+        if self.prefix_cache is None:
+            return 0
+        return self.prefix_cache.persist()
+        
+    def close(self):
+        """Release pinned models, stop workers, persist the prefix cache, drop swap files and close the result cache"""
+        for model_path in self._pinned_models:
+            self.model_manager.release(model_path)
+        self._pinned_models.clear()
+        self.tokenizer_pool.shutdown()
+        if self.prefix_cache is not None and self.prefix_cache.store is not None:
+            self.prefix_cache.persist()
+            self.prefix_cache.store.close()
+            self.prefix_cache.store = None
+        if self.kv_swapper is not None:
+            self.kv_swapper.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
+        if self.parallel_workers is not None:
+            self.parallel_workers.shutdown()
+            self.parallel_workers = None
+        
+    def get_startup_stats(self) -> Dict[str, float]:
+        """Seconds spent in each startup phase (config, tokenizer, weights, ...)"""
+        return self.startup_timer.get_stats()
+        
+    def get_tokenizer_stats(self) -> Dict[str, Any]:
+        """Get tokenization cache hit rates and reused tokens"""
+        return self.tokenizer_pool.get_stats()
+        
+    def get_speculative_stats(self) -> Dict[str, Any]:
+        """Get draft acceptance statistics (empty when speculative decoding is off)"""
+        if self.speculative_decoder is None:
+            return {}
+        return self.speculative_decoder.get_stats()
+        
+    def get_compile_stats(self) -> Dict[str, Any]:
+        """Get compiled decode bucket and dispatch statistics (empty with enforce_eager)"""
+        if self.compiled_decoder is None:
+            return {}
+        return self.compiled_decoder.get_stats()
+        
+    def get_guided_decoding_stats(self) -> Dict[str, Any]:
+        """Get constraint compilation and vocabulary mask cache statistics"""
+        return self.guide_compiler.get_stats()
+        
     def get_cache_stats(self) -> Dict[str, Any]:
         """Get KV cache statistics"""
-        return {
-            'prefix_cache_hits': self.prefix_cache.get_hit_rate(),
+        stats = {
             'kv_cache_memory': self.kv_cache.get_memory_usage(),
-            'cache_efficiency': self.prefix_cache.get_efficiency()
+            'kv_cache_blocks': self.kv_cache.get_cache_stats()
         }
+        
+        if self.prefix_cache is not None:
+            stats['prefix_cache_hits'] = self.prefix_cache.get_hit_rate()
+            stats['prefix_tokens_saved'] = self.prefix_cache.tokens_saved
+            stats['cache_efficiency'] = self.prefix_cache.get_efficiency()
+            if self.prefix_cache.store is not None:
+                stats['prefix_store'] = self.prefix_cache.store.get_stats()
+        if self.kv_swapper is not None:
+            stats['swap'] = self.kv_swapper.get_stats()
+        stats['result_cache'] = {'deduplicated': self.num_deduplicated}
+        if self.result_cache is not None:
+            stats['result_cache'].update(self.result_cache.get_stats())
+                        
+        return stats
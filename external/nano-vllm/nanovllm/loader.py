@@ -0,0 +1,275 @@
+"""
+Fast model loading for nano-vLLM
+Memory-maps safetensors shards, keeps a local copy of tokenizer and config, and times each startup phase
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import struct
+import hashlib
+import tempfile
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nanovllm")
+
+# safetensors header dtype names
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool
+}
+
+def get_cache_dir(cache_dir: Optional[str] = None) -> str:
+    """Root of the local artifact cache (NANOVLLM_CACHE_DIR overrides the default)"""
+    return cache_dir or os.environ.get("NANOVLLM_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+class StartupTimer:
+    """Wall-clock breakdown of startup phases"""
+    
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block and add it to the named phase"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.time() - start
+            
+    def get_stats(self) -> Dict[str, float]:
+        """Seconds per phase plus their total"""
+        return {**self.phases, 'total': sum(self.phases.values())}
+        
+    def report(self):
+        """Print the breakdown"""
+        total = sum(self.phases.values())
+        print(f"⏱️  Startup: {total:.2f}s")
+        for name, seconds in self.phases.items():
+            share = seconds / total * 100 if total > 0 else 0.0
+            print(f"   {name}: {seconds:.2f}s ({share:.0f}%)")
+
+class ArtifactCache:
+    """
+    Local disk copy of a model's tokenizer and config
+    
+    The first start saves the tokenizer and config under cache_dir together
+    with the local directory that holds the weight shards. Later starts,
+    including other replicas sharing the volume, read all three from local
+    disk without resolving the model against the Hub or converting a slow
+    tokenizer again. Entries for local model directories are keyed by the
+    modification time of their config.json, so edited checkpoints miss.
+    """
+    
+    MANIFEST = "manifest.json"
+    
+    def __init__(self, model_path: str, cache_dir: Optional[str] = None):
+        self.model_path = model_path
+        self.is_local = os.path.isdir(model_path)
+        
+        source = os.path.abspath(model_path) if self.is_local else model_path
+        if self.is_local:
+            config_file = os.path.join(model_path, "config.json")
+            mtime = os.path.getmtime(config_file) if os.path.exists(config_file) else 0.0
+            source = f"{source}@{mtime}"
+        digest = hashlib.sha1(source.encode()).hexdigest()[:12]
+        name = re.sub(r"[^A-Za-z0-9._-]+", "--", os.path.basename(model_path.rstrip("/")) or "model")
+        
+        self.root = os.path.join(get_cache_dir(cache_dir), "models")
+        self.path = os.path.join(self.root, f"{name}-{digest}")
+        self.quantized_dir = os.path.join(get_cache_dir(cache_dir), "quantized", f"{name}-{digest}")
+        self.kv_dir = os.path.join(get_cache_dir(cache_dir), "kv", f"{name}-{digest}")
+        self.results_dir = os.path.join(get_cache_dir(cache_dir), "results", f"{name}-{digest}")
+        self.manifest = self._read_manifest()
+        
+    def _read_manifest(self) -> Dict[str, str]:
+        try:
+            with open(os.path.join(self.path, self.MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+            
+    @property
+    def is_cached(self) -> bool:
+        """Whether tokenizer and config are on local disk"""
+        return bool(self.manifest)
+        
+    def resolve_weights_dir(self) -> str:
+        """Local directory holding the model's weight files, downloading them on a miss"""
+        weights_dir = self.manifest.get('weights_dir')
+        if weights_dir and os.path.isdir(weights_dir):
+            return weights_dir
+        if self.is_local:
+            return os.path.abspath(self.model_path)
+            
+        from huggingface_hub import snapshot_download
+        return snapshot_download(self.model_path, allow_patterns=["*.json", "*.safetensors"])
+        
+    def quantized_path(self, mode: str, group_size: int, dtype: torch.dtype) -> str:
+        """Location of the cached quantized checkpoint for a quantization layout"""
+        dtype_name = str(dtype).replace("torch.", "")
+        return os.path.join(self.quantized_dir, f"{mode}-g{group_size}-{dtype_name}.safetensors")
+        
+    def prefix_store_path(self, layout: str) -> str:
+        """Directory of the persisted prefix-cache blocks for a KV layout"""
+        return os.path.join(self.kv_dir, layout)
+        
+    def result_cache_path(self, layout: str) -> str:
+        """Directory of the cached generation results for a weight layout"""
+        return os.path.join(self.results_dir, layout)
+        
+    @property
+    def identity(self) -> str:
+        """Name of the model and its version (local checkpoints change it when edited)"""
+        return os.path.basename(self.path)
+                
+    def load_config(self):
+        """Model config, from the cache when present"""
+        if self.is_cached:
+            return AutoConfig.from_pretrained(self.path, trust_remote_code=True)
+        return AutoConfig.from_pretrained(self.model_path, trust_remote_code=True)
+        
+    def load_tokenizer(self):
+        """Tokenizer, from the cache when present"""
+        if self.is_cached:
+            return AutoTokenizer.from_pretrained(self.path, trust_remote_code=True)
+        return AutoTokenizer.from_pretrained(self.model_path, trust_remote_code=True)
+        
+    def save(self, config, tokenizer, weights_dir: Optional[str] = None):
+        """
+        Write tokenizer, config and weight location to the cache
+        
+        Files are written to a temporary directory and renamed into place, so
+        replicas starting together never read a partial entry.
+        """
+        if self.is_cached:
+            return
+            
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.root)
+        try:
+            config.save_pretrained(staging)
+            tokenizer.save_pretrained(staging)
+            manifest = {'model_path': self.model_path, 'created': time.time()}
+            if weights_dir is not None:
+                manifest['weights_dir'] = weights_dir
+            with open(os.path.join(staging, self.MANIFEST), 'w') as f:
+                json.dump(manifest, f)
+            os.rename(staging, self.path)
+            self.manifest = manifest
+        except OSError:
+            # Another replica populated the entry first
+            shutil.rmtree(staging, ignore_errors=True)
+            self.manifest = self._read_manifest()
+
+def find_safetensors(weights_dir: str) -> List[str]:
+    """Shard files of a safetensors checkpoint (empty if there are none)"""
+    index_file = os.path.join(weights_dir, "model.safetensors.index.json")
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            shards = sorted(set(json.load(f)['weight_map'].values()))
+    else:
+        shards = sorted(name for name in os.listdir(weights_dir) if name.endswith(".safetensors"))
+    return [os.path.join(weights_dir, shard) for shard in shards]
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Map a safetensors file into memory without reading it
+    
+    Returns CPU tensors that are views into a private (copy-on-write)
+    mapping of the file; pages are read from disk on first access.
+    """
+    with open(path, 'rb') as f:
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    header.pop('__metadata__', None)
+    
+    data = torch.from_file(path, shared=False, size=os.path.getsize(path), dtype=torch.uint8)
+    offset = 8 + header_len
+    
+    tensors = {}
+    for name, info in header.items():
+        start, end = info['data_offsets']
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        raw = data[offset + start:offset + end]
+        if (offset + start) % torch.empty((), dtype=dtype).element_size():
+            # Misaligned for this dtype: copy instead of viewing
+            raw = raw.clone()
+        tensors[name] = raw.view(dtype).view(info['shape'])
+    return tensors
+
+def load_safetensors_model(
+    config,
+    shard_files: List[str],
+    dtype: torch.dtype,
+    device: torch.device,
+    num_workers: int = 8,
+    prepare: Optional[Callable[[torch.nn.Module], None]] = None
+) -> torch.nn.Module:
+    """
+    Build a model from memory-mapped safetensors shards
+    
+    The module tree is created without allocating or initializing weights,
+    then every parameter is bound to its checkpoint tensor. On CPU, tensors
+    already in dtype are used in place, so weights are paged in lazily as
+    the first forward pass touches them. Otherwise shards are converted and
+    copied to the device in parallel, one thread per shard.
+    
+    Args:
+        prepare: Applied to the empty module tree before binding, e.g. to
+            swap in quantized layers matching a quantized checkpoint
+            
+    Raises:
+        ValueError: If the checkpoint does not cover every parameter
+    """
+    from accelerate import init_empty_weights
+    from accelerate.utils import set_module_tensor_to_device
+    
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+    if prepare is not None:
+        prepare(model)
+    expected = set(model.state_dict().keys())
+    
+    def load_shard(path: str) -> Dict[str, torch.Tensor]:
+        tensors = {}
+        for name, tensor in mmap_safetensors(path).items():
+            if name not in expected:
+                continue
+            if tensor.is_floating_point() and tensor.dtype != dtype:
+                tensor = tensor.to(dtype)
+            tensors[name] = tensor.to(device)
+        return tensors
+        
+    with ThreadPoolExecutor(max_workers=max(1, min(num_workers, len(shard_files)))) as pool:
+        for tensors in pool.map(load_shard, shard_files):
+            for name, tensor in tensors.items():
+                set_module_tensor_to_device(model, name, device, value=tensor)
+                
+    # Tied embeddings are absent from the checkpoint
+    model.tie_weights()
+    missing = [
+        name for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+        if tensor.device.type == 'meta'
+    ]
+    if missing:
+        raise ValueError(f"Checkpoint is missing {len(missing)} tensors, e.g. {missing[:3]}")
+        
+    model.to(device)
+    model.eval()
+    return model
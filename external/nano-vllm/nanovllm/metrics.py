@@ -0,0 +1,49 @@
+"""
+Engine instrumentation hooks for nano-vLLM
+The engine reports step and request timings to an optional StatsRecorder
+"""
+
+from dataclasses import dataclass
+
+from .sequence import Sequence
+
+@dataclass
+class StepStats:
+    """Timings and batch composition of one engine step"""
+    num_prefill_seqs: int
+    num_decode_seqs: int
+    num_prefill_tokens: int
+    num_cached_tokens: int
+    num_preempted: int
+    num_waiting: int
+    prefill_time: float
+    decode_time: float
+    kv_utilization: float
+    
+    @property
+    def batch_size(self) -> int:
+        return self.num_prefill_seqs + self.num_decode_seqs
+
+class StatsRecorder:
+    """
+    Base class for engine metrics sinks
+    
+    LLMEngine calls these hooks only when a recorder is attached, so an
+    engine without one pays a single None check per step. All times are in
+    seconds. Subclasses override the hooks they need.
+    """
+    
+    def record_step(self, stats: StepStats):
+        """Called once per engine step after the batch has run"""
+        
+    def record_scheduled(self, seq: Sequence):
+        """Called when a sequence is scheduled for the first time"""
+        
+    def record_first_token(self, seq: Sequence):
+        """Called when a sequence produces its first token"""
+        
+    def record_inter_token(self, seq: Sequence, latency: float):
+        """Called for every later token with the time since the previous one"""
+        
+    def record_finished(self, seq: Sequence):
+        """Called when a sequence finishes"""
@@ -3,11 +3,25 @@ Model management utilities for nano-vLLM
 Handles model loading, unloading, and metadata
 """
 
+import gc
 import os
 import json
+import time
+import threading
 import torch
-from typing import Dict, List, Any, Optional
-from transformers import AutoConfig
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Any, Optional
+from transformers import AutoConfig, AutoModelForCausalLM
+
+from .loader import ArtifactCache, StartupTimer, find_safetensors, load_safetensors_model
+from .quantization import get_quantization_stats, prepare_quantized_model, quantize_model, save_quantized
+
+LOAD_FORMATS = ("auto", "safetensors", "hf")
+
+# Where a model's weights currently live
+LOCATION_DISK = "disk"
+LOCATION_CPU = "cpu"
+LOCATION_DEVICE = "device"
 
 class ModelInfo:
     """Information about a loaded model"""
@@ -17,7 +31,30 @@ class ModelInfo:
         self.config = config
         self.load_time = None
         self.memory_usage = 0
+        self.model: Optional[torch.nn.Module] = None
+        self.hf_config = None
+        self.tokenizer = None
+        self.startup_timer = StartupTimer()
         
+        # Residency
+        self.location = LOCATION_DISK
+        self.device: Optional[torch.device] = None
+        self.dtype: Optional[torch.dtype] = None
+        self.extra_memory = 0
+        self.num_users = 0
+        self.last_used = 0.0
+        self.num_loads = 0
+        self.num_evictions = 0
+        self.quantization: Optional[str] = None
+        self.quantization_group_size = 128
+        self.quantization_stats: Dict[str, float] = {}
+        self.evict_callbacks: List[Callable[['ModelInfo'], None]] = []
+        
+    @property
+    def device_memory(self) -> int:
+        """Bytes held on the device: weights plus registered per-model state"""
+        return self.memory_usage + self.extra_memory
+                
 class ModelManager:
     """
     Manages multiple models and their lifecycle
@@ -26,23 +63,92 @@ class ModelManager:
     - Model loading/unloading
     - Memory management  
     - Model metadata tracking
-    - Hot-swapping support
+    - Hot-swapping support: models in use are pinned, idle ones are
+      evicted least-recently-used to CPU RAM or back to disk when a
+      device memory budget is exceeded, and reloaded on demand
+    - Memory-mapped safetensors loading with a local tokenizer/config cache
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        load_format: str = "auto",
+        num_load_workers: int = 8,
+        memory_budget: Optional[int] = None,
+        cpu_memory_budget: Optional[int] = None,
+        offload_to_cpu: bool = True
+    ):
+        """
+        Args:
+            cache_dir: Local artifact cache (default ~/.cache/nanovllm or NANOVLLM_CACHE_DIR)
+            load_format: "safetensors" (memory-mapped), "hf" (from_pretrained), or
+                "auto" to use safetensors when the checkpoint has them
+            num_load_workers: Threads loading safetensors shards in parallel
+            memory_budget: Device bytes all resident models may use (unlimited if None)
+            cpu_memory_budget: Host bytes for models offloaded to CPU (unlimited if None)
+            offload_to_cpu: Evict to CPU RAM for a fast reload instead of dropping
+                weights (models already on CPU are always dropped)
+        """
+        if load_format not in LOAD_FORMATS:
+            raise ValueError(f"load_format must be one of {LOAD_FORMATS}")
+            
         self.loaded_models: Dict[str, ModelInfo] = {}
         self.model_configs: Dict[str, dict] = {}
+        self.cache_dir = cache_dir
+        self.load_format = load_format
+        self.num_load_workers = num_load_workers
+        self.memory_budget = memory_budget
+        self.cpu_memory_budget = cpu_memory_budget
+        self.offload_to_cpu = offload_to_cpu
+        self.lock = threading.RLock()
+                        
+    def load_model(
+        self,
+        model_path: str,
+        load_weights: bool = False,
+        dtype: Optional[torch.dtype] = None,
+        timer: Optional[StartupTimer] = None,
+        quantization: Optional[str] = None,
+        quantization_group_size: int = 128,
+        device: Optional[torch.device] = None,
+        **kwargs
+    ) -> ModelInfo:
+        """
+        Load a model and return model info
         
-    def load_model(self, model_path: str, **kwargs) -> ModelInfo:
-        """Load a model and return model info"""
-        if model_path in self.loaded_models:
-            return self.loaded_models[model_path]
+        Args:
+            model_path: Path to model (local or HuggingFace)
+            load_weights: Also make the weights and tokenizer resident in
+                ModelInfo.model and ModelInfo.tokenizer, evicting idle
+                models if the memory budget requires it
+            dtype: Weight dtype when loading weights
+            timer: Records per-phase load times (a new one per model if None)
+            quantization: "int8" or "int4" weight-only quantization of Linear
+                layers; kept for reloads of the same model
+            quantization_group_size: Input features per int4 scale
+            device: Device for the weights (default cuda if available, else cpu)
+        """
+        with self.lock:
+            model_info = self.loaded_models.get(model_path)
+            if model_info is None:
+                model_info = self._register(model_path, timer)
+            if quantization is not None and model_info.model is None:
+                model_info.quantization = quantization
+                model_info.quantization_group_size = quantization_group_size
+            if load_weights:
+                self._make_resident(model_info, dtype, device=device, **kwargs)
+            return model_info
             
+    def _register(self, model_path: str, timer: Optional[StartupTimer]) -> ModelInfo:
+        """Read a model's config and add it to the registry without loading weights"""
         print(f"📥 Loading model: {model_path}")
+        timer = timer or StartupTimer()
         
         # Load config
+        config = None
         try:
-            config = AutoConfig.from_pretrained(model_path)
+            with timer.phase('config'):
+                config = ArtifactCache(model_path, self.cache_dir).load_config()
             config_dict = config.to_dict()
         except Exception as e:
             print(f"⚠️  Could not load config: {e}")
@@ -50,30 +156,309 @@ class ModelManager:
             
         # Create model info
         model_info = ModelInfo(model_path, config_dict)
-        
+        model_info.hf_config = config
+        model_info.startup_timer = timer
+                
         # Store in registry
         self.loaded_models[model_path] = model_info
+        return model_info
         
+    def register_model(
+        self,
+        model_path: str,
+        on_evict: Optional[Callable[[ModelInfo], None]] = None
+    ) -> ModelInfo:
+        """
+        Add a model to the registry; weights load on first acquire()
+        
+        Args:
+            model_path: Path to model (local or HuggingFace)
+            on_evict: Called (under the registry lock) when the model leaves
+                the device, so owners can drop device state such as a KV cache
+        """
+        model_info = self.load_model(model_path)
+        if on_evict is not None:
+            model_info.evict_callbacks.append(on_evict)
         return model_info
         
-    def unload_model(self, model_path: str) -> bool:
-        """Unload a model to free memory"""
-        if model_path not in self.loaded_models:
-            return False
+    def acquire(self, model_path: str, dtype: Optional[torch.dtype] = None, **kwargs) -> ModelInfo:
+        """
+        Make a model resident and pin it until release()
+        
+        Pinned models are never evicted, so requests running on them are
+        unaffected by loads of other models.
+        """
+        with self.lock:
+            model_info = self.load_model(model_path, load_weights=True, dtype=dtype, **kwargs)
+            model_info.num_users += 1
+            model_info.last_used = time.time()
+            return model_info
             
-        print(f"🗑️  Unloading model: {model_path}")
-        del self.loaded_models[model_path]
+    def release(self, model_path: str):
+        """Unpin a model acquired with acquire()"""
+        with self.lock:
+            model_info = self.loaded_models[model_path]
+            model_info.num_users = max(0, model_info.num_users - 1)
+            model_info.last_used = time.time()
+            
+    @contextmanager
+    def use(self, model_path: str, dtype: Optional[torch.dtype] = None):
+        """Pin a model for the duration of a with block"""
+        model_info = self.acquire(model_path, dtype)
+        try:
+            yield model_info
+        finally:
+            self.release(model_path)
+            
+    def set_extra_memory(self, model_path: str, num_bytes: int):
+        """Account device state owned by a model (e.g. its KV cache) against the budget"""
+        with self.lock:
+            model_info = self.loaded_models[model_path]
+            model_info.extra_memory = num_bytes
+            self._enforce_budget(keep=model_info)
+            
+    def _make_resident(self, model_info: ModelInfo, dtype: Optional[torch.dtype], **kwargs):
+        """Bring a model's weights to its device, loading or restoring them as needed"""
+        if model_info.location == LOCATION_DEVICE:
+            return
+            
+        # Make room first using the last known (or on-disk) footprint
+        self._evict_for(self._estimate_memory(model_info), keep=model_info)
+        
+        if model_info.location == LOCATION_CPU:
+            print(f"♻️  Restoring model from CPU: {model_info.model_path}")
+            start_time = time.time()
+            model_info.model.to(model_info.device)
+            model_info.load_time = time.time() - start_time
+        else:
+            self._load_weights(model_info, dtype or model_info.dtype, **kwargs)
+            model_info.device = next(model_info.model.parameters()).device
+            
+        model_info.location = LOCATION_DEVICE
+        model_info.num_loads += 1
+        model_info.last_used = time.time()
+        self._enforce_budget(keep=model_info)
+        
+    def _estimate_memory(self, model_info: ModelInfo) -> int:
+        """Device bytes a model will need: its last footprint, else its checkpoint size"""
+        if model_info.memory_usage:
+            return model_info.device_memory
+        try:
+            weights_dir = ArtifactCache(model_info.model_path, self.cache_dir).resolve_weights_dir()
+            return sum(os.path.getsize(path) for path in find_safetensors(weights_dir))
+        except Exception:
+            return 0
+            
+    def _device_memory(self) -> int:
+        return sum(info.device_memory for info in self.loaded_models.values() if info.location == LOCATION_DEVICE)
+        
+    def _cpu_memory(self) -> int:
+        return sum(info.memory_usage for info in self.loaded_models.values() if info.location == LOCATION_CPU)
         
-        # Force garbage collection
+    def _enforce_budget(self, keep: ModelInfo):
+        """Evict idle models until resident ones fit the budgets again"""
+        self._evict_for(0, keep)
+        
+    def _evict_for(self, num_bytes: int, keep: ModelInfo):
+        """
+        Evict least-recently-used idle models until num_bytes more fit on the device
+        
+        Raises:
+            RuntimeError: If models in use leave no room
+        """
+        if self.memory_budget is not None:
+            while self._device_memory() + num_bytes > self.memory_budget:
+                victims = [
+                    info for info in self.loaded_models.values()
+                    if info.location == LOCATION_DEVICE and info.num_users == 0 and info is not keep
+                ]
+                if not victims:
+                    raise RuntimeError(
+                        f"Cannot fit {keep.model_path}: {self._device_memory() / 1024**3:.2f} GB of the "
+                        f"{self.memory_budget / 1024**3:.2f} GB budget is held by models in use"
+                    )
+                victim = min(victims, key=lambda info: info.last_used)
+                if self.offload_to_cpu and victim.device.type != 'cpu':
+                    self._offload(victim)
+                else:
+                    self._drop_weights(victim)
+                    
+        if self.cpu_memory_budget is not None:
+            while self._cpu_memory() > self.cpu_memory_budget:
+                victims = [info for info in self.loaded_models.values() if info.location == LOCATION_CPU]
+                self._drop_weights(min(victims, key=lambda info: info.last_used))
+                
+    def _notify_evicted(self, model_info: ModelInfo):
+        for callback in model_info.evict_callbacks:
+            callback(model_info)
+        model_info.extra_memory = 0
+        model_info.num_evictions += 1
+        
+    def _offload(self, model_info: ModelInfo):
+        """Move an idle model's weights to CPU RAM"""
+        print(f"📤 Offloading model to CPU: {model_info.model_path}")
+        self._notify_evicted(model_info)
+        model_info.model.to('cpu')
+        model_info.location = LOCATION_CPU
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            
+    def _drop_weights(self, model_info: ModelInfo):
+        """Free a model's weights, keeping its registry entry for a later reload"""
+        print(f"🗑️  Dropping model weights: {model_info.model_path}")
+        if model_info.location == LOCATION_DEVICE:
+            self._notify_evicted(model_info)
+        model_info.model = None
+        model_info.location = LOCATION_DISK
+        gc.collect()
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
+                
+    def _load_weights(
+        self,
+        model_info: ModelInfo,
+        dtype: Optional[torch.dtype],
+        device: Optional[torch.device] = None,
+        **kwargs
+    ):
+        """
+        Load tokenizer and weights for inference and record their footprint
+        
+        safetensors checkpoints are memory-mapped and bound to the module
+        tree directly; other checkpoints (or load_format="hf") go through
+        from_pretrained. The tokenizer, config and weight location are then
+        cached locally for the next start.
+        """
+        start_time = time.time()
+        timer = model_info.startup_timer
+        cache = ArtifactCache(model_info.model_path, self.cache_dir)
+        dtype = dtype or (torch.float16 if torch.cuda.is_available() else torch.float32)
+        device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        mode, group_size = model_info.quantization, model_info.quantization_group_size
+        
+        with timer.phase('tokenizer'):
+            tokenizer = cache.load_tokenizer()
+            
+        quantized_path = None
+        if mode is not None:
+            quantized_path = cache.quantized_path(mode, group_size, dtype)
+            
+        if quantized_path is not None and os.path.exists(quantized_path) and model_info.hf_config is not None:
+            # Bind the cached quantized checkpoint; full-precision weights are never read
+            with timer.phase('weights'):
+                model = load_safetensors_model(
+                    model_info.hf_config, [quantized_path], dtype, device, self.num_load_workers,
+                    prepare=lambda empty: prepare_quantized_model(empty, mode, group_size)
+                )
+            weights_dir = cache.manifest.get('weights_dir')
+        else:
+            # Quantize on CPU so the full-precision model never occupies the device
+            load_device = torch.device('cpu') if mode is not None else device
+            model, weights_dir = self._load_full_precision(model_info, cache, dtype, load_device, **kwargs)
+            if mode is not None:
+                with timer.phase('quantize'):
+                    quantize_model(model, mode, group_size)
+                    save_quantized(model, quantized_path, mode, group_size)
+                    model.to(device)
+                    
+        if mode is not None:
+            model_info.quantization_stats = get_quantization_stats(model)
             
-        return True
+        if model_info.hf_config is not None:
+            cache.save(model_info.hf_config, tokenizer, weights_dir)
+                        
+        model_info.model = model
+        model_info.tokenizer = tokenizer
+        model_info.dtype = dtype
+        model_info.load_time = time.time() - start_time
+        model_info.memory_usage = sum(
+            t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers())
+        )
+        
+    def _load_full_precision(
+        self,
+        model_info: ModelInfo,
+        cache: ArtifactCache,
+        dtype: torch.dtype,
+        device: torch.device,
+        **kwargs
+    ):
+        """
+        Load the original checkpoint
         
+        Returns:
+            (model, local weights directory or None)
+        """
+        timer = model_info.startup_timer
+        weights_dir, shard_files = None, []
+        if self.load_format != "hf":
+            with timer.phase('resolve'):
+                weights_dir = cache.resolve_weights_dir()
+                shard_files = find_safetensors(weights_dir)
+            if not shard_files and self.load_format == "safetensors":
+                raise ValueError(f"No safetensors shards found in {weights_dir}")
+                
+        with timer.phase('weights'):
+            if shard_files and model_info.hf_config is not None and 'device_map' not in kwargs:
+                model = load_safetensors_model(
+                    model_info.hf_config, shard_files, dtype, device, self.num_load_workers
+                )
+            else:
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_info.model_path,
+                    torch_dtype=dtype,
+                    device_map=kwargs.pop('device_map', "auto" if device.type == 'cuda' else None),
+                    trust_remote_code=True,
+                    **kwargs
+                )
+                model.eval()
+        return model, weights_dir
+                
+    def unload_model(self, model_path: str) -> bool:
+        """Unload a model to free memory (refused while it is in use)"""
+        with self.lock:
+            model_info = self.loaded_models.get(model_path)
+            if model_info is None or model_info.num_users > 0:
+                return False
+                
+            print(f"🗑️  Unloading model: {model_path}")
+            if model_info.location == LOCATION_DEVICE:
+                self._notify_evicted(model_info)
+            del self.loaded_models[model_path]
+            model_info.model = None
+            
+            # Force garbage collection
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                
+            return True
+            
     def list_models(self) -> List[ModelInfo]:
         """List all loaded models"""
         return list(self.loaded_models.values())
         
+    def get_residency_stats(self) -> Dict[str, Any]:
+        """Per-model location, footprint and swap counts against the budgets"""
+        with self.lock:
+            return {
+                'memory_budget': self.memory_budget,
+                'device_memory': self._device_memory(),
+                'cpu_memory': self._cpu_memory(),
+                'models': {
+                    path: {
+                        'location': info.location,
+                        'weights_bytes': info.memory_usage,
+                        'extra_bytes': info.extra_memory,
+                        'num_users': info.num_users,
+                        'num_loads': info.num_loads,
+                        'num_evictions': info.num_evictions,
+                        'last_used': info.last_used
+                    }
+                    for path, info in self.loaded_models.items()
+                }
+            }
+        
     def get_model_info(self, model_path: str) -> Optional[ModelInfo]:
         """Get information about a specific model"""
         return self.loaded_models.get(model_path)
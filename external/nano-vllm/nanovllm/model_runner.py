@@ -0,0 +1,299 @@
+"""
+Model execution for nano-vLLM
+Runs batched prefill and decode steps against the paged KV cache
+"""
+
+import torch
+from typing import List, Optional, Tuple
+
+from .sequence import Sequence
+from .sampler import Sampler, SamplingTensors
+from .cache_manager import KVCacheManager, to_legacy_cache, from_legacy_cache
+
+class ForwardInputs:
+    """
+    Tensors for one forward pass against the paged KV cache
+    
+    Block tables are already resolved to slot indices, so the pass can be
+    replayed on another rank's KV shard without any scheduler state.
+    """
+    
+    def __init__(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        position_ids: torch.Tensor,
+        token_mask: torch.Tensor,
+        write_slots: torch.Tensor,
+        gather_slots: Optional[torch.Tensor] = None
+    ):
+        """
+        Args:
+            input_ids: New tokens of shape [batch, max new], left-padded
+            attention_mask: Mask over cached then new positions
+            position_ids: Positions of the new tokens
+            token_mask: Flattened [batch * max new] mask of real (non-padding) new tokens
+            write_slots: KV slots of the real new tokens, in token_mask order
+            gather_slots: Cached KV slots of shape [batch, max cached], or None
+        """
+        self.input_ids = input_ids
+        self.attention_mask = attention_mask
+        self.position_ids = position_ids
+        self.token_mask = token_mask
+        self.write_slots = write_slots
+        self.gather_slots = gather_slots
+        
+    def to(self, device: torch.device) -> 'ForwardInputs':
+        """Copy of the inputs on another device"""
+        return ForwardInputs(
+            self.input_ids.to(device),
+            self.attention_mask.to(device),
+            self.position_ids.to(device),
+            self.token_mask.to(device),
+            self.write_slots.to(device),
+            None if self.gather_slots is None else self.gather_slots.to(device)
+        )
+        
+def stack_cache(past_key_values, positions=slice(None)) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Stack selected positions of a model cache into (keys, values) across layers
+    
+    Args:
+        past_key_values: Cache returned by the model
+        positions: Slice of sequence positions, or a single index
+        
+    Returns:
+        Tensors of shape [layers, batch, heads, len, dim], or
+        [layers, batch, heads, dim] for a single index
+    """
+    legacy = to_legacy_cache(past_key_values)
+    keys = torch.stack([key[:, :, positions] for key, _ in legacy])
+    values = torch.stack([value[:, :, positions] for _, value in legacy])
+    return keys, values
+    
+@torch.no_grad()
+def execute_forward(model: torch.nn.Module, kv_cache: KVCacheManager, inputs: ForwardInputs) -> torch.Tensor:
+    """
+    Run new tokens against their cached prefixes and store their KV
+    
+    The cached prefixes are copied out of the block pool into dense
+    past_key_values every call, because HF attention cannot read block
+    tables. Decode cost therefore grows with context length, not just
+    with the one new token per sequence.
+    
+    Returns:
+        Logits of shape [batch, max new tokens, vocab]
+    """
+    past_key_values = None
+    max_cached = 0
+    if inputs.gather_slots is not None:
+        max_cached = inputs.gather_slots.size(1)
+        keys, values = kv_cache.gather_slots(inputs.gather_slots)
+        past_key_values = from_legacy_cache(
+            tuple((keys[layer], values[layer]) for layer in range(keys.size(0)))
+        )
+        
+    outputs = model(
+        input_ids=inputs.input_ids,
+        attention_mask=inputs.attention_mask,
+        position_ids=inputs.position_ids,
+        past_key_values=past_key_values,
+        use_cache=True
+    )
+    
+    # [layers, batch, heads, len, dim] -> [layers, new tokens, heads, dim]
+    keys, values = stack_cache(outputs.past_key_values, slice(max_cached, None))
+    keys = keys.transpose(2, 3).flatten(1, 2)[:, inputs.token_mask]
+    values = values.transpose(2, 3).flatten(1, 2)[:, inputs.token_mask]
+    kv_cache.write(inputs.write_slots, keys, values)
+    
+    return outputs.logits
+    
+class ModelRunner:
+    """
+    Executes forward passes for scheduled sequences
+    
+    Features:
+    - Left-padded batched prefill written into KV cache blocks, whole or
+      one chunk at a time
+    - Batched single-token decode gathered from KV cache blocks, or replayed
+      from compiled bucket graphs when a CompiledDecoder is attached
+    - Batched per-request sampling through Sampler
+    - Tensor-parallel execution: every pass is replayed by the worker ranks
+    """
+    
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        kv_cache: KVCacheManager,
+        pad_token_id: int,
+        eos_token_id: Optional[int] = None,
+        workers=None,
+        compiled_decoder=None
+    ):
+        """
+        Args:
+            workers: TensorParallelWorkers holding the other shards of model
+                (None for single-process execution)
+            compiled_decoder: CompiledDecoder that runs decode steps fitting
+                its buckets (None to always decode eagerly)
+        """
+        self.model = model
+        self.kv_cache = kv_cache
+        self.pad_token_id = pad_token_id
+        self.device = next(model.parameters()).device
+        self.sampler = Sampler(eos_token_id)
+        self.workers = workers
+        self.compiled_decoder = compiled_decoder
+        if workers is not None:
+            # Copy-on-write copies must be replayed on every rank's KV shard
+            kv_cache.block_copies = []
+                    
+    @torch.no_grad()
+    def prefill(self, seqs: List[Sequence], chunk_lens: Optional[List[int]] = None) -> torch.Tensor:
+        """
+        Compute and store the KV cache for the uncached tokens of each sequence
+        
+        Tokens before seq.num_computed_tokens (e.g. a prefix cache hit or an
+        earlier chunk) are read from the block pool instead of being
+        recomputed. Each row is laid out as [padding | cached prefix |
+        padding | new tokens]. Block tables must already be allocated for
+        all tokens.
+        
+        Args:
+            chunk_lens: Tokens to prefill per sequence (default: all uncached)
+            
+        Returns:
+            Logits after each row's last prefilled token, of shape
+            [len(seqs), vocab]; only rows that reached the end of the
+            sequence predict its next token
+        """
+        cached_lens = [seq.num_computed_tokens for seq in seqs]
+        if chunk_lens is None:
+            chunk_lens = [seq.num_tokens - cached for seq, cached in zip(seqs, cached_lens)]
+        new_token_lists = [
+            seq.token_ids[cached:cached + chunk]
+            for seq, cached, chunk in zip(seqs, cached_lens, chunk_lens)
+        ]
+        logits = self._forward(seqs, cached_lens, new_token_lists)
+        
+        for seq, chunk in zip(seqs, chunk_lens):
+            seq.num_computed_tokens += chunk
+            
+        return logits[:, -1, :]
+        
+    @torch.no_grad()
+    def verify(self, seqs: List[Sequence], draft_token_ids: List[List[int]]) -> List[torch.Tensor]:
+        """
+        Score each sequence's last token followed by its draft tokens in one pass
+        
+        KV is written for every scored position; slots for them must already
+        be reserved. seq.num_computed_tokens is left unchanged so the caller
+        can keep only the accepted positions.
+        
+        Returns:
+            Per sequence, logits of shape [1 + len(drafts), vocab] where row i
+            predicts the token after scored position i
+        """
+        cached_lens = [seq.num_computed_tokens for seq in seqs]
+        new_token_lists = [[seq.token_ids[-1]] + list(drafts) for seq, drafts in zip(seqs, draft_token_ids)]
+        logits = self._forward(seqs, cached_lens, new_token_lists)
+        
+        width = logits.size(1)
+        return [logits[row, width - len(ids):] for row, ids in enumerate(new_token_lists)]
+        
+    def _forward(
+        self,
+        seqs: List[Sequence],
+        cached_lens: List[int],
+        new_token_lists: List[List[int]]
+    ) -> torch.Tensor:
+        """
+        Run new tokens against each sequence's cached prefix and store their KV
+        
+        Returns:
+            Logits of shape [len(seqs), max new tokens, vocab]; rows are left-padded
+        """
+        inputs = self._prepare_inputs(seqs, cached_lens, new_token_lists)
+        if self.workers is not None:
+            self.workers.execute(inputs, self.kv_cache.block_copies)
+            self.kv_cache.block_copies.clear()
+        return execute_forward(self.model, self.kv_cache, inputs)
+        
+    def _prepare_inputs(
+        self,
+        seqs: List[Sequence],
+        cached_lens: List[int],
+        new_token_lists: List[List[int]]
+    ) -> ForwardInputs:
+        """Lay out a left-padded batch and resolve its KV slots"""
+        seq_ids = [seq.seq_id for seq in seqs]
+        max_cached = max(cached_lens)
+        max_new = max(len(ids) for ids in new_token_lists)
+        
+        input_ids = torch.full(
+            (len(seqs), max_new), self.pad_token_id,
+            dtype=torch.long, device=self.device
+        )
+        new_mask = torch.zeros((len(seqs), max_new), dtype=torch.long, device=self.device)
+        cached_mask = torch.zeros((len(seqs), max_cached), dtype=torch.long, device=self.device)
+        
+        slots = []
+        for row, (seq_id, cached, ids) in enumerate(zip(seq_ids, cached_lens, new_token_lists)):
+            input_ids[row, max_new - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            new_mask[row, max_new - len(ids):] = 1
+            cached_mask[row, max_cached - cached:] = 1
+            slots.extend(self.kv_cache.get_slots(seq_id, cached, cached + len(ids)))
+            
+        cached_lens_tensor = torch.tensor(cached_lens, dtype=torch.long, device=self.device)
+        position_ids = cached_lens_tensor.unsqueeze(-1) + (new_mask.cumsum(dim=-1) - 1).clamp(min=0)
+        
+        gather_slots = None
+        if max_cached > 0:
+            gather_slots = self.kv_cache.get_gather_slots(seq_ids, cached_lens, max_cached)
+            
+        return ForwardInputs(
+            input_ids=input_ids,
+            attention_mask=torch.cat([cached_mask, new_mask], dim=1),
+            position_ids=position_ids,
+            token_mask=new_mask.view(-1).bool(),
+            write_slots=torch.tensor(slots, dtype=torch.long, device=self.device),
+            gather_slots=gather_slots
+        )
+        
+    @torch.no_grad()
+    def decode(self, seqs: List[Sequence]) -> torch.Tensor:
+        """
+        Run one decode step for sequences whose last token is not yet cached
+        
+        Cached tokens are gathered from the block pool into a right-aligned
+        padded batch; padding positions are masked out. The slot for the new
+        token must already be reserved with KVCacheManager.append_slot.
+        
+        Returns:
+            Next-token logits of shape [len(seqs), vocab]
+        """
+        kv_lens = [seq.num_computed_tokens for seq in seqs]
+        decoder = self.compiled_decoder
+        if decoder is not None and decoder.can_run(len(seqs), max(kv_lens)):
+            logits = decoder.decode(seqs, kv_lens)
+        else:
+            if decoder is not None:
+                decoder.num_eager_steps += 1
+            logits = self._forward(seqs, kv_lens, [[seq.token_ids[-1]] for seq in seqs])[:, -1, :]
+            
+        for seq in seqs:
+            seq.num_computed_tokens += 1
+            
+        return logits
+                
+    def sample_sequences(self, logits: torch.Tensor, seqs: List[Sequence]) -> Tuple[List[int], List[bool]]:
+        """
+        Sample the next token for each sequence in one batched call
+        
+        Returns:
+            (token ID per sequence, whether it completed a stop sequence)
+        """
+        tensors = SamplingTensors.from_sequences(seqs, logits.device)
+        token_ids, stopped = self.sampler(logits, tensors)
+        return token_ids.tolist(), stopped.tolist()
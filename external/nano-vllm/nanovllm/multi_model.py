@@ -0,0 +1,174 @@
+"""
+Multi-model serving for nano-vLLM
+Routes requests by model name across models sharing one memory budget
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from .llm import LLM
+from .sampling_params import SamplingParams
+from .model_manager import ModelManager, ModelInfo
+from .cache_manager import KVCacheManager
+
+class MultiModelLLM:
+    """
+    Several models in one process under a shared device memory budget
+    
+    Features:
+    - Models load on first request and stay resident while the budget allows
+    - Idle models are evicted least-recently-used to CPU RAM (or dropped)
+      together with their KV cache, and reloaded on their next request
+    - Each request pins its model, so swaps never touch a model that has
+      requests in flight
+    - generate / generate_stream routed by model name
+    """
+    
+    def __init__(
+        self,
+        models: Dict[str, str],
+        memory_budget: Optional[int] = None,
+        cpu_memory_budget: Optional[int] = None,
+        offload_to_cpu: bool = True,
+        cache_dir: Optional[str] = None,
+        load_format: str = "auto",
+        **llm_kwargs
+    ):
+        """
+        Args:
+            models: Model name -> model path (local or HuggingFace)
+            memory_budget: Device bytes for weights plus KV caches of resident models
+            cpu_memory_budget: Host bytes for models offloaded to CPU
+            offload_to_cpu: Evict to CPU RAM instead of dropping weights
+            cache_dir: Local tokenizer/config cache
+            load_format: "auto", "safetensors" or "hf"
+            llm_kwargs: Passed to every LLM (set max_num_kv_tokens to bound
+                each model's KV cache)
+        """
+        self.models = dict(models)
+        self.llm_kwargs = llm_kwargs
+        self.model_manager = ModelManager(
+            cache_dir=cache_dir,
+            load_format=load_format,
+            memory_budget=memory_budget,
+            cpu_memory_budget=cpu_memory_budget,
+            offload_to_cpu=offload_to_cpu
+        )
+        
+        self.llms: Dict[str, LLM] = {}
+        self.lock = threading.RLock()
+        # One engine loop per model at a time
+        self.model_locks = {name: threading.Lock() for name in self.models}
+        
+        for name, model_path in self.models.items():
+            self.model_manager.register_model(
+                model_path, on_evict=lambda model_info, name=name: self._on_evict(name)
+            )
+            
+    def _on_evict(self, name: str):
+        """Drop a model's engine and KV cache when its weights leave the device"""
+        llm = self.llms.pop(name, None)
+        if llm is not None:
+            llm.close()
+            
+    def _kv_cache_bytes(self, model_info: ModelInfo) -> int:
+        """Upper bound on the KV cache an LLM for this model will allocate"""
+        config = model_info.hf_config
+        if config is None or model_info.model is None:
+            return 0
+            
+        block_size = self.llm_kwargs.get('block_size', 16)
+        max_model_len = self.llm_kwargs.get('max_model_len') or getattr(config, 'max_position_embeddings', 2048)
+        max_num_tokens = self.llm_kwargs.get('max_num_kv_tokens') or (
+            self.llm_kwargs.get('max_num_seqs', 32) * max_model_len
+        )
+        dtype = next(model_info.model.parameters()).dtype
+        num_blocks = -(-max_num_tokens // block_size)
+        return KVCacheManager.get_block_bytes(config, block_size, dtype) * num_blocks
+        
+    def _acquire(self, name: str) -> LLM:
+        """Pin a model and return its LLM, building the engine if needed"""
+        model_path = self.models[name]
+        with self.lock:
+            model_info = self.model_manager.acquire(
+                model_path,
+                dtype=self.llm_kwargs.get('dtype'),
+                quantization=self.llm_kwargs.get('quantization'),
+                quantization_group_size=self.llm_kwargs.get('quantization_group_size', 128)
+            )
+            try:
+                llm = self.llms.get(name)
+                if llm is None:
+                    # Reserve the KV cache in the budget before allocating it
+                    self.model_manager.set_extra_memory(model_path, self._kv_cache_bytes(model_info))
+                    llm = LLM(model_path, model_manager=self.model_manager, **self.llm_kwargs)
+                    kv_pool = llm.kv_cache.kv_pool
+                    self.model_manager.set_extra_memory(model_path, kv_pool.numel() * kv_pool.element_size())
+                    self.llms[name] = llm
+            except Exception:
+                if name not in self.llms:
+                    model_info.extra_memory = 0
+                self.model_manager.release(model_path)
+                raise
+            return llm
+            
+    @contextmanager
+    def use(self, name: str):
+        """
+        Pin a model for a with block and yield its LLM
+        
+        The block has exclusive use of the model's engine.
+        """
+        if name not in self.models:
+            raise KeyError(f"Unknown model: {name}")
+            
+        with self.model_locks[name]:
+            llm = self._acquire(name)
+            try:
+                yield llm
+            finally:
+                self.model_manager.release(self.models[name])
+                
+    def generate(
+        self,
+        prompts: List[str],
+        sampling_params: SamplingParams,
+        model: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate responses with the named model
+        
+        Args:
+            prompts: List of input prompts
+            sampling_params: Sampling configuration
+            model: Name of a registered model
+            
+        Returns:
+            List of generation results
+        """
+        with self.use(model) as llm:
+            return llm.generate(prompts, sampling_params)
+            
+    def generate_stream(self, prompt: str, sampling_params: SamplingParams, model: str):
+        """
+        Stream a response from the named model
+        
+        The model stays pinned until the generator is exhausted or closed.
+        """
+        with self.use(model) as llm:
+            yield from llm.generate_stream(prompt, sampling_params)
+            
+    def list_models(self) -> List[str]:
+        """Registered model names"""
+        return list(self.models)
+        
+    def get_stats(self) -> Dict[str, Any]:
+        """Residency and swap statistics keyed by model name"""
+        stats = self.model_manager.get_residency_stats()
+        paths = {path: name for name, path in self.models.items()}
+        stats['models'] = {
+            paths.get(path, path): {**model_stats, 'engine_ready': paths.get(path) in self.llms}
+            for path, model_stats in stats['models'].items()
+        }
+        return stats
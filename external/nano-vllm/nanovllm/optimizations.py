@@ -5,56 +5,246 @@ Includes prefix caching, tensor parallelism, and performance enhancements
 
 import torch
 import torch.distributed as dist
-from typing import Dict, List, Optional, Tuple
-import hashlib
+from typing import Dict, List, Optional, Set, Tuple
+import heapq
 import time
 
+from .cache_manager import KVCacheManager
+from .kv_offload import PersistentPrefixStore, block_digest
+
+class RadixNode:
+    """Prefix cache trie node owning one full KV cache block"""
+    
+    __slots__ = ('key', 'block_id', 'parent', 'children', 'last_access', 'digest')
+    
+    def __init__(
+        self,
+        key: Tuple[int, ...],
+        block_id: int,
+        parent: Optional['RadixNode'],
+        digest: bytes = b''
+    ):
+        self.key = key
+        self.block_id = block_id
+        self.parent = parent
+        self.children: Dict[Tuple[int, ...], 'RadixNode'] = {}
+        self.last_access = 0
+        # Hash of the whole prefix up to this block, kept when persisting to disk
+        self.digest = digest
+                
 class PrefixCache:
     """
     Prefix caching optimization
-    Reuses computation for repeated prompt prefixes
+    Radix tree over token IDs whose nodes hold KV cache blocks, so requests
+    sharing a prompt prefix skip prefill for the cached part
+    
+    Each edge is one full block of block_size token IDs. The cache keeps a
+    reference on every block it holds; leaves whose block is not used by
+    any running sequence are evicted least-recently-used first.
+    
+    With a PersistentPrefixStore, evicted blocks are written to disk and
+    read back when a later prompt (or a later process) extends past the
+    in-memory tree; persist() writes out every cached block.
     """
     
-    def __init__(self, max_prefixes: int = 100):
-        self.max_prefixes = max_prefixes
-        self.prefix_cache: Dict[str, torch.Tensor] = {}
-        self.prefix_usage: Dict[str, int] = {}
+    def __init__(
+        self,
+        kv_cache: KVCacheManager,
+        max_blocks: Optional[int] = None,
+        store: Optional[PersistentPrefixStore] = None
+    ):
+        self.kv_cache = kv_cache
+        self.store = store
+        self.block_size = kv_cache.block_size
+        self.max_blocks = max_blocks or kv_cache.num_blocks
+        self.root = RadixNode((), -1, None)
+        self.num_cached_blocks = 0
+        self.access_clock = 0
+        
         self.hit_count = 0
         self.total_requests = 0
+        self.tokens_queried = 0
+        self.tokens_saved = 0
+        self.evicted_blocks = 0
+        self.disk_loaded_blocks = 0
+                
+    def _block_key(self, token_ids: List[int], index: int) -> Tuple[int, ...]:
+        """Token IDs covered by the index-th block"""
+        return tuple(token_ids[index * self.block_size:(index + 1) * self.block_size])
         
-    def get_cache_key(self, prompt: str) -> str:
-        """Generate cache key for prompt prefix"""
-        # Use first 100 characters as prefix
-        prefix = prompt[:100]
-        return hashlib.md5(prefix.encode()).hexdigest()
+    def match(self, token_ids: List[int]) -> Tuple[List[int], int]:
+        """
+        Find the longest cached prefix of token_ids
         
-    def get_cached_tokens(self, cache_key: str) -> Optional[torch.Tensor]:
-        """Get cached tokens for prefix"""
-        self.total_requests += 1
+        At least one token is always left uncached so the model still
+        produces logits for the next token.
         
-        if cache_key in self.prefix_cache:
+        Returns:
+            (block IDs of the cached prefix, number of cached tokens)
+        """
+        self.access_clock += 1
+        max_blocks = (len(token_ids) - 1) // self.block_size
+        node = self.root
+        block_ids = []
+        
+        for index in range(max_blocks):
+            child = node.children.get(self._block_key(token_ids, index))
+            if child is None:
+                break
+            child.last_access = self.access_clock
+            block_ids.append(child.block_id)
+            node = child
+            
+        if self.store is not None:
+            block_ids.extend(self._load_from_store(token_ids, node, len(block_ids), max_blocks))
+            
+        return block_ids, len(block_ids) * self.block_size
+        
+    def _load_from_store(self, token_ids: List[int], node: RadixNode, start: int, max_blocks: int) -> List[int]:
+        """Extend the tree below node with consecutive blocks found on disk"""
+        block_ids = []
+        for index in range(start, max_blocks):
+            key = self._block_key(token_ids, index)
+            digest = block_digest(node.digest, key)
+            if digest not in self.store or self.kv_cache.get_num_free_blocks() == 0:
+                break
+                
+            block_id = self.kv_cache.allocate_block()
+            self.store.load(digest, self.kv_cache, block_id)
+            child = RadixNode(key, block_id, node, digest)
+            child.last_access = self.access_clock
+            node.children[key] = child
+            self.num_cached_blocks += 1
+            self.disk_loaded_blocks += 1
+            block_ids.append(block_id)
+            node = child
+            
+        return block_ids
+        
+    def record_lookup(self, num_tokens: int, num_cached_tokens: int):
+        """Record the outcome of a lookup that was used for admission"""
+        self.total_requests += 1
+        self.tokens_queried += num_tokens
+        self.tokens_saved += num_cached_tokens
+        if num_cached_tokens > 0:
             self.hit_count += 1
-            self.prefix_usage[cache_key] += 1
-            return self.prefix_cache[cache_key]
             
-        return None
+    def insert(self, token_ids: List[int], block_table: List[int]) -> int:
+        """
+        Cache the full blocks of a computed token sequence
         
-    def store_tokens(self, cache_key: str, tokens: torch.Tensor):
-        """Store generated tokens for prefix"""
-        if len(self.prefix_cache) >= self.max_prefixes:
-            self._evict_oldest()
+        Args:
+            token_ids: Tokens whose KV is stored in block_table
+            block_table: KV cache blocks of the sequence
             
-        self.prefix_cache[cache_key] = tokens.clone()
-        self.prefix_usage[cache_key] = 1
+        Returns:
+            Number of newly cached blocks
+        """
+        self.access_clock += 1
+        num_blocks = min(len(token_ids) // self.block_size, len(block_table))
+        node = self.root
+        added = 0
         
-    def _evict_oldest(self):
-        """Evict least used prefix"""
-        if not self.prefix_cache:
-            return
+        for index in range(num_blocks):
+            key = self._block_key(token_ids, index)
+            child = node.children.get(key)
+            if child is None:
+                digest = block_digest(node.digest, key) if self.store is not None else b''
+                child = RadixNode(key, block_table[index], node, digest)
+                node.children[key] = child
+                self.kv_cache.acquire_block(child.block_id)
+                self.num_cached_blocks += 1
+                added += 1
+            child.last_access = self.access_clock
+            node = child
+            
+        if self.num_cached_blocks > self.max_blocks:
+            self.evict(self.num_cached_blocks - self.max_blocks)
+            
+        return added
+        
+    def _is_evictable(self, node: RadixNode, protected: Set[int]) -> bool:
+        """A leaf whose block only the cache still references"""
+        return (
+            not node.children
+            and node.block_id not in protected
+            and self.kv_cache.ref_counts[node.block_id] == 1
+        )
+        
+    def evict(self, num_blocks: int, protected: Optional[Set[int]] = None) -> int:
+        """
+        Free up to num_blocks blocks by evicting least recently used leaves
+        
+        Args:
+            num_blocks: Number of blocks to return to the pool
+            protected: Block IDs that must not be evicted
             
-        least_used = min(self.prefix_usage.items(), key=lambda x: x[1])[0]
-        del self.prefix_cache[least_used]
-        del self.prefix_usage[least_used]
+        Returns:
+            Number of blocks freed
+        """
+        protected = protected or set()
+        heap = []
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            if self._is_evictable(node, protected):
+                heap.append((node.last_access, id(node), node))
+            stack.extend(node.children.values())
+        heapq.heapify(heap)
+        
+        evicted = []
+        while heap and len(evicted) < num_blocks:
+            _, _, node = heapq.heappop(heap)
+            parent = node.parent
+            del parent.children[node.key]
+            evicted.append(node)
+            
+            if parent is not self.root and self._is_evictable(parent, protected):
+                heapq.heappush(heap, (parent.last_access, id(parent), parent))
+                
+        if self.store is not None and evicted:
+            # Spill to disk before the blocks can be reused
+            self.store.save([node.digest for node in evicted], self.kv_cache, [node.block_id for node in evicted])
+            
+        for node in evicted:
+            self.kv_cache.release_block(node.block_id)
+        self.num_cached_blocks -= len(evicted)
+        self.evicted_blocks += len(evicted)
+        return len(evicted)
+        
+    def persist(self) -> int:
+        """
+        Write every cached block to the persistent store and flush its index
+        
+        Returns:
+            Number of blocks written (0 without a store)
+        """
+        if self.store is None:
+            return 0
+            
+        nodes = []
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children.values())
+            
+        # Least recently used first, so the store keeps the hottest prefixes if it is full
+        nodes.sort(key=lambda node: node.last_access)
+        written = self.store.save([node.digest for node in nodes], self.kv_cache, [node.block_id for node in nodes])
+        self.store.flush()
+        return written
+        
+    def clear(self):
+        """Drop every cached prefix"""
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            self.kv_cache.release_block(node.block_id)
+            stack.extend(node.children.values())
+            
+        self.root = RadixNode((), -1, None)
+        self.num_cached_blocks = 0
         
     def get_hit_rate(self) -> float:
         """Get cache hit rate"""
@@ -64,26 +254,56 @@ class PrefixCache:
         """Get cache efficiency metrics"""
         return {
             'hit_rate': self.get_hit_rate(),
-            'total_prefixes': len(self.prefix_cache),
-            'max_prefixes': self.max_prefixes,
+            'token_hit_rate': self.tokens_saved / max(self.tokens_queried, 1),
+            'tokens_saved': self.tokens_saved,
+            'tokens_queried': self.tokens_queried,
+            'cached_blocks': self.num_cached_blocks,
+            'max_blocks': self.max_blocks,
+            'evicted_blocks': self.evicted_blocks,
+            'disk_loaded_blocks': self.disk_loaded_blocks,
             'total_hits': self.hit_count,
             'total_requests': self.total_requests
         }
 
 class TensorParallel:
     """
-    Tensor parallelism for multi-GPU inference
-    Distributes model computation across multiple GPUs
+    Tensor parallelism for multi-device inference
+    Distributes model computation across processes, one rank per device
+    
+    NCCL is used when every rank has its own GPU; otherwise ranks run on
+    CPU over gloo, which is how multi-process runs are verified without GPUs.
+    Control messages always travel over a gloo group.
     """
     
-    def __init__(self, world_size: int):
+    def __init__(
+        self,
+        world_size: int,
+        rank: int = 0,
+        backend: Optional[str] = None,
+        init_method: Optional[str] = None
+    ):
         self.world_size = world_size
-        self.rank = 0
+        self.rank = rank
+        self.backend = backend or self.default_backend(world_size)
+        self.init_method = init_method
         self.device = None
+        self.control_group = None
         self.initialized = False
         
+    @staticmethod
+    def default_backend(world_size: int) -> str:
+        """nccl if there is a GPU per rank, else gloo"""
+        if torch.cuda.is_available() and torch.cuda.device_count() >= world_size:
+            return 'nccl'
+        return 'gloo'
+        
     def initialize(self):
-        """Initialize tensor parallelism"""
+        """
+        Join the process group
+        
+        Raises:
+            RuntimeError: If the process group cannot be initialized
+        """
         if self.world_size <= 1:
             print("⚠️  Tensor parallelism disabled (single GPU)")
             return
@@ -91,18 +311,42 @@ class TensorParallel:
         try:
             # Initialize process group
             if not dist.is_initialized():
-                dist.init_process_group(backend='nccl')
+                dist.init_process_group(
+                    backend=self.backend,
+                    init_method=self.init_method,
+                    rank=self.rank,
+                    world_size=self.world_size
+                )
                 
             self.rank = dist.get_rank()
-            self.device = torch.device(f'cuda:{self.rank}')
+            if self.backend == 'nccl':
+                self.device = torch.device(f'cuda:{self.rank}')
+                torch.cuda.set_device(self.device)
+            else:
+                self.device = torch.device('cpu')
+            # Every rank must create groups in the same order
+            self.control_group = dist.new_group(backend='gloo') if self.backend != 'gloo' else None
             self.initialized = True
             
-            print(f"✅ Tensor parallelism initialized: rank {self.rank}/{self.world_size}")
+            print(f"✅ Tensor parallelism initialized: rank {self.rank}/{self.world_size} ({self.backend})")
             
         except Exception as e:
             print(f"❌ Failed to initialize tensor parallelism: {e}")
             self.initialized = False
+            raise RuntimeError(f"Tensor parallelism failed on rank {self.rank}") from e
             
+    def broadcast_object(self, obj=None):
+        """Send a picklable object from rank 0; every rank returns it"""
+        objects = [obj]
+        dist.broadcast_object_list(objects, src=0, group=self.control_group)
+        return objects[0]
+        
+    def destroy(self):
+        """Leave the process group"""
+        if self.initialized and dist.is_initialized():
+            dist.destroy_process_group()
+        self.initialized = False
+                    
     def split_tensor(self, tensor: torch.Tensor, dim: int = -1) -> torch.Tensor:
         """Split tensor across GPUs"""
         if not self.initialized or self.world_size <= 1:
@@ -133,12 +377,12 @@ class TensorParallel:
         return torch.cat(gathered_tensors, dim=-1)
         
     def all_reduce_tensor(self, tensor: torch.Tensor) -> torch.Tensor:
-        """All-reduce tensor across GPUs"""
+        """Sum partial results across ranks in place (row-parallel outputs)"""
         if not self.initialized or self.world_size <= 1:
             return tensor
             
         dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
-        return tensor / self.world_size
+        return tensor
 
 class PerformanceOptimizer:
     """
@@ -229,9 +473,15 @@ class AdaptiveBatching:
     Dynamically adjusts batch sizes based on GPU memory and request patterns
     """
     
-    def __init__(self, min_batch_size: int = 1, max_batch_size: int = 32):
+    def __init__(
+        self,
+        min_batch_size: int = 1,
+        max_batch_size: int = 32,
+        max_num_batched_tokens: int = 8192
+    ):
         self.min_batch_size = min_batch_size
         self.max_batch_size = max_batch_size
+        self.max_num_batched_tokens = max_num_batched_tokens
         self.current_batch_size = min_batch_size
         self.batch_history: List[Tuple[int, float]] = []  # (batch_size, throughput)
         
@@ -251,6 +501,48 @@ class AdaptiveBatching:
         
         return optimal_size
         
+    def plan_batches(
+        self,
+        prompt_lengths: List[int],
+        max_new_tokens: int,
+        available_memory: float = 1.0
+    ) -> List[List[int]]:
+        """
+        Group prompts into length-bucketed batches under the token budget
+        
+        Prompts are sorted by length so each batch pads to a similar size.
+        A batch is closed when it reaches the optimal batch size or when its
+        padded footprint (longest prompt + max_new_tokens per row) would
+        exceed max_num_batched_tokens.
+        
+        Returns:
+            List of batches, each a list of indices into prompt_lengths
+        """
+        order = sorted(range(len(prompt_lengths)), key=lambda i: prompt_lengths[i])
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_max_len = 0
+        
+        for position, index in enumerate(order):
+            if batch:
+                row_len = max(batch_max_len, prompt_lengths[index]) + max_new_tokens
+                if (len(batch) >= batch_limit
+                        or row_len * (len(batch) + 1) > self.max_num_batched_tokens):
+                    batches.append(batch)
+                    batch, batch_max_len = [], 0
+                    
+            if not batch:
+                remaining = len(order) - position
+                batch_limit = self.get_optimal_batch_size(available_memory, remaining)
+                
+            batch.append(index)
+            batch_max_len = max(batch_max_len, prompt_lengths[index])
+            
+        if batch:
+            batches.append(batch)
+            
+        return batches
+        
     def update_performance(self, batch_size: int, throughput: float):
         """Update performance history for adaptive learning"""
         self.batch_history.append((batch_size, throughput))
@@ -281,5 +573,6 @@ class AdaptiveBatching:
             'avg_throughput': avg_throughput,
             'total_batches': len(self.batch_history),
             'min_batch_size': self.min_batch_size,
-            'max_batch_size': self.max_batch_size
+            'max_batch_size': self.max_batch_size,
+            'max_num_batched_tokens': self.max_num_batched_tokens
         }
@@ -0,0 +1,313 @@
+"""
+Weight-only quantization for nano-vLLM
+Stores Linear weights as int8 (per output channel) or packed int4 (per group) and runs on CPU or GPU
+"""
+
+import os
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Dict, List, Optional, Sequence as SequenceType
+
+QUANTIZATION_MODES = ("int8", "int4")
+
+# Layers kept in full precision: the output head dominates accuracy loss
+# and is often tied to the input embeddings
+DEFAULT_SKIP_MODULES = ("lm_head",)
+
+DEFAULT_EVAL_TEXTS = [
+    "The quick brown fox jumps over the lazy dog while the farmer watches from the porch.",
+    "def fibonacci(n):\n    if n < 2:\n        return n\n    return fibonacci(n - 1) + fibonacci(n - 2)\n",
+    "Invoice #4821 issued on 2024-03-15 to Acme Corp for 12 units at $49.99 each, total $599.88.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose molecules.",
+    "SELECT name, COUNT(*) FROM orders WHERE status = 'shipped' GROUP BY name ORDER BY 2 DESC;",
+    "In 1969, Apollo 11 landed on the Moon and Neil Armstrong became the first person to walk on its surface."
+]
+
+class QuantizedLinear(nn.Module):
+    """
+    Linear layer with weight-only quantized storage
+    
+    int8 keeps one symmetric scale per output channel; int4 keeps one
+    symmetric scale per group of group_size input features and packs two
+    weights per byte. Activations stay in the model dtype and weights are
+    dequantized on the fly, so the layer runs wherever torch runs.
+    """
+    
+    def __init__(
+        self,
+        in_features: int,
+        out_features: int,
+        bias: bool,
+        bits: int,
+        group_size: int,
+        dtype: torch.dtype,
+        device: Optional[torch.device] = None
+    ):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = min(group_size, in_features) if bits == 4 else in_features
+        
+        packed_features = in_features if bits == 8 else in_features // 2
+        weight_dtype = torch.int8 if bits == 8 else torch.uint8
+        num_groups = in_features // self.group_size
+        self.register_buffer('qweight', torch.empty((out_features, packed_features), dtype=weight_dtype, device=device))
+        self.register_buffer('scales', torch.empty((out_features, num_groups), dtype=dtype, device=device))
+        self.bias = nn.Parameter(torch.empty(out_features, dtype=dtype, device=device), requires_grad=False) if bias else None
+        
+    @classmethod
+    def can_quantize(cls, linear: nn.Linear, bits: int, group_size: int) -> bool:
+        """Whether a layer's shape supports the requested layout"""
+        if bits == 8:
+            return True
+        return linear.in_features % 2 == 0 and linear.in_features % min(group_size, linear.in_features) == 0
+        
+    @classmethod
+    def from_linear(cls, linear: nn.Linear, bits: int, group_size: int = 128) -> 'QuantizedLinear':
+        """Quantize a Linear layer's weight with symmetric round-to-nearest"""
+        weight = linear.weight.detach()
+        layer = cls(
+            linear.in_features, linear.out_features, linear.bias is not None,
+            bits, group_size, weight.dtype, weight.device
+        )
+        qmax = 2 ** (bits - 1) - 1
+        
+        # [out, groups, group_size] so each group gets its own scale
+        grouped = weight.float().view(linear.out_features, -1, layer.group_size)
+        scales = grouped.abs().amax(dim=-1).clamp(min=1e-8) / qmax
+        q = torch.round(grouped / scales.unsqueeze(-1)).clamp(-qmax - 1, qmax).to(torch.int8)
+        q = q.view(linear.out_features, linear.in_features)
+        
+        if bits == 4:
+            # Two's offset into [0, 15]; even columns in the low nibble
+            q = (q + 8).to(torch.uint8)
+            q = q[:, 0::2] | (q[:, 1::2] << 4)
+            
+        layer.qweight.copy_(q)
+        layer.scales.copy_(scales.to(weight.dtype))
+        if linear.bias is not None:
+            layer.bias.data.copy_(linear.bias.detach())
+        return layer
+        
+    def dequantize(self, dtype: Optional[torch.dtype] = None) -> torch.Tensor:
+        """Full-precision weight of shape [out_features, in_features]"""
+        dtype = dtype or self.scales.dtype
+        if self.bits == 8:
+            q = self.qweight
+        else:
+            low = (self.qweight & 0x0F).to(torch.int8) - 8
+            high = (self.qweight >> 4).to(torch.int8) - 8
+            q = torch.stack([low, high], dim=-1).view(self.out_features, self.in_features)
+            
+        grouped = q.to(dtype).view(self.out_features, -1, self.group_size)
+        return (grouped * self.scales.to(dtype).unsqueeze(-1)).view(self.out_features, self.in_features)
+        
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.bits == 8 and x.dtype != torch.float16:
+            # Per-channel scales factor out of the matmul; fp16 would overflow
+            out = F.linear(x, self.qweight.to(x.dtype)) * self.scales[:, 0].to(x.dtype)
+        else:
+            out = F.linear(x, self.dequantize(x.dtype))
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+        
+    def extra_repr(self) -> str:
+        return (
+            f"in_features={self.in_features}, out_features={self.out_features}, "
+            f"bits={self.bits}, group_size={self.group_size}, bias={self.bias is not None}"
+        )
+
+def _bits(mode: str) -> int:
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"quantization must be one of {QUANTIZATION_MODES}")
+    return 8 if mode == "int8" else 4
+
+def _target_layers(
+    model: nn.Module,
+    bits: int,
+    group_size: int,
+    skip_modules: SequenceType[str]
+) -> List[str]:
+    """Names of Linear layers to quantize"""
+    names = []
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Linear):
+            continue
+        if any(name == skip or name.endswith("." + skip) for skip in skip_modules):
+            continue
+        if QuantizedLinear.can_quantize(module, bits, group_size):
+            names.append(name)
+    return names
+
+def _set_submodule(model: nn.Module, name: str, module: nn.Module):
+    parent_name, _, child_name = name.rpartition(".")
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child_name, module)
+
+def quantize_model(
+    model: nn.Module,
+    mode: str,
+    group_size: int = 128,
+    skip_modules: SequenceType[str] = DEFAULT_SKIP_MODULES
+) -> nn.Module:
+    """
+    Replace Linear layers with QuantizedLinear in place, one layer at a time
+    
+    Args:
+        model: Model with loaded weights
+        mode: "int8" or "int4"
+        group_size: Input features per scale for int4
+        skip_modules: Module names (or name suffixes) to keep in full precision
+        
+    Returns:
+        The same model
+    """
+    bits = _bits(mode)
+    for name in _target_layers(model, bits, group_size, skip_modules):
+        linear = model.get_submodule(name)
+        _set_submodule(model, name, QuantizedLinear.from_linear(linear, bits, group_size))
+        del linear
+    return model
+
+def prepare_quantized_model(
+    model: nn.Module,
+    mode: str,
+    group_size: int = 128,
+    skip_modules: SequenceType[str] = DEFAULT_SKIP_MODULES
+) -> nn.Module:
+    """
+    Swap Linear layers of an empty (meta) model for empty QuantizedLinear layers
+    
+    Used to bind a cached quantized checkpoint without materializing the
+    full-precision weights first.
+    """
+    bits = _bits(mode)
+    for name in _target_layers(model, bits, group_size, skip_modules):
+        linear = model.get_submodule(name)
+        _set_submodule(model, name, QuantizedLinear(
+            linear.in_features, linear.out_features, linear.bias is not None,
+            bits, group_size, linear.weight.dtype, torch.device('meta')
+        ))
+    return model
+
+def save_quantized(model: nn.Module, path: str, mode: str, group_size: int):
+    """
+    Write a quantized model's tensors as one safetensors file
+    
+    Tensors sharing storage (tied embeddings) are stored once; the file is
+    written next to path and renamed into place.
+    """
+    from safetensors.torch import save_file
+    
+    tensors, seen = {}, set()
+    for name, tensor in model.state_dict().items():
+        key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape))
+        if key in seen:
+            continue
+        seen.add(key)
+        tensors[name] = tensor.detach().to('cpu').contiguous()
+        
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = f"{path}.{os.getpid()}.tmp"
+    save_file(tensors, staging, metadata={'quantization': mode, 'group_size': str(group_size)})
+    os.replace(staging, path)
+
+def get_quantization_stats(model: nn.Module) -> Dict[str, float]:
+    """Quantized layer count and weight bytes before and after quantization"""
+    num_layers = 0
+    original_bytes = quantized_bytes = 0
+    for module in model.modules():
+        if isinstance(module, QuantizedLinear):
+            num_layers += 1
+            element_size = module.scales.element_size()
+            original_bytes += module.in_features * module.out_features * element_size
+            quantized_bytes += (
+                module.qweight.numel() * module.qweight.element_size()
+                + module.scales.numel() * element_size
+            )
+            
+    model_bytes = sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    full_precision_bytes = model_bytes - quantized_bytes + original_bytes
+    return {
+        'num_quantized_layers': num_layers,
+        'linear_bytes_original': original_bytes,
+        'linear_bytes_quantized': quantized_bytes,
+        'model_bytes': model_bytes,
+        'model_bytes_full_precision': full_precision_bytes,
+        'memory_saved_bytes': original_bytes - quantized_bytes,
+        'compression_ratio': full_precision_bytes / model_bytes if model_bytes else 1.0
+    }
+
+@torch.no_grad()
+def evaluate_perplexity(
+    model: nn.Module,
+    tokenizer,
+    texts: SequenceType[str] = DEFAULT_EVAL_TEXTS,
+    max_length: int = 512
+) -> Dict[str, object]:
+    """
+    Token-level negative log-likelihood of texts
+    
+    Returns:
+        {'perplexity', 'nll', 'num_tokens', 'predictions'} where predictions
+        holds the argmax next token at every position of every text
+    """
+    device = next(model.parameters()).device
+    total_nll, total_tokens = 0.0, 0
+    predictions = []
+    
+    for text in texts:
+        input_ids = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_length)['input_ids']
+        input_ids = input_ids.to(device)
+        if input_ids.size(1) < 2:
+            continue
+            
+        logits = model(input_ids=input_ids).logits[0, :-1].float()
+        targets = input_ids[0, 1:]
+        total_nll += F.cross_entropy(logits, targets, reduction='sum').item()
+        total_tokens += targets.numel()
+        predictions.append(logits.argmax(dim=-1).cpu())
+        
+    nll = total_nll / max(total_tokens, 1)
+    return {'perplexity': math.exp(nll), 'nll': nll, 'num_tokens': total_tokens, 'predictions': predictions}
+
+def compare_quantization(
+    model: nn.Module,
+    tokenizer,
+    mode: str,
+    group_size: int = 128,
+    texts: SequenceType[str] = DEFAULT_EVAL_TEXTS,
+    max_length: int = 512
+) -> Dict[str, float]:
+    """
+    Quantize a full-precision model in place and report memory saved and accuracy delta
+    
+    Perplexity and greedy next-token predictions on texts are measured
+    before and after quantization.
+    
+    Returns:
+        Memory statistics plus reference/quantized perplexity, their
+        relative difference and the top-1 next-token agreement
+    """
+    reference = evaluate_perplexity(model, tokenizer, texts, max_length)
+    quantize_model(model, mode, group_size)
+    quantized = evaluate_perplexity(model, tokenizer, texts, max_length)
+    
+    agreement = [
+        (ref == quant).float().mean().item()
+        for ref, quant in zip(reference['predictions'], quantized['predictions'])
+    ]
+    return {
+        'quantization': mode,
+        'group_size': group_size,
+        **get_quantization_stats(model),
+        'reference_perplexity': reference['perplexity'],
+        'quantized_perplexity': quantized['perplexity'],
+        'perplexity_delta_pct': (quantized['perplexity'] / reference['perplexity'] - 1) * 100,
+        'top1_agreement': sum(agreement) / len(agreement) if agreement else 1.0,
+        'num_eval_tokens': reference['num_tokens']
+    }
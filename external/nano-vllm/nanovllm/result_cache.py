@@ -0,0 +1,137 @@
+"""
+Result cache for nano-vLLM
+Keeps the outputs of deterministic requests on disk so repeated batch jobs skip generation
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence as SequenceType, Tuple
+
+from .sampling_params import SamplingParams
+
+def is_deterministic(sampling_params: SamplingParams) -> bool:
+    """Whether a request always produces the same output for the same prompt"""
+    return sampling_params.temperature == 0 or sampling_params.seed is not None
+
+def result_key(model_identity: str, prompt_token_ids: SequenceType[int], sampling_params: SamplingParams) -> bytes:
+    """Hash of everything that determines a deterministic request's output"""
+    payload = json.dumps(
+        [model_identity, list(prompt_token_ids), sampling_params.to_dict()],
+        sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode()).digest()
+
+class ResultCache:
+    """
+    Generated text and token IDs in a size-bounded SQLite store
+    
+    Features:
+    - Keyed by result_key: full prompt token IDs, model identity and every
+      SamplingParams field, so distinct prompts never share an entry
+    - Least recently used entries are evicted once the stored outputs
+      exceed max_size_gb
+    - Safe to share between processes; SQLite serializes the writers
+    """
+    
+    FILENAME = "results.sqlite"
+    
+    def __init__(self, path: str, max_size_gb: float):
+        """
+        Args:
+            path: Directory holding the database
+            max_size_gb: GiB of stored outputs kept before eviction
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, self.FILENAME)
+        self.max_bytes = int(max_size_gb * 1024**3)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key BLOB PRIMARY KEY, text TEXT NOT NULL, token_ids TEXT NOT NULL, "
+                "finish_reason TEXT, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+            
+        self.hits = 0
+        self.misses = 0
+        self.num_written = 0
+        self.num_evicted = 0
+        
+    def get(self, key: bytes) -> Optional[Tuple[str, List[int], Optional[str]]]:
+        """
+        Look up a stored result and mark it recently used
+        
+        Returns:
+            (text, output token IDs, finish reason), or None on a miss
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT text, token_ids, finish_reason FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        text, token_ids, finish_reason = row
+        return text, json.loads(token_ids), finish_reason
+        
+    def put_many(self, entries: List[Tuple[bytes, str, List[int], Optional[str]]]):
+        """Store (key, text, output token IDs, finish reason) entries, then evict down to the size limit"""
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, text, token_ids, finish_reason in entries:
+            token_json = json.dumps(token_ids, separators=(',', ':'))
+            rows.append((key, text, token_json, finish_reason, len(text.encode()) + len(token_json), now))
+            
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.num_written += len(rows)
+            self._evict()
+            
+    def _evict(self):
+        """Drop least recently used entries until the stored outputs fit in max_bytes"""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY last_access"):
+            if total - freed <= self.max_bytes:
+                break
+            evicted.append((key,))
+            freed += size
+        self.conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.num_evicted += len(evicted)
+        
+    def get_stats(self) -> Dict[str, float]:
+        """Get hit rate, size and eviction statistics"""
+        with self.lock:
+            num_entries, total = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': num_entries,
+            'size_bytes': total,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'written': self.num_written,
+            'evicted': self.num_evicted
+        }
+        
+    def close(self):
+        """Close the database"""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,276 @@
+"""
+Batched sampler for nano-vLLM
+Applies per-request SamplingParams to a [batch, vocab] logits tensor with tensor ops
+"""
+
+import torch
+from dataclasses import dataclass
+from typing import List, Optional, Sequence as SequenceType, Tuple
+
+from .sampling_params import SamplingParams
+from .sequence import Sequence
+from .constrained import TokenGuide, apply_guides
+
+def make_generator(sampling_params: SamplingParams, device: torch.device) -> Optional[torch.Generator]:
+    """Create a seeded random generator when the request asks for one"""
+    if sampling_params.seed is None:
+        return None
+        
+    generator = torch.Generator(device=device)
+    generator.manual_seed(sampling_params.seed)
+    return generator
+
+def _pad_rows(rows: List[List[int]], value: int) -> List[List[int]]:
+    """Right-pad ragged rows of token IDs to the same length"""
+    width = max((len(row) for row in rows), default=0)
+    return [row + [value] * (width - len(row)) for row in rows]
+
+@dataclass
+class SamplingTensors:
+    """
+    Per-row sampling parameters for one batch
+    
+    Args:
+        temperatures: [batch] float, 0 means greedy
+        top_ks: [batch] long, 0 means disabled
+        top_ps: [batch] float
+        repetition_penalties: [batch] float
+        min_tokens: [batch] long
+        output_lens: [batch] long, tokens generated so far
+        generators: Per-row seeded generators (None for unseeded rows)
+        token_ids: [batch, len] prompt and output tokens padded with -1,
+            only built when a row uses a repetition penalty
+        stop_token_ids: [batch, num_stops, stop_len] tokenized stop
+            sequences, left-padded with -1
+        stop_context: [batch, stop_len - 1] most recent tokens before the
+            one being sampled, left-padded with -2
+        guides: Constrained-decoding guide of each row (None for free rows),
+            only set when a row is constrained
+    """
+    temperatures: torch.Tensor
+    top_ks: torch.Tensor
+    top_ps: torch.Tensor
+    repetition_penalties: torch.Tensor
+    min_tokens: torch.Tensor
+    output_lens: torch.Tensor
+    generators: List[Optional[torch.Generator]]
+    token_ids: Optional[torch.Tensor] = None
+    stop_token_ids: Optional[torch.Tensor] = None
+    stop_context: Optional[torch.Tensor] = None
+    guides: Optional[List[Optional[TokenGuide]]] = None
+    
+    @classmethod
+    def build(
+        cls,
+        sampling_params: SequenceType[SamplingParams],
+        generators: SequenceType[Optional[torch.Generator]],
+        output_lens: SequenceType[int],
+        token_ids: SequenceType[List[int]],
+        stop_token_ids: SequenceType[List[List[int]]],
+        device: torch.device,
+        guides: Optional[SequenceType[Optional[TokenGuide]]] = None
+    ) -> 'SamplingTensors':
+        """
+        Build batch tensors from per-row parameters
+        
+        Args:
+            sampling_params: SamplingParams of each row
+            generators: Seeded generator of each row, or None
+            output_lens: Number of tokens each row has generated
+            token_ids: Prompt followed by generated tokens of each row
+            stop_token_ids: Tokenized stop sequences of each row
+            device: Device of the logits
+            guides: Constrained-decoding guide of each row, or None
+        """
+        tensors = cls(
+            temperatures=torch.tensor([p.temperature for p in sampling_params], dtype=torch.float, device=device),
+            top_ks=torch.tensor([p.top_k for p in sampling_params], dtype=torch.long, device=device),
+            top_ps=torch.tensor([p.top_p for p in sampling_params], dtype=torch.float, device=device),
+            repetition_penalties=torch.tensor(
+                [p.repetition_penalty for p in sampling_params], dtype=torch.float, device=device
+            ),
+            min_tokens=torch.tensor([p.min_tokens for p in sampling_params], dtype=torch.long, device=device),
+            output_lens=torch.tensor(list(output_lens), dtype=torch.long, device=device),
+            generators=list(generators)
+        )
+        
+        if guides is not None and any(guide is not None for guide in guides):
+            tensors.guides = list(guides)
+            
+        if any(p.repetition_penalty != 1.0 for p in sampling_params):
+            tensors.token_ids = torch.tensor(_pad_rows(list(token_ids), -1), dtype=torch.long, device=device)
+            
+        stop_len = max((len(stop) for stops in stop_token_ids for stop in stops), default=0)
+        if stop_len > 0:
+            num_stops = max(len(stops) for stops in stop_token_ids)
+            stop_rows = []
+            for stops in stop_token_ids:
+                stops = [[-1] * (stop_len - len(stop)) + list(stop) for stop in stops]
+                stops += [[-1] * stop_len] * (num_stops - len(stops))
+                stop_rows.append(stops)
+            context = [list(ids[len(ids) - stop_len + 1:]) if stop_len > 1 else [] for ids in token_ids]
+            context = [[-2] * (stop_len - 1 - len(row)) + row for row in context]
+            
+            tensors.stop_token_ids = torch.tensor(stop_rows, dtype=torch.long, device=device)
+            tensors.stop_context = torch.tensor(context, dtype=torch.long, device=device).view(len(context), -1)
+            
+        return tensors
+        
+    @classmethod
+    def from_sequences(cls, seqs: List[Sequence], device: torch.device) -> 'SamplingTensors':
+        """Build batch tensors for scheduled sequences"""
+        return cls.build(
+            [seq.sampling_params for seq in seqs],
+            [seq.generator for seq in seqs],
+            [len(seq.output_token_ids) for seq in seqs],
+            [seq.token_ids for seq in seqs],
+            [seq.stop_token_ids for seq in seqs],
+            device,
+            [seq.guide for seq in seqs]
+        )
+
+class Sampler:
+    """
+    Vectorized token sampler
+    
+    Features:
+    - Repetition penalty, min_tokens, temperature, top-k and top-p per row
+    - Greedy and random rows mixed in one batch
+    - Per-request torch.Generator for reproducible seeded rows
+    - Token-level stop sequence detection
+    - Constrained rows restricted to their guide's vocabulary mask
+    """
+    
+    def __init__(self, eos_token_id: Optional[int]):
+        self.eos_token_id = eos_token_id
+        
+    @torch.no_grad()
+    def __call__(self, logits: torch.Tensor, tensors: SamplingTensors) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Sample one token per row
+        
+        Args:
+            logits: [batch, vocab] next-token logits
+            tensors: Per-row sampling parameters
+            
+        Returns:
+            (token_ids [batch], stopped [batch] bool) where stopped marks rows
+            whose new token completes a stop sequence
+        """
+        logits = logits.to(torch.float, copy=True)
+        logits = self._apply_penalties(logits, tensors)
+        greedy_tokens = logits.argmax(dim=-1)
+        
+        greedy = tensors.temperatures == 0
+        if greedy.all():
+            token_ids = greedy_tokens
+        else:
+            temperatures = torch.where(greedy, torch.ones_like(tensors.temperatures), tensors.temperatures)
+            logits = logits / temperatures.unsqueeze(-1)
+            logits = self._apply_top_k_top_p(logits, tensors.top_ks, tensors.top_ps)
+            probs = torch.softmax(logits, dim=-1)
+            token_ids = torch.where(greedy, greedy_tokens, self.sample_from_probs(probs, tensors.generators))
+            
+        return token_ids, self._check_stops(token_ids, tensors)
+        
+    @torch.no_grad()
+    def probs(self, logits: torch.Tensor, tensors: SamplingTensors) -> torch.Tensor:
+        """
+        Distribution each row would be sampled from
+        
+        Applies the same penalties, temperature, top-k and top-p as __call__;
+        greedy rows get a one-hot distribution on their argmax. Used by
+        speculative decoding to verify draft tokens.
+        
+        Returns:
+            [batch, vocab] float probabilities
+        """
+        logits = logits.to(torch.float, copy=True)
+        logits = self._apply_penalties(logits, tensors)
+        
+        greedy = tensors.temperatures == 0
+        temperatures = torch.where(greedy, torch.ones_like(tensors.temperatures), tensors.temperatures)
+        logits = self._apply_top_k_top_p(logits / temperatures.unsqueeze(-1), tensors.top_ks, tensors.top_ps)
+        probs = torch.softmax(logits, dim=-1)
+        
+        if greedy.any():
+            one_hot = torch.zeros_like(probs).scatter_(1, logits.argmax(dim=-1, keepdim=True), 1.0)
+            probs = torch.where(greedy.unsqueeze(-1), one_hot, probs)
+        return probs
+                
+    def _apply_penalties(self, logits: torch.Tensor, tensors: SamplingTensors) -> torch.Tensor:
+        """Apply repetition penalty, suppress EOS before min_tokens and mask constrained rows"""
+        if tensors.token_ids is not None:
+            valid = tensors.token_ids >= 0
+            counts = torch.zeros_like(logits, dtype=torch.int)
+            counts.scatter_add_(1, tensors.token_ids.clamp(min=0), valid.int())
+            penalties = torch.where(
+                counts > 0,
+                tensors.repetition_penalties.unsqueeze(-1),
+                torch.ones_like(tensors.repetition_penalties).unsqueeze(-1)
+            )
+            logits = torch.where(logits > 0, logits / penalties, logits * penalties)
+            
+        if tensors.guides is not None:
+            logits = apply_guides(logits, tensors.guides)
+            
+        if self.eos_token_id is not None:
+            below_min = tensors.output_lens < tensors.min_tokens
+            if tensors.guides is not None:
+                # A constraint that allows nothing but EOS ends the output, min_tokens or not
+                allowed = logits != float('-inf')
+                allowed[:, self.eos_token_id] = False
+                below_min &= allowed.any(dim=-1)
+            logits[:, self.eos_token_id] = logits[:, self.eos_token_id].masked_fill(below_min, float('-inf'))
+            
+        return logits
+        
+    def _apply_top_k_top_p(self, logits: torch.Tensor, top_ks: torch.Tensor, top_ps: torch.Tensor) -> torch.Tensor:
+        """Mask tokens outside each row's top-k and nucleus with one sort"""
+        vocab_size = logits.size(-1)
+        sorted_logits, sorted_indices = torch.sort(logits, dim=-1, descending=True)
+        
+        # Top-k: keep the first k ranks (k == 0 keeps everything)
+        top_ks = torch.where(top_ks > 0, top_ks.clamp(max=vocab_size), torch.full_like(top_ks, vocab_size))
+        ranks = torch.arange(vocab_size, device=logits.device).unsqueeze(0)
+        sorted_logits = sorted_logits.masked_fill(ranks >= top_ks.unsqueeze(-1), float('-inf'))
+        
+        # Top-p: drop tokens once the probability mass before them exceeds p
+        sorted_probs = torch.softmax(sorted_logits, dim=-1)
+        mass_before = sorted_probs.cumsum(dim=-1) - sorted_probs
+        sorted_logits = sorted_logits.masked_fill(mass_before > top_ps.unsqueeze(-1), float('-inf'))
+        
+        return torch.empty_like(logits).scatter_(1, sorted_indices, sorted_logits)
+        
+    def sample_from_probs(self, probs: torch.Tensor, generators: List[Optional[torch.Generator]]) -> torch.Tensor:
+        """
+        Draw one token per row with the exponential race trick
+        
+        argmax(p / E) with E ~ Exp(1) is distributed as Categorical(p). Rows
+        without a seed share one batched noise draw; only seeded rows draw
+        their noise from their own generator.
+        """
+        seeded = [row for row, generator in enumerate(generators) if generator is not None]
+        if not seeded:
+            return (probs / torch.empty_like(probs).exponential_()).argmax(dim=-1)
+            
+        noise = torch.empty_like(probs)
+        unseeded = [row for row, generator in enumerate(generators) if generator is None]
+        if unseeded:
+            index = torch.tensor(unseeded, device=probs.device)
+            noise.index_copy_(0, index, torch.empty_like(probs[index]).exponential_())
+        seeded_noise = torch.stack([
+            torch.empty_like(probs[row]).exponential_(generator=generators[row]) for row in seeded
+        ])
+        noise.index_copy_(0, torch.tensor(seeded, device=probs.device), seeded_noise)
+        return (probs / noise).argmax(dim=-1)
+        
+    def _check_stops(self, token_ids: torch.Tensor, tensors: SamplingTensors) -> torch.Tensor:
+        """Rows whose most recent tokens end with one of their stop sequences"""
+        if tensors.stop_token_ids is None:
+            return torch.zeros_like(token_ids, dtype=torch.bool)
+            
+        recent = torch.cat([tensors.stop_context, token_ids.unsqueeze(-1)], dim=-1)
+        stops = tensors.stop_token_ids
+        matches = ((stops == recent.unsqueeze(1)) | (stops == -1)).all(dim=-1)
+        return (matches & (stops != -1).any(dim=-1)).any(dim=-1)
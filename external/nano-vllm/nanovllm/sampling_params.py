@@ -18,8 +18,12 @@ class SamplingParams:
         max_tokens: Maximum number of tokens to generate
         min_tokens: Minimum number of tokens to generate  
         repetition_penalty: Penalty for repeating tokens
-        stop_sequences: List of sequences that stop generation
+        stop_sequences: Strings that stop generation; matched in the detokenized
+            text and left out of the output
+        stop_token_ids: Token IDs that stop generation
         seed: Random seed for reproducible generation
+        regex: Constrain the output to a full match of this regex
+        json_schema: Constrain the output to JSON valid under this schema
     """
     
     # Core sampling parameters
@@ -32,8 +36,13 @@ class SamplingParams:
     # Advanced parameters
     repetition_penalty: float = 1.0
     stop_sequences: Optional[list] = None
+    stop_token_ids: Optional[list] = None
     seed: Optional[int] = None
     
+    # Constrained decoding
+    regex: Optional[str] = None
+    json_schema: Optional[dict] = None
+    
     # Performance parameters
     use_beam_search: bool = False
     num_beams: int = 1
@@ -53,9 +62,13 @@ class SamplingParams:
             raise ValueError("min_tokens must be non-negative")
         if self.repetition_penalty < 0:
             raise ValueError("repetition_penalty must be non-negative")
+        if self.regex is not None and self.json_schema is not None:
+            raise ValueError("Only one of regex and json_schema can be set")
             
         if self.stop_sequences is None:
             self.stop_sequences = []
+        if self.stop_token_ids is None:
+            self.stop_token_ids = []
             
     @classmethod
     def greedy(cls, max_tokens: int = 256):
@@ -92,7 +105,10 @@ class SamplingParams:
             'min_tokens': self.min_tokens,
             'repetition_penalty': self.repetition_penalty,
             'stop_sequences': self.stop_sequences,
+            'stop_token_ids': self.stop_token_ids,
             'seed': self.seed,
+            'regex': self.regex,
+            'json_schema': self.json_schema,
             'use_beam_search': self.use_beam_search,
             'num_beams': self.num_beams,
             'early_stopping': self.early_stopping
@@ -0,0 +1,370 @@
+"""
+Continuous-batching scheduler for nano-vLLM
+Admits, retires and preempts sequences at every decode step
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set
+
+from .sequence import Sequence, SequenceStatus
+from .cache_manager import KVCacheManager
+from .optimizations import PrefixCache
+from .kv_offload import KVSwapper
+
+@dataclass
+class SchedulerOutput:
+    """Sequences selected for one engine step"""
+    prefill_seqs: List[Sequence] = field(default_factory=list)
+    # Tokens prefilled for each of prefill_seqs in this step
+    prefill_chunks: List[int] = field(default_factory=list)
+    decode_seqs: List[Sequence] = field(default_factory=list)
+    preempted_seqs: List[Sequence] = field(default_factory=list)
+    # Prompt tokens of newly admitted sequences served from the prefix cache
+    num_cached_tokens: int = 0
+    
+    @property
+    def num_seqs(self) -> int:
+        """Number of sequences that run in this step"""
+        return len(self.prefill_seqs) + len(self.decode_seqs)
+        
+    @property
+    def is_empty(self) -> bool:
+        """Whether nothing was scheduled"""
+        return self.num_seqs == 0
+
+class Scheduler:
+    """
+    Iteration-level scheduler with running and waiting queues
+    
+    Features:
+    - New requests join the running batch at every step
+    - Finished sequences retire immediately
+    - Block-based KV admission; when blocks run out, sequences are preempted
+      by swapping their KV to host memory or disk, or by recompute
+    - Prefix cache lookup on admission; idle cached prefixes are evicted
+      before any running sequence is preempted
+    - Chunked prefill: long prompts are prefilled a chunk per step alongside
+      the decode batch, within a per-step token budget
+    - Per-step batch occupancy statistics
+    """
+    
+    def __init__(
+        self,
+        kv_cache: KVCacheManager,
+        max_num_seqs: int = 32,
+        max_num_batched_tokens: int = 8192,
+        prefix_cache: Optional[PrefixCache] = None,
+        stats_window: int = 1000,
+        prefill_chunk_size: Optional[int] = None,
+        kv_swapper: Optional[KVSwapper] = None
+    ):
+        """
+        Args:
+            max_num_batched_tokens: Per-step token budget; decode tokens plus
+                padded prefill tokens with chunked prefill, padded prefill
+                tokens only without
+            prefill_chunk_size: Most prompt tokens prefilled per sequence in
+                one step (None prefills each prompt in a single step)
+            kv_swapper: Swap space for preempted sequences (None: always
+                preempt by recompute)
+        """
+        if prefill_chunk_size is not None:
+            if prefill_chunk_size < 1:
+                raise ValueError("prefill_chunk_size must be positive")
+            if max_num_batched_tokens <= max_num_seqs:
+                raise ValueError(
+                    "max_num_batched_tokens must exceed max_num_seqs so prefill "
+                    "chunks fit beside a full decode batch"
+                )
+                
+        self.kv_cache = kv_cache
+        self.prefix_cache = prefix_cache
+        self.max_num_seqs = max_num_seqs
+        self.max_num_batched_tokens = max_num_batched_tokens
+        self.prefill_chunk_size = prefill_chunk_size
+        self.kv_swapper = kv_swapper
+        
+        self.waiting: Deque[Sequence] = deque()
+        self.running: List[Sequence] = []
+        self.swapped: Deque[Sequence] = deque()
+        
+        self.num_steps = 0
+        self.num_preemptions = 0
+        self.num_swap_preemptions = 0
+        self.num_finished = 0
+        self.step_stats: Deque[Dict[str, float]] = deque(maxlen=stats_window)
+        
+    def add_sequence(self, seq: Sequence):
+        """Queue a new sequence for admission"""
+        seq.status = SequenceStatus.WAITING
+        self.waiting.append(seq)
+        
+    def abort_sequence(self, seq_id: int) -> bool:
+        """Remove a sequence from whichever queue holds it"""
+        for queue in (self.waiting, self.running, self.swapped):
+            for seq in queue:
+                if seq.seq_id == seq_id:
+                    queue.remove(seq)
+                    self._free(seq)
+                    seq.finish('abort')
+                    return True
+        return False
+        
+    def has_unfinished(self) -> bool:
+        """Whether any sequence is waiting, running or swapped out"""
+        return bool(self.waiting or self.running or self.swapped)
+        
+    def schedule(self) -> SchedulerOutput:
+        """
+        Pick the sequences to run in the next step
+        
+        Running sequences are decoded first and each gets a KV slot for its
+        next token. If there are not enough free blocks for that, the most
+        recently admitted ones are preempted: swapped out when there is swap
+        space, otherwise sent back to the waiting queue for recompute.
+        Swapped-out sequences are swapped back in before anything new is
+        admitted. Partially prefilled sequences then get their next chunk,
+        and remaining capacity is filled with waiting sequences, subject to
+        the batch size limit, the per-step token budget and the free blocks.
+        Blocks for a whole prompt are allocated on admission.
+        
+        Returns:
+            SchedulerOutput for this step
+        """
+        output = SchedulerOutput()
+        
+        # Reserve one new KV slot per decoding sequence
+        while self.running and not self._ensure_free_blocks(self._num_append_blocks()):
+            victim = self.running.pop()
+            self._preempt(victim)
+            output.preempted_seqs.append(victim)
+            
+        for seq in self.running:
+            if not seq.is_prefilling:
+                self.kv_cache.append_slot(seq.seq_id)
+                output.decode_seqs.append(seq)
+                
+        # Resume swapped-out sequences, oldest first; not in a step that had to preempt
+        while self.swapped and len(self.running) < self.max_num_seqs and not output.preempted_seqs:
+            seq = self.swapped[0]
+            if self._exceeds_capacity(seq):
+                # Can never be swapped back in with room for its next token
+                self.swapped.popleft()
+                self._free(seq)
+                seq.finish('length')
+                self.num_finished += 1
+                continue
+                
+            # Plus room for the next token
+            if not self._ensure_free_blocks(self.kv_swapper.get_num_swap_in_blocks(seq.seq_id) + 1):
+                break
+                
+            self.swapped.popleft()
+            self.kv_swapper.swap_in(seq.seq_id)
+            seq.status = SequenceStatus.RUNNING
+            self.running.append(seq)
+            if not seq.is_prefilling:
+                self.kv_cache.append_slot(seq.seq_id)
+                output.decode_seqs.append(seq)
+                
+        token_budget = self.max_num_batched_tokens - len(output.decode_seqs)
+        prefill_tokens = 0
+        prefill_max_len = 0
+        
+        # Continue chunked prefills, oldest first
+        for seq in self.running:
+            if not seq.is_prefilling:
+                continue
+            chunk = self._prefill_chunk(
+                seq.num_prefill_tokens - seq.num_computed_tokens,
+                len(output.prefill_seqs), prefill_max_len, token_budget
+            )
+            if chunk == 0:
+                break
+            output.prefill_seqs.append(seq)
+            output.prefill_chunks.append(chunk)
+            prefill_tokens += chunk
+            prefill_max_len = max(prefill_max_len, chunk)
+            
+        # Admit waiting sequences once nothing is swapped out; not in a step that had to preempt
+        while (
+            self.waiting and not self.swapped
+            and len(self.running) < self.max_num_seqs and not output.preempted_seqs
+        ):
+            seq = self.waiting[0]
+            num_tokens = seq.num_tokens
+            
+            if self.kv_cache.get_num_required_blocks(num_tokens) > self.kv_cache.num_blocks:
+                # Can never fit, even with an empty cache
+                self.waiting.popleft()
+                seq.finish('length')
+                self.num_finished += 1
+                continue
+                
+            prefix_blocks, num_cached_tokens = [], 0
+            if self.prefix_cache is not None:
+                prefix_blocks, num_cached_tokens = self.prefix_cache.match(seq.token_ids)
+                
+            chunk = self._prefill_chunk(
+                num_tokens - num_cached_tokens, len(output.prefill_seqs), prefill_max_len, token_budget
+            )
+            if chunk == 0:
+                break
+                                
+            num_new_blocks = self.kv_cache.get_num_required_blocks(num_tokens) - len(prefix_blocks)
+            if not self._ensure_free_blocks(num_new_blocks, protected=set(prefix_blocks)):
+                break
+                
+            self.waiting.popleft()
+            self.kv_cache.allocate(seq.seq_id, num_tokens, prefix_blocks)
+            seq.num_computed_tokens = num_cached_tokens
+            seq.num_prefill_tokens = num_tokens
+            if self.prefix_cache is not None:
+                self.prefix_cache.record_lookup(num_tokens, num_cached_tokens)
+                
+            seq.status = SequenceStatus.RUNNING
+            self.running.append(seq)
+            output.prefill_seqs.append(seq)
+            output.prefill_chunks.append(chunk)
+            output.num_cached_tokens += num_cached_tokens
+            prefill_tokens += chunk
+            prefill_max_len = max(prefill_max_len, chunk)
+                        
+        self._record_step(output, prefill_tokens, prefill_max_len)
+        return output
+        
+    def update(self):
+        """Retire sequences that finished during the last step"""
+        finished = [seq for seq in self.running if seq.is_finished]
+        if finished:
+            self.running = [seq for seq in self.running if not seq.is_finished]
+            self.num_finished += len(finished)
+            for seq in finished:
+                self._free(seq)
+                
+    def _prefill_chunk(self, num_new_tokens: int, num_rows: int, max_len: int, token_budget: int) -> int:
+        """
+        Tokens of a prefill that fit in this step
+        
+        Prefill rows are padded to the longest one, so the budget is charged
+        for max chunk length times rows. Without chunking a prefill is taken
+        whole, and the first one of a step always fits.
+        
+        Args:
+            num_new_tokens: Tokens still to prefill for the sequence
+            num_rows: Prefill rows already scheduled in this step
+            max_len: Longest chunk already scheduled in this step
+            token_budget: Padded prefill tokens allowed in this step
+            
+        Returns:
+            Chunk length, or 0 if the prefill has to wait
+        """
+        if self.prefill_chunk_size is None:
+            padded_len = max(max_len, num_new_tokens)
+            if num_rows and padded_len * (num_rows + 1) > self.max_num_batched_tokens:
+                return 0
+            return num_new_tokens
+            
+        if max_len * (num_rows + 1) > token_budget:
+            return 0
+        return min(num_new_tokens, self.prefill_chunk_size, token_budget // (num_rows + 1))
+        
+    def _ensure_free_blocks(self, num_blocks: int, protected: Optional[Set[int]] = None) -> bool:
+        """Make num_blocks blocks free, evicting idle cached prefixes if needed"""
+        shortfall = num_blocks - self.kv_cache.get_num_free_blocks()
+        if shortfall > 0 and self.prefix_cache is not None:
+            self.prefix_cache.evict(shortfall, protected)
+        return self.kv_cache.get_num_free_blocks() >= num_blocks
+        
+    def _free(self, seq: Sequence):
+        """Release a sequence's blocks, keeping its computed prefix in the cache"""
+        if self.kv_swapper is not None:
+            self.kv_swapper.free(seq.seq_id)
+        if not self.kv_cache.has_sequence(seq.seq_id):
+            return
+            
+        if self.prefix_cache is not None:
+            self.prefix_cache.insert(
+                seq.token_ids[:seq.num_computed_tokens],
+                self.kv_cache.block_tables[seq.seq_id]
+            )
+        self.kv_cache.free(seq.seq_id)
+        
+    def _num_append_blocks(self) -> int:
+        """Blocks needed to give every decoding sequence one more slot"""
+        return sum(
+            self.kv_cache.get_num_append_blocks(seq.seq_id)
+            for seq in self.running if not seq.is_prefilling
+        )
+        
+    def _preempt(self, seq: Sequence):
+        """
+        Swap a running sequence out, or free its blocks and requeue it at the front
+        
+        A sequence that has outgrown the whole pool could never resume, so it
+        is finished with reason 'length' instead.
+        """
+        self.num_preemptions += 1
+        if self._exceeds_capacity(seq):
+            self._free(seq)
+            seq.finish('length')
+            self.num_finished += 1
+            return
+            
+        if self.kv_swapper is not None and self.kv_swapper.swap_out(seq.seq_id):
+            seq.status = SequenceStatus.SWAPPED
+            # Most recently admitted first out, last back in
+            self.swapped.appendleft(seq)
+            self.num_swap_preemptions += 1
+            return
+            
+        self._free(seq)
+        seq.reset_for_recompute()
+        self.waiting.appendleft(seq)
+        
+    def _exceeds_capacity(self, seq: Sequence) -> bool:
+        """Whether a sequence and its next token need more blocks than the pool has"""
+        return self.kv_cache.get_num_required_blocks(seq.num_tokens + 1) > self.kv_cache.num_blocks
+        
+    def _record_step(self, output: SchedulerOutput, prefill_tokens: int, prefill_max_len: int):
+        """Record batch occupancy and prefill padding for this step"""
+        self.num_steps += 1
+        self.step_stats.append({
+            'num_seqs': output.num_seqs,
+            'num_prefill': len(output.prefill_seqs),
+            'num_decode': len(output.decode_seqs),
+            'num_preempted': len(output.preempted_seqs),
+            'num_waiting': len(self.waiting),
+            'prefill_tokens': prefill_tokens,
+            # Prefill rows are padded to the longest chunk
+            'prefill_padded_tokens': prefill_max_len * len(output.prefill_seqs),
+            'occupancy': output.num_seqs / self.max_num_seqs,
+            'kv_utilization': self.kv_cache.get_utilization()
+        })
+        
+    def get_stats(self) -> Dict[str, float]:
+        """Get scheduling and batch occupancy statistics"""
+        window = list(self.step_stats)
+        avg_occupancy = sum(s['occupancy'] for s in window) / len(window) if window else 0.0
+        avg_batch_size = sum(s['num_seqs'] for s in window) / len(window) if window else 0.0
+        padded_tokens = sum(s['prefill_padded_tokens'] for s in window)
+        prefill_tokens = sum(s['prefill_tokens'] for s in window)
+        
+        return {
+            'num_steps': self.num_steps,
+            'num_running': len(self.running),
+            'num_waiting': len(self.waiting),
+            'num_finished': self.num_finished,
+            'num_preemptions': self.num_preemptions,
+            'num_swap_preemptions': self.num_swap_preemptions,
+            'num_swapped': len(self.swapped),
+            'num_prefilling': sum(seq.is_prefilling for seq in self.running),
+            'avg_batch_occupancy': avg_occupancy,
+            'avg_batch_size': avg_batch_size,
+            'last_batch_occupancy': window[-1]['occupancy'] if window else 0.0,
+            'prefill_padding_ratio': 1.0 - prefill_tokens / padded_tokens if padded_tokens else 0.0,
+            'max_num_seqs': self.max_num_seqs,
+            'max_num_batched_tokens': self.max_num_batched_tokens,
+            'prefill_chunk_size': self.prefill_chunk_size
+        }
@@ -0,0 +1,109 @@
+"""
+Sequence state for nano-vLLM scheduling
+Tracks tokens, status and timing for each in-flight request
+"""
+
+import time
+from enum import Enum
+from itertools import count
+from typing import List, Optional
+
+from .sampling_params import SamplingParams
+
+class SequenceStatus(Enum):
+    """Lifecycle state of a sequence"""
+    WAITING = "waiting"
+    RUNNING = "running"
+    SWAPPED = "swapped"
+    FINISHED = "finished"
+
+class Sequence:
+    """
+    A single generation request
+    
+    Holds the prompt and generated token IDs and the timestamps the
+    scheduler and metrics need. KV storage lives in the KVCacheManager
+    block table keyed by seq_id.
+    """
+    
+    _id_counter = count()
+    
+    def __init__(
+        self,
+        prompt: str,
+        prompt_token_ids: List[int],
+        sampling_params: SamplingParams,
+        seq_id: Optional[int] = None,
+        arrival_time: Optional[float] = None
+    ):
+        self.seq_id = next(self._id_counter) if seq_id is None else seq_id
+        self.prompt = prompt
+        self.prompt_token_ids = list(prompt_token_ids)
+        self.output_token_ids: List[int] = []
+        self.sampling_params = sampling_params
+        self.status = SequenceStatus.WAITING
+        self.finish_reason: Optional[str] = None
+        
+        # Number of leading tokens whose KV is stored in the cache
+        self.num_computed_tokens = 0
+        # Tokens the current prefill covers; with chunked prefill it spans several steps
+        self.num_prefill_tokens = 0
+        self.num_preemptions = 0
+        self.generator = None
+        self.stop_token_ids: List[List[int]] = []
+        # StopStringDetokenizer when the request has stop strings
+        self.detokenizer = None
+        # TokenGuide when the output is constrained to a regex or JSON schema
+        self.guide = None
+        
+        # Timing
+        self.arrival_time = time.time() if arrival_time is None else arrival_time
+        self.first_scheduled_time: Optional[float] = None
+        self.first_token_time: Optional[float] = None
+        self.last_token_time: Optional[float] = None
+        self.finish_time: Optional[float] = None
+        
+    @property
+    def token_ids(self) -> List[int]:
+        """Prompt followed by generated tokens"""
+        return self.prompt_token_ids + self.output_token_ids
+        
+    @property
+    def num_tokens(self) -> int:
+        """Total number of prompt and generated tokens"""
+        return len(self.prompt_token_ids) + len(self.output_token_ids)
+        
+    @property
+    def num_prompt_tokens(self) -> int:
+        """Number of prompt tokens"""
+        return len(self.prompt_token_ids)
+        
+    @property
+    def is_prefilling(self) -> bool:
+        """Whether part of the admitted prefill still has no KV"""
+        return self.num_computed_tokens < self.num_prefill_tokens
+        
+    @property
+    def is_finished(self) -> bool:
+        """Whether the sequence has finished"""
+        return self.status == SequenceStatus.FINISHED
+        
+    def append_token(self, token_id: int):
+        """Record a newly generated token"""
+        self.last_token_time = time.time()
+        if self.first_token_time is None:
+            self.first_token_time = self.last_token_time
+        self.output_token_ids.append(token_id)
+        
+    def finish(self, reason: str):
+        """Mark the sequence finished"""
+        self.status = SequenceStatus.FINISHED
+        self.finish_reason = reason
+        self.finish_time = time.time()
+        
+    def reset_for_recompute(self):
+        """Drop computed KV so the sequence is prefilled again when resumed"""
+        self.status = SequenceStatus.WAITING
+        self.num_computed_tokens = 0
+        self.num_prefill_tokens = 0
+        self.num_preemptions += 1
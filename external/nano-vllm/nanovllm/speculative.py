@@ -0,0 +1,365 @@
+"""
+Speculative decoding for nano-vLLM
+A cheap proposer guesses k tokens and the target model verifies them in one forward pass
+"""
+
+import torch
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .sequence import Sequence
+from .sampler import Sampler, SamplingTensors
+from .cache_manager import KVCacheManager
+from .model_runner import ModelRunner
+
+# Draft tokens per sequence and, for sampled proposals, their draft
+# distributions [num_drafts, vocab] (None means each draft was chosen
+# deterministically, i.e. q is one-hot)
+Proposal = Tuple[List[int], Optional[torch.Tensor]]
+
+class NgramProposer:
+    """
+    Prompt lookup proposer
+    
+    Finds the most recent earlier occurrence of the sequence's last n tokens
+    (longest n first) and proposes the tokens that followed it. Costs no
+    model forward and works well when outputs copy spans of the prompt.
+    """
+    
+    def __init__(self, max_ngram: int = 4, min_ngram: int = 1):
+        if min_ngram < 1 or max_ngram < min_ngram:
+            raise ValueError("Need 1 <= min_ngram <= max_ngram")
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+        
+    def propose(self, seqs: List[Sequence], num_drafts: List[int]) -> List[Proposal]:
+        return [(self._lookup(seq.token_ids, k), None) for seq, k in zip(seqs, num_drafts)]
+        
+    def _lookup(self, token_ids: List[int], k: int) -> List[int]:
+        if k <= 0:
+            return []
+            
+        for n in range(min(self.max_ngram, len(token_ids) - 1), self.min_ngram - 1, -1):
+            pattern = token_ids[-n:]
+            # Search right to left, excluding the suffix itself
+            for start in range(len(token_ids) - n - 1, -1, -1):
+                if token_ids[start:start + n] == pattern:
+                    return token_ids[start + n:start + n + k]
+        return []
+        
+    def rollback(self, seq: Sequence, num_valid_tokens: int):
+        pass
+        
+    def free(self, seq_id: int):
+        pass
+
+class _DraftSequence:
+    """View of a target sequence as seen by the draft model's KV cache"""
+    
+    def __init__(self, seq_id: int, token_ids: List[int], num_computed_tokens: int):
+        self.seq_id = seq_id
+        self.token_ids = token_ids
+        self.num_computed_tokens = num_computed_tokens
+        
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_ids)
+
+class DraftModelProposer:
+    """
+    Small draft model proposer
+    
+    The draft model keeps its own paged KV cache keyed by the target seq_id,
+    catches up on tokens the target accepted since the last step with one
+    batched prefill, then decodes k tokens autoregressively. Drafts are
+    sampled with the request's own SamplingParams so rejection sampling can
+    use their exact probabilities.
+    """
+    
+    def __init__(self, model: torch.nn.Module, kv_cache: KVCacheManager, sampler: Sampler, pad_token_id: int):
+        self.runner = ModelRunner(model, kv_cache, pad_token_id)
+        self.kv_cache = kv_cache
+        self.sampler = sampler
+        self.num_computed: Dict[int, int] = {}
+        
+    def propose(self, seqs: List[Sequence], num_drafts: List[int]) -> List[Proposal]:
+        proposals: List[Proposal] = [([], None)] * len(seqs)
+        active = [
+            row for row, (seq, k) in enumerate(zip(seqs, num_drafts))
+            if k > 0 and self._reserve(seq, k)
+        ]
+        if not active:
+            return proposals
+            
+        k_max = max(num_drafts[row] for row in active)
+        views = [
+            _DraftSequence(seqs[row].seq_id, list(seqs[row].token_ids), self.num_computed[seqs[row].seq_id])
+            for row in active
+        ]
+        drafts: List[List[int]] = [[] for _ in active]
+        draft_probs: List[List[torch.Tensor]] = [[] for _ in active]
+        
+        # Rows of views still drafting
+        live = list(range(len(active)))
+        logits = self.runner.prefill(views)
+        for step in range(k_max):
+            tensors = SamplingTensors.build(
+                [seqs[active[i]].sampling_params for i in live],
+                [seqs[active[i]].generator for i in live],
+                [len(seqs[active[i]].output_token_ids) + step for i in live],
+                [views[i].token_ids for i in live],
+                [[] for _ in live],
+                logits.device
+            )
+            probs = self.sampler.probs(logits, tensors)
+            tokens = self.sampler.sample_from_probs(probs, tensors.generators).tolist()
+            
+            for j, i in enumerate(live):
+                drafts[i].append(tokens[j])
+                draft_probs[i].append(probs[j])
+                views[i].token_ids.append(tokens[j])
+                
+            live = [i for i in live if len(drafts[i]) < num_drafts[active[i]]]
+            if not live:
+                break
+            logits = self.runner.decode([views[i] for i in live])
+            
+        for i, (row, view) in enumerate(zip(active, views)):
+            self.num_computed[view.seq_id] = view.num_computed_tokens
+            proposals[row] = (drafts[i], torch.stack(draft_probs[i]))
+        return proposals
+        
+    def _reserve(self, seq: Sequence, k: int) -> bool:
+        """Make room in the draft cache for the sequence plus k - 1 drafted tokens"""
+        needed = seq.num_tokens + k - 1
+        if seq.seq_id not in self.num_computed:
+            if not self.kv_cache.can_allocate(needed):
+                return False
+            self.kv_cache.allocate(seq.seq_id, needed)
+            self.num_computed[seq.seq_id] = 0
+            return True
+            
+        extra = needed - self.kv_cache.seq_lens[seq.seq_id]
+        extra_blocks = (
+            self.kv_cache.get_num_required_blocks(needed) - len(self.kv_cache.block_tables[seq.seq_id])
+        )
+        if extra_blocks > self.kv_cache.get_num_free_blocks():
+            return False
+        for _ in range(extra):
+            self.kv_cache.append_slot(seq.seq_id)
+        return True
+        
+    def rollback(self, seq: Sequence, num_valid_tokens: int):
+        """Forget draft KV past the tokens the target kept"""
+        if seq.seq_id not in self.num_computed:
+            return
+        num_computed = min(self.num_computed[seq.seq_id], num_valid_tokens)
+        self.num_computed[seq.seq_id] = num_computed
+        self.kv_cache.trim(seq.seq_id, num_computed)
+        
+    def free(self, seq_id: int):
+        self.num_computed.pop(seq_id, None)
+        self.kv_cache.free(seq_id)
+
+Proposer = Union[NgramProposer, DraftModelProposer]
+
+class SpeculativeDecoder:
+    """
+    Draft-then-verify decode step
+    
+    Features:
+    - Up to num_speculative_tokens drafts per sequence from an n-gram or
+      draft model proposer
+    - One target forward pass scores the last token and all drafts
+    - Rejection sampling: draft d is kept with probability min(1, p(d)/q(d))
+      and the first rejection is resampled from max(0, p - q), so outputs
+      follow the target distribution exactly; greedy rows reduce to
+      "keep drafts while they match the argmax"
+    - Rejected positions are trimmed from the KV cache
+    - Acceptance statistics
+    """
+    
+    def __init__(
+        self,
+        proposer: Proposer,
+        kv_cache: KVCacheManager,
+        model_runner: ModelRunner,
+        num_speculative_tokens: int = 4,
+        max_model_len: Optional[int] = None
+    ):
+        self.proposer = proposer
+        self.kv_cache = kv_cache
+        self.model_runner = model_runner
+        self.sampler = model_runner.sampler
+        self.num_speculative_tokens = num_speculative_tokens
+        self.max_model_len = max_model_len
+        
+        self.num_steps = 0
+        self.num_seq_steps = 0
+        self.num_draft_tokens = 0
+        self.num_accepted_tokens = 0
+        self.num_emitted_tokens = 0
+        
+    def step(self, seqs: List[Sequence], append_tokens: Callable[[Sequence, List[int]], int]):
+        """
+        Run one speculative decode step for running sequences
+        
+        Each sequence's next KV slot must already be reserved, as for a
+        normal decode step.
+        
+        Args:
+            seqs: Sequences to decode
+            append_tokens: Appends tokens to a sequence in order, applying
+                stop conditions, and returns how many were appended
+        """
+        num_drafts = [self._max_drafts(seq) for seq in seqs]
+        proposals = self.proposer.propose(seqs, num_drafts)
+        
+        drafts = []
+        for seq, (tokens, _) in zip(seqs, proposals):
+            drafts.append(tokens[:self._reserve(seq, len(tokens))])
+            
+        logits = self.model_runner.verify(seqs, drafts)
+        accepted, next_tokens = self._rejection_sample(seqs, drafts, proposals, logits)
+        
+        for seq, seq_drafts, num_accepted, next_token in zip(seqs, drafts, accepted, next_tokens):
+            kv_len = seq.num_computed_tokens
+            tokens = seq_drafts[:num_accepted] + [next_token]
+            num_appended = append_tokens(seq, tokens)
+            
+            # KV is valid for the last token and the accepted drafts that were kept
+            seq.num_computed_tokens = kv_len + min(len(tokens), num_appended + 1)
+            self.kv_cache.trim(seq.seq_id, seq.num_computed_tokens)
+            self.proposer.rollback(seq, seq.num_computed_tokens)
+            
+            self.num_draft_tokens += len(seq_drafts)
+            self.num_accepted_tokens += num_accepted
+            self.num_emitted_tokens += num_appended
+        self.num_steps += 1
+        self.num_seq_steps += len(seqs)
+        
+    def free(self, seq_id: int):
+        """Drop proposer state of a finished or preempted sequence"""
+        self.proposer.free(seq_id)
+        
+    def _max_drafts(self, seq: Sequence) -> int:
+        """Drafts worth proposing without overshooting max_tokens or the model length"""
+        if seq.guide is not None:
+            # Verifying drafts would need the guide state after every draft token
+            return 0
+        remaining = seq.sampling_params.max_tokens - len(seq.output_token_ids) - 1
+        if self.max_model_len is not None:
+            remaining = min(remaining, self.max_model_len - seq.num_tokens - 1)
+        return max(0, min(self.num_speculative_tokens, remaining))
+        
+    def _reserve(self, seq: Sequence, num_drafts: int) -> int:
+        """Reserve KV slots for as many drafts as free blocks allow"""
+        seq_len = self.kv_cache.seq_lens[seq.seq_id]
+        num_blocks = len(self.kv_cache.block_tables[seq.seq_id])
+        free_blocks = self.kv_cache.get_num_free_blocks()
+        while num_drafts > 0:
+            if self.kv_cache.get_num_required_blocks(seq_len + num_drafts) - num_blocks <= free_blocks:
+                break
+            num_drafts -= 1
+            
+        for _ in range(num_drafts):
+            self.kv_cache.append_slot(seq.seq_id)
+        return num_drafts
+        
+    def _rejection_sample(
+        self,
+        seqs: List[Sequence],
+        drafts: List[List[int]],
+        proposals: List[Proposal],
+        logits: List[torch.Tensor]
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Accept a prefix of each sequence's drafts and pick the token after it
+        
+        Returns:
+            (number of accepted drafts per sequence, next token per sequence)
+        """
+        device = logits[0].device
+        k_max = max(len(d) for d in drafts)
+        
+        # Target distributions at every scored position, with the token
+        # history each position would have seen in normal decoding
+        rows = [(seq, position) for seq, d in zip(seqs, drafts) for position in range(len(d) + 1)]
+        tensors = SamplingTensors.build(
+            [seq.sampling_params for seq, _ in rows],
+            [seq.generator for seq, _ in rows],
+            [len(seq.output_token_ids) + position for seq, position in rows],
+            [seq.token_ids + d[:position] for (seq, position), d in zip(rows, self._row_drafts(drafts))],
+            [[] for _ in rows],
+            device,
+            [seq.guide for seq, _ in rows]
+        )
+        probs = self.sampler.probs(torch.cat(logits), tensors)
+        
+        # Pad to [batch, k_max + 1, vocab]
+        vocab_size = probs.size(-1)
+        target = probs.new_zeros((len(seqs), k_max + 1, vocab_size))
+        draft_q = probs.new_zeros((len(seqs), k_max, vocab_size))
+        draft_ids = torch.zeros((len(seqs), k_max), dtype=torch.long, device=device)
+        num_drafts = torch.tensor([len(d) for d in drafts], dtype=torch.long, device=device)
+        
+        offset = 0
+        for row, (d, (_, q)) in enumerate(zip(drafts, proposals)):
+            n = len(d)
+            target[row, :n + 1] = probs[offset:offset + n + 1]
+            offset += n + 1
+            if n == 0:
+                continue
+            draft_ids[row, :n] = torch.tensor(d, dtype=torch.long, device=device)
+            if q is None:
+                draft_q[row, torch.arange(n, device=device), draft_ids[row, :n]] = 1.0
+            else:
+                q = q[:n].to(device=device, dtype=probs.dtype)
+                width = min(q.size(-1), vocab_size)
+                draft_q[row, :n, :width] = q[:, :width]
+                
+        # Accept draft i with probability min(1, p(d_i) / q(d_i))
+        p_draft = target[:, :k_max].gather(-1, draft_ids.unsqueeze(-1)).squeeze(-1)
+        q_draft = draft_q.gather(-1, draft_ids.unsqueeze(-1)).squeeze(-1)
+        uniform = torch.rand((len(seqs), k_max), device=device)
+        for row, seq in enumerate(seqs):
+            if seq.generator is not None and k_max > 0:
+                uniform[row] = torch.rand(k_max, device=device, generator=seq.generator)
+                
+        accept = uniform * q_draft < p_draft
+        accept &= torch.arange(k_max, device=device).unsqueeze(0) < num_drafts.unsqueeze(-1)
+        num_accepted = accept.int().cumprod(dim=-1).sum(dim=-1)
+        
+        # Next token: from max(0, p - q) at the first rejection, or from p after all drafts
+        index = num_accepted.view(-1, 1, 1).expand(-1, 1, vocab_size)
+        next_p = target.gather(1, index).squeeze(1)
+        padded_q = torch.cat([draft_q, draft_q.new_zeros((len(seqs), 1, vocab_size))], dim=1)
+        next_q = padded_q.gather(1, index).squeeze(1)
+        residual = (next_p - next_q).clamp(min=0)
+        residual_mass = residual.sum(dim=-1, keepdim=True)
+        next_dist = torch.where(residual_mass > 0, residual / residual_mass.clamp(min=1e-12), next_p)
+        
+        greedy = torch.tensor(
+            [seq.sampling_params.temperature == 0 for seq in seqs], dtype=torch.bool, device=device
+        )
+        next_tokens = torch.where(
+            greedy,
+            next_dist.argmax(dim=-1),
+            self.sampler.sample_from_probs(next_dist, [seq.generator for seq in seqs])
+        )
+        return num_accepted.tolist(), next_tokens.tolist()
+        
+    @staticmethod
+    def _row_drafts(drafts: List[List[int]]) -> List[List[int]]:
+        """Draft list of each flattened (sequence, position) row"""
+        return [d for d in drafts for _ in range(len(d) + 1)]
+        
+    def get_stats(self) -> Dict[str, float]:
+        """Get acceptance statistics"""
+        return {
+            'num_speculative_steps': self.num_steps,
+            'num_draft_tokens': self.num_draft_tokens,
+            'num_accepted_tokens': self.num_accepted_tokens,
+            'acceptance_rate': self.num_accepted_tokens / max(self.num_draft_tokens, 1),
+            'mean_accepted_tokens': self.num_accepted_tokens / max(self.num_seq_steps, 1),
+            'tokens_per_target_forward': self.num_emitted_tokens / max(self.num_seq_steps, 1)
+        }
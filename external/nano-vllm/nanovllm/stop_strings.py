@@ -0,0 +1,130 @@
+"""
+Stop-string matching for nano-vLLM
+Finds stop strings in detokenized output with an Aho-Corasick automaton while streaming
+"""
+
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Sequence as SequenceType, Tuple
+
+from .tokenization import IncrementalDetokenizer
+
+class StopStringAutomaton:
+    """
+    Aho-Corasick automaton over a set of stop strings
+    
+    Text is fed one character at a time, so every stop string is found in a
+    single pass however the text is split into deltas. The depth of the
+    current state is the length of the longest text suffix that is still a
+    prefix of some stop string: exactly the text that must be held back
+    before it can be streamed.
+    """
+    
+    def __init__(self, stop_strings: SequenceType[str]):
+        self.stop_strings = tuple(stop for stop in stop_strings if stop)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.depth: List[int] = [0]
+        # Length of the longest stop string ending at each state (0 = none)
+        self.match_len: List[int] = [0]
+        
+        for stop in self.stop_strings:
+            state = 0
+            for char in stop:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.depth.append(self.depth[state] + 1)
+                    self.match_len.append(0)
+                state = self.goto[state][char]
+            self.match_len[state] = max(self.match_len[state], len(stop))
+            
+        # Breadth-first so failure links of shallower states are ready first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0) if state else 0
+                self.match_len[child] = max(self.match_len[child], self.match_len[self.fail[child]])
+                queue.append(child)
+                
+    def next_state(self, state: int, char: str) -> int:
+        """State after reading one more character"""
+        while state and char not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(char, 0)
+
+@lru_cache(maxsize=256)
+def compile_stop_strings(stop_strings: Tuple[str, ...]) -> StopStringAutomaton:
+    """Shared automaton for a set of stop strings; requests usually repeat the same few"""
+    return StopStringAutomaton(stop_strings)
+
+class StopStringDetokenizer(IncrementalDetokenizer):
+    """
+    Incremental detokenizer that ends the text at the first stop string
+    
+    Deltas never contain a stop string or any text after it. Text that could
+    still grow into a stop string is held back until the next character
+    rules it out, or until flush() when the sequence ends for another reason.
+    
+    Attributes:
+        stopped: Whether a stop string has been found
+        output_text: All text released so far
+    """
+    
+    def __init__(
+        self,
+        tokenizer,
+        prompt_token_ids: SequenceType[int] = (),
+        stop_strings: SequenceType[str] = (),
+        skip_special_tokens: bool = True
+    ):
+        super().__init__(tokenizer, prompt_token_ids, skip_special_tokens)
+        self.automaton = compile_stop_strings(tuple(stop_strings))
+        self.state = 0
+        self.held = ""
+        self.stopped = False
+        self.output_text = ""
+        
+    def _match(self, text: str) -> str:
+        """Feed new text through the automaton and return the part safe to release"""
+        automaton = self.automaton
+        released = []
+        for char in text:
+            self.state = automaton.next_state(self.state, char)
+            self.held += char
+            stop_len = automaton.match_len[self.state]
+            if stop_len:
+                released.append(self.held[:len(self.held) - stop_len])
+                self.held = ""
+                self.stopped = True
+                break
+            keep = automaton.depth[self.state]
+            if len(self.held) > keep:
+                released.append(self.held[:len(self.held) - keep])
+                self.held = self.held[len(self.held) - keep:]
+                
+        delta = "".join(released)
+        self.output_text += delta
+        return delta
+        
+    def step(self, output_token_ids: SequenceType[int]) -> str:
+        """Text released by the tokens appended since the last call"""
+        if self.stopped:
+            return ""
+        return self._match(super().step(output_token_ids))
+        
+    def flush(self) -> str:
+        """Text still held back when the sequence finishes without a stop string"""
+        if self.stopped:
+            return ""
+        delta = self._match(super().flush())
+        if not self.stopped and self.held:
+            delta += self.held
+            self.output_text += self.held
+            self.held = ""
+        return delta
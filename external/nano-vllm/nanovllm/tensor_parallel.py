@@ -0,0 +1,287 @@
+"""
+Tensor-parallel execution for nano-vLLM
+Shards attention and MLP layers across ranks and replays forward passes in worker processes
+"""
+
+import os
+import socket
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from typing import Any, Dict, List, Optional, Tuple
+
+from .optimizations import TensorParallel
+from .cache_manager import KVCacheManager
+from .model_runner import ForwardInputs, execute_forward
+from .model_manager import ModelManager, ModelInfo
+from .quantization import QuantizedLinear
+from .loader import StartupTimer
+
+# Llama-style projection names: column-parallel inputs, row-parallel output
+ATTENTION_COLUMN = ("q_proj", "k_proj", "v_proj")
+ATTENTION_ROW = "o_proj"
+MLP_COLUMN = ("gate_proj", "up_proj")
+MLP_ROW = "down_proj"
+
+class RowParallelLinear(nn.Module):
+    """
+    Linear layer holding this rank's slice of the input features
+    
+    Each rank multiplies its slice of the activations; the partial outputs
+    are summed across ranks and the bias is added once afterwards.
+    """
+    
+    def __init__(self, linear: nn.Module, bias: Optional[torch.Tensor], tensor_parallel: TensorParallel):
+        super().__init__()
+        self.linear = linear
+        self.bias = nn.Parameter(bias, requires_grad=False) if bias is not None else None
+        self.tensor_parallel = tensor_parallel
+        
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.tensor_parallel.all_reduce_tensor(self.linear(x))
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+def _shard(tensor: torch.Tensor, dim: int, rank: int, world_size: int) -> torch.Tensor:
+    """This rank's contiguous slice along dim, copied so the full tensor can be freed"""
+    size = tensor.size(dim) // world_size
+    return tensor.narrow(dim, rank * size, size).clone()
+
+def _shard_linear(linear: nn.Module, dim: int, rank: int, world_size: int) -> Tuple[nn.Module, Optional[torch.Tensor]]:
+    """
+    Slice a Linear or QuantizedLinear layer along its output (dim 0) or input (dim 1) features
+    
+    Returns:
+        (sharded layer without bias, bias for the sharded layer's output)
+    """
+    bias = None
+    if linear.bias is not None:
+        bias = linear.bias.detach()
+        bias = _shard(bias, 0, rank, world_size) if dim == 0 else bias.clone()
+        
+    in_features, out_features = linear.in_features, linear.out_features
+    if dim == 0:
+        out_features //= world_size
+    else:
+        in_features //= world_size
+        
+    if isinstance(linear, QuantizedLinear):
+        group_size = linear.group_size if linear.bits == 4 else in_features
+        if dim == 1 and in_features % group_size:
+            raise ValueError(f"Input shard of {in_features} features is not a multiple of group size {group_size}")
+        layer = QuantizedLinear(
+            in_features, out_features, False, linear.bits, group_size,
+            linear.scales.dtype, torch.device('meta')
+        )
+        if dim == 0:
+            layer.qweight = _shard(linear.qweight, 0, rank, world_size)
+            layer.scales = _shard(linear.scales, 0, rank, world_size)
+        else:
+            # int4 packs two columns per byte; int8 scales are per output channel
+            layer.qweight = _shard(linear.qweight, 1, rank, world_size)
+            layer.scales = _shard(linear.scales, 1, rank, world_size) if linear.bits == 4 else linear.scales.clone()
+        return layer, bias
+        
+    weight = _shard(linear.weight.detach(), dim, rank, world_size)
+    layer = nn.Linear(in_features, out_features, bias=False, device='meta', dtype=weight.dtype)
+    layer.weight = nn.Parameter(weight, requires_grad=False)
+    return layer, bias
+
+def _shard_block(
+    module: nn.Module,
+    column_names: Tuple[str, ...],
+    row_name: str,
+    tensor_parallel: TensorParallel
+):
+    """Column-shard the input projections and row-shard the output projection of a block"""
+    rank, world_size = tensor_parallel.rank, tensor_parallel.world_size
+    for name in column_names:
+        layer, bias = _shard_linear(getattr(module, name), 0, rank, world_size)
+        if bias is not None:
+            layer.bias = nn.Parameter(bias, requires_grad=False)
+        setattr(module, name, layer)
+        
+    layer, bias = _shard_linear(getattr(module, row_name), 1, rank, world_size)
+    setattr(module, row_name, RowParallelLinear(layer, bias, tensor_parallel))
+
+def shard_model(model: nn.Module, tensor_parallel: TensorParallel) -> nn.Module:
+    """
+    Keep this rank's slice of every attention and MLP block, in place
+    
+    Attention is split by heads (q/k/v by output, o_proj by input) and the
+    MLP by intermediate features (gate/up by output, down_proj by input), so
+    each block needs one all-reduce. Embeddings, norms and lm_head stay
+    replicated.
+    
+    Raises:
+        ValueError: If head counts or MLP widths do not divide by the world
+            size, or the model has no Llama-style blocks
+    """
+    world_size = tensor_parallel.world_size
+    config = model.config
+    num_heads = config.num_attention_heads
+    num_kv_heads = getattr(config, 'num_key_value_heads', None) or num_heads
+    if num_heads % world_size or num_kv_heads % world_size:
+        raise ValueError(
+            f"tensor_parallel_size {world_size} must divide {num_heads} attention "
+            f"and {num_kv_heads} key/value heads"
+        )
+        
+    num_attention = num_mlp = 0
+    for module in list(model.modules()):
+        if all(hasattr(module, name) for name in ATTENTION_COLUMN + (ATTENTION_ROW,)):
+            _shard_block(module, ATTENTION_COLUMN, ATTENTION_ROW, tensor_parallel)
+            # Older attention implementations reshape with these
+            for name in ('num_heads', 'num_key_value_heads'):
+                if isinstance(getattr(module, name, None), int):
+                    setattr(module, name, getattr(module, name) // world_size)
+            if isinstance(getattr(module, 'hidden_size', None), int):
+                module.hidden_size //= world_size
+            num_attention += 1
+        elif all(hasattr(module, name) for name in MLP_COLUMN + (MLP_ROW,)):
+            if module.gate_proj.out_features % world_size:
+                raise ValueError(
+                    f"tensor_parallel_size {world_size} must divide MLP width {module.gate_proj.out_features}"
+                )
+            _shard_block(module, MLP_COLUMN, MLP_ROW, tensor_parallel)
+            num_mlp += 1
+            
+    if num_attention == 0 or num_mlp == 0:
+        raise ValueError(f"No Llama-style attention/MLP blocks to shard in {type(model).__name__}")
+    return model
+
+def load_sharded_model(
+    model_manager: ModelManager,
+    model_path: str,
+    tensor_parallel: TensorParallel,
+    dtype: Optional[torch.dtype] = None,
+    timer: Optional[StartupTimer] = None,
+    **kwargs
+) -> ModelInfo:
+    """
+    Load a model on CPU, keep this rank's shard and move it to the rank's device
+    
+    safetensors weights are memory-mapped, so only this rank's slices are
+    read in full.
+    """
+    model_info = model_manager.load_model(
+        model_path, load_weights=True, dtype=dtype, timer=timer, device=torch.device('cpu'), **kwargs
+    )
+    with model_info.startup_timer.phase('shard'):
+        model = shard_model(model_info.model, tensor_parallel)
+        model.to(tensor_parallel.device)
+        
+    model_info.device = tensor_parallel.device
+    model_info.memory_usage = sum(
+        t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers())
+    )
+    return model_info
+
+def _worker_main(
+    rank: int,
+    world_size: int,
+    backend: str,
+    init_method: str,
+    model_path: str,
+    model_kwargs: Dict[str, Any]
+):
+    """Worker rank: load a shard, then replay forward passes until told to stop"""
+    tensor_parallel = TensorParallel(world_size, rank=rank, backend=backend, init_method=init_method)
+    tensor_parallel.initialize()
+    if tensor_parallel.device.type == 'cpu':
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        
+    manager_kwargs = {name: model_kwargs.pop(name) for name in ('cache_dir', 'load_format', 'num_load_workers')}
+    model_info = load_sharded_model(ModelManager(**manager_kwargs), model_path, tensor_parallel, **model_kwargs)
+    model = model_info.model
+    kv_cache = None
+    
+    while True:
+        message = tensor_parallel.broadcast_object()
+        if message is None:
+            break
+            
+        kind = message[0]
+        if kind == 'kv_cache':
+            _, num_blocks, block_size = message
+            num_layers, num_kv_heads, head_dim = KVCacheManager.get_kv_shape(model.config, world_size)
+            kv_cache = KVCacheManager(
+                num_blocks, num_layers, num_kv_heads, head_dim,
+                block_size=block_size,
+                dtype=next(model.parameters()).dtype,
+                device=tensor_parallel.device
+            )
+        elif kind == 'forward':
+            _, block_copies, inputs = message
+            for src_block, dst_block in block_copies:
+                kv_cache.copy_block(src_block, dst_block)
+            execute_forward(model, kv_cache, inputs.to(tensor_parallel.device))
+            
+    tensor_parallel.destroy()
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class TensorParallelWorkers:
+    """
+    Worker processes running ranks 1..world_size-1 of a tensor-parallel model
+    
+    Features:
+    - Rank 0 is the calling process; it schedules, samples and broadcasts
+      every forward pass with its KV slots already resolved
+    - Workers load the same checkpoint, keep their own weight and KV cache
+      shards, and replay each pass; the all-reduces inside the model keep
+      all ranks in lockstep
+    - Processes are spawned, so scripts using tensor parallelism need an
+      `if __name__ == "__main__":` guard
+    """
+    
+    def __init__(self, world_size: int, model_path: str, model_kwargs: Dict[str, Any], backend: Optional[str] = None):
+        """
+        Args:
+            world_size: Total number of ranks, including this process
+            model_path: Model every rank loads
+            model_kwargs: dtype, quantization, quantization_group_size,
+                cache_dir, load_format and num_load_workers for the workers
+            backend: "nccl" or "gloo" (default: nccl with a GPU per rank)
+        """
+        init_method = f"tcp://127.0.0.1:{_free_port()}"
+        self.tensor_parallel = TensorParallel(world_size, rank=0, backend=backend, init_method=init_method)
+        
+        context = mp.get_context('spawn')
+        self.processes = []
+        for rank in range(1, world_size):
+            process = context.Process(
+                target=_worker_main,
+                args=(rank, world_size, self.tensor_parallel.backend, init_method, model_path, dict(model_kwargs)),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+            
+        self.tensor_parallel.initialize()
+        if self.tensor_parallel.device.type == 'cpu':
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+            
+    def init_kv_cache(self, num_blocks: int, block_size: int):
+        """Have every worker allocate a KV cache shard with the same block layout as rank 0"""
+        self.tensor_parallel.broadcast_object(('kv_cache', num_blocks, block_size))
+        
+    def execute(self, inputs: ForwardInputs, block_copies: List[Tuple[int, int]]):
+        """Start one forward pass on every worker; rank 0 runs it right after"""
+        self.tensor_parallel.broadcast_object(('forward', list(block_copies), inputs.to(torch.device('cpu'))))
+        
+    def shutdown(self):
+        """Stop the workers and leave the process group"""
+        if not self.processes:
+            return
+        self.tensor_parallel.broadcast_object(None)
+        for process in self.processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.tensor_parallel.destroy()
@@ -0,0 +1,346 @@
+"""
+Tokenization pipeline for nano-vLLM
+Tokenizes prompts on worker threads with prefix reuse and detokenizes outputs incrementally
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence as SequenceType, Tuple
+
+# Texts used to check that a tokenizer gives the same IDs when it resumes mid-text
+PROBE_TEXTS = [
+    "The quick brown fox jumps over the lazy dog. It was a bright cold day in April.",
+    "def add(a, b):\n    return a + b  # sum of two numbers\n\nprint(add(1, 2))",
+    "Zürich, 東京 and São Paulo: 1234567 visitors, 99.5% satisfied! Really?? Yes...",
+    "<p>Hello   world</p>\n\n  - item one\n  - item two\t(tab)  end"
+]
+
+class TokenizerPool:
+    """
+    Prompt tokenization on worker threads with a tokenization cache
+    
+    Features:
+    - Batches are split across worker threads; fast tokenizers encode in
+      Rust without holding the GIL, so tokenization overlaps with model
+      execution and scales with cores
+    - Exact repeats of a prompt are served from an LRU cache
+    - Prompts that share a long prefix with an earlier prompt only tokenize
+      the new text. Token IDs are remembered every chunk_chars characters,
+      keyed by a hash of the text up to that point, and tokenization resumes
+      from the last word boundary (a space after a non-space character)
+      inside the shared text.
+      
+    Prefix reuse is enabled only for fast tokenizers that reproduce the
+    full-text IDs when resumed at such a boundary on PROBE_TEXTS.
+    """
+    
+    def __init__(
+        self,
+        tokenizer,
+        num_workers: int = 4,
+        cache_size: int = 1024,
+        chunk_chars: int = 256,
+        max_prefix_entries: int = 4096
+    ):
+        """
+        Args:
+            tokenizer: HuggingFace tokenizer
+            num_workers: Tokenization threads
+            cache_size: Prompts kept in the exact-match cache (0 disables caching)
+            chunk_chars: Characters between remembered prefix tokenizations
+            max_prefix_entries: Remembered prefix tokenizations
+        """
+        self.tokenizer = tokenizer
+        self.num_workers = max(1, num_workers)
+        self.cache_size = cache_size
+        self.chunk_chars = chunk_chars
+        self.max_prefix_entries = max_prefix_entries
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="nanovllm-tokenizer")
+        self.lock = threading.Lock()
+        
+        # prompt -> token IDs; prefix digest -> (token IDs, number kept, resume offset)
+        self.prompt_cache: 'OrderedDict[str, Tuple[int, ...]]' = OrderedDict()
+        self.prefix_cache: 'OrderedDict[bytes, Tuple[Tuple[int, ...], int, int]]' = OrderedDict()
+        
+        self.backend = tokenizer.backend_tokenizer if getattr(tokenizer, 'is_fast', False) else None
+        if self.backend is not None and not self._check_backend():
+            self.backend = None
+        self.enable_prefix_reuse = cache_size > 0 and self.backend is not None and self._check_prefix_reuse()
+        probe_ids = tokenizer("a")['input_ids']
+        self.appends_special_token = bool(probe_ids) and probe_ids[-1] in set(tokenizer.all_special_ids)
+        
+        self.num_prompts = 0
+        self.num_cache_hits = 0
+        self.num_prefix_hits = 0
+        self.num_tokens_reused = 0
+        self.num_tokens_encoded = 0
+        
+    def _encode_texts(
+        self,
+        texts: SequenceType[str],
+        add_special_tokens: bool
+    ) -> List[Tuple[List[int], Optional[List[Tuple[int, int]]]]]:
+        """Token IDs and character offsets (None without a fast tokenizer) of each text"""
+        if not texts:
+            return []
+        if self.backend is not None:
+            encodings = self.backend.encode_batch(list(texts), add_special_tokens=add_special_tokens)
+            return [(encoding.ids, encoding.offsets) for encoding in encodings]
+        token_ids = self.tokenizer(list(texts), add_special_tokens=add_special_tokens)['input_ids']
+        return [(ids, None) for ids in token_ids]
+        
+    def _check_backend(self) -> bool:
+        """Whether the Rust tokenizer alone matches the HuggingFace wrapper"""
+        expected = self.tokenizer(PROBE_TEXTS)['input_ids']
+        encodings = self.backend.encode_batch(PROBE_TEXTS, add_special_tokens=True)
+        return all(list(encoding.ids) == list(ids) for encoding, ids in zip(encodings, expected))
+        
+    @staticmethod
+    def _boundaries(
+        text: str,
+        offsets: List[Tuple[int, int]],
+        base: int = 0
+    ) -> List[Tuple[int, int]]:
+        """
+        Positions where tokenization can resume: (tokens before, character offset)
+        
+        A boundary is a token end followed by a space and preceded by a
+        non-space character. offsets are relative to text[base:].
+        """
+        boundaries = []
+        for index, (start, end) in enumerate(offsets):
+            end += base
+            if end <= base or end >= len(text):
+                continue
+            if text[end] == ' ' and not text[end - 1].isspace():
+                if index + 1 == len(offsets) or offsets[index + 1][0] + base >= end:
+                    boundaries.append((index + 1, end))
+        return boundaries
+        
+    def _check_prefix_reuse(self) -> bool:
+        """Whether resuming at every boundary of PROBE_TEXTS reproduces the full IDs"""
+        for text, (ids, offsets) in zip(PROBE_TEXTS, self._encode_texts(PROBE_TEXTS, True)):
+            boundaries = self._boundaries(text, offsets)
+            tails = self._encode_texts([text[end:] for _, end in boundaries], False)
+            for (num_kept, _), (tail_ids, _) in zip(boundaries, tails):
+                if list(ids[:num_kept]) + list(tail_ids) != list(ids):
+                    return False
+        return True
+        
+    def _prefix_digests(self, text: str) -> List[bytes]:
+        """Hash of text up to every multiple of chunk_chars"""
+        digests = []
+        state = hashlib.sha1()
+        for start in range(0, len(text) - self.chunk_chars + 1, self.chunk_chars):
+            state.update(text[start:start + self.chunk_chars].encode('utf-8', 'surrogatepass'))
+            digests.append(state.digest())
+        return digests
+        
+    def _encode_chunk(self, texts: SequenceType[str]) -> List[Tuple[int, ...]]:
+        """Untruncated token IDs of texts, using and filling the caches"""
+        results: List[Optional[Tuple[int, ...]]] = [None] * len(texts)
+        digests = [self._prefix_digests(text) if self.enable_prefix_reuse else [] for text in texts]
+        misses = []
+        
+        with self.lock:
+            self.num_prompts += len(texts)
+            for index, text in enumerate(texts):
+                cached = self.prompt_cache.get(text)
+                if cached is not None:
+                    self.prompt_cache.move_to_end(text)
+                    self.num_cache_hits += 1
+                    results[index] = cached
+                    continue
+                    
+                # Longest remembered prefix
+                hit = None
+                for digest in reversed(digests[index]):
+                    hit = self.prefix_cache.get(digest)
+                    if hit is not None:
+                        self.prefix_cache.move_to_end(digest)
+                        break
+                misses.append((index, hit))
+                
+        full = [index for index, hit in misses if hit is None]
+        partial = [(index, hit) for index, hit in misses if hit is not None]
+        encoded = dict(zip(full, self._encode_texts([texts[index] for index in full], True)))
+        tails = self._encode_texts([texts[index][hit[2]:] for index, hit in partial], False)
+        encoded.update(zip([index for index, _ in partial], tails))
+        
+        new_prefixes = []
+        for index, hit in misses:
+            tail_ids, offsets = encoded[index]
+            prefix_ids, base = (), 0
+            if hit is not None:
+                prefix_ids, base = hit[0][:hit[1]], hit[2]
+            token_ids = tuple(prefix_ids) + tuple(tail_ids)
+            results[index] = token_ids
+            
+            if self.enable_prefix_reuse:
+                new_prefixes.extend(self._prefix_entries(
+                    texts[index], digests[index], token_ids, len(prefix_ids), offsets, base, hit
+                ))
+                
+        with self.lock:
+            self.num_prefix_hits += len(partial)
+            self.num_tokens_reused += sum(hit[1] for _, hit in partial)
+            self.num_tokens_encoded += sum(len(ids) for ids, _ in encoded.values())
+            if self.cache_size > 0:
+                for index, _ in misses:
+                    self.prompt_cache[texts[index]] = results[index]
+                while len(self.prompt_cache) > self.cache_size:
+                    self.prompt_cache.popitem(last=False)
+                for digest, entry in new_prefixes:
+                    self.prefix_cache[digest] = entry
+                while len(self.prefix_cache) > self.max_prefix_entries:
+                    self.prefix_cache.popitem(last=False)
+                    
+        return results
+        
+    def _prefix_entries(
+        self,
+        text: str,
+        digests: List[bytes],
+        token_ids: Tuple[int, ...],
+        num_prefix_tokens: int,
+        offsets: List[Tuple[int, int]],
+        base: int,
+        hit: Optional[Tuple[Tuple[int, ...], int, int]]
+    ) -> List[Tuple[bytes, Tuple[Tuple[int, ...], int, int]]]:
+        """Resume points of text at each chunk boundary, sharing one ID tuple"""
+        boundaries = [
+            (num_prefix_tokens + num_kept, end)
+            for num_kept, end in self._boundaries(text, offsets, base)
+        ]
+        entries = []
+        best = (hit[1], hit[2]) if hit is not None else None
+        position = 0
+        for chunk_index, digest in enumerate(digests):
+            cut = (chunk_index + 1) * self.chunk_chars
+            # The character after the boundary must lie inside the hashed text
+            while position < len(boundaries) and boundaries[position][1] < cut:
+                best = boundaries[position]
+                position += 1
+            if best is not None:
+                entries.append((digest, (token_ids, best[0], best[1])))
+        return entries
+        
+    def _truncate(self, token_ids: SequenceType[int], max_length: Optional[int]) -> List[int]:
+        """Keep at most max_length tokens, like the tokenizer's own truncation"""
+        if max_length is None or len(token_ids) <= max_length:
+            return list(token_ids)
+        max_length = max(max_length, 0)
+        if self.appends_special_token and max_length > 0:
+            return list(token_ids[:max_length - 1]) + [token_ids[-1]]
+        return list(token_ids[:max_length])
+        
+    def submit(self, prompts: SequenceType[str], max_length: Optional[int] = None) -> 'Future[List[List[int]]]':
+        """Tokenize prompts on one worker; the returned future holds their token IDs"""
+        prompts = list(prompts)
+        return self.executor.submit(
+            lambda: [self._truncate(ids, max_length) for ids in self._encode_chunk(prompts)]
+        )
+        
+    def encode_batch(self, prompts: SequenceType[str], max_length: Optional[int] = None) -> List[List[int]]:
+        """Tokenize prompts split across all workers"""
+        prompts = list(prompts)
+        chunk_size = max(1, -(-len(prompts) // self.num_workers))
+        futures = [
+            self.submit(prompts[start:start + chunk_size], max_length)
+            for start in range(0, len(prompts), chunk_size)
+        ]
+        return [ids for future in futures for ids in future.result()]
+        
+    def encode(self, prompt: str, max_length: Optional[int] = None) -> List[int]:
+        """Tokenize one prompt on the calling thread"""
+        return self._truncate(self._encode_chunk([prompt])[0], max_length)
+        
+    def decode_batch(self, token_ids: SequenceType[SequenceType[int]], skip_special_tokens: bool = True) -> List[str]:
+        """Detokenize complete outputs split across all workers"""
+        token_ids = [list(ids) for ids in token_ids]
+        chunk_size = max(1, -(-len(token_ids) // self.num_workers))
+        futures = [
+            self.executor.submit(
+                self.tokenizer.batch_decode, token_ids[start:start + chunk_size],
+                skip_special_tokens=skip_special_tokens
+            )
+            for start in range(0, len(token_ids), chunk_size)
+        ]
+        return [text for future in futures for text in future.result()]
+        
+    def get_stats(self) -> Dict[str, float]:
+        """Cache hit rates and token reuse"""
+        with self.lock:
+            return {
+                'num_prompts': self.num_prompts,
+                'cache_hit_rate': self.num_cache_hits / self.num_prompts if self.num_prompts else 0.0,
+                'prefix_hit_rate': self.num_prefix_hits / self.num_prompts if self.num_prompts else 0.0,
+                'num_tokens_reused': self.num_tokens_reused,
+                'num_tokens_encoded': self.num_tokens_encoded,
+                'prefix_reuse_enabled': self.enable_prefix_reuse
+            }
+            
+    def shutdown(self):
+        """Stop the worker threads"""
+        self.executor.shutdown(wait=True)
+
+class IncrementalDetokenizer:
+    """
+    Turns one sequence's growing output token IDs into text deltas
+    
+    Each step decodes only a short window of recent tokens. The window
+    starts a few tokens back, so merged tokens and leading spaces decode as
+    they do in the full text, and a delta is released only once it no longer
+    ends in an incomplete UTF-8 sequence (U+FFFD).
+    """
+    
+    # Prompt tokens decoded as context before the first output token
+    CONTEXT_TOKENS = 5
+    
+    def __init__(self, tokenizer, prompt_token_ids: SequenceType[int] = (), skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids = list(prompt_token_ids[-self.CONTEXT_TOKENS:]) if self.CONTEXT_TOKENS else []
+        # Text of token_ids[prefix_offset:read_offset] has already been emitted
+        self.prefix_offset = 0
+        self.read_offset = len(self.token_ids)
+        self.num_output_tokens = 0
+        self.text = ""
+        
+    def _decode(self, token_ids: List[int]) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens)
+        
+    def _advance(self, final: bool) -> str:
+        prefix_text = self._decode(self.token_ids[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.token_ids[self.prefix_offset:])
+        if len(new_text) <= len(prefix_text) or (new_text.endswith("\ufffd") and not final):
+            return ""
+            
+        delta = new_text[len(prefix_text):]
+        # Drop tokens that are no longer needed as context
+        del self.token_ids[:self.read_offset]
+        self.prefix_offset, self.read_offset = 0, len(self.token_ids)
+        self.text += delta
+        return delta
+        
+    def step(self, output_token_ids: SequenceType[int]) -> str:
+        """
+        Text completed by the tokens appended since the last call
+        
+        Args:
+            output_token_ids: All output tokens of the sequence so far
+        """
+        new_token_ids = output_token_ids[self.num_output_tokens:]
+        if not new_token_ids:
+            return ""
+        self.num_output_tokens = len(output_token_ids)
+        self.token_ids.extend(new_token_ids)
+        return self._advance(final=False)
+        
+    def flush(self) -> str:
+        """Text still held back when the sequence finishes (e.g. a truncated character)"""
+        if self.read_offset == len(self.token_ids):
+            return ""
+        return self._advance(final=True)
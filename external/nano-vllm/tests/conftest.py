@@ -0,0 +1,31 @@
+"""
+Shared fixtures: a tiny random-weight model that runs on CPU without downloads
+"""
+
+import pytest
+
+@pytest.fixture(scope="session")
+def tiny_model_path(tmp_path_factory):
+    """Path of a tiny Llama checkpoint and byte-level tokenizer"""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    pytest.importorskip("tokenizers")
+    from benchmarks.tiny_model import create_tiny_model
+    
+    return create_tiny_model(str(tmp_path_factory.mktemp("tiny-model")), seed=0)
+
+@pytest.fixture(scope="session")
+def tiny_model(tiny_model_path):
+    """The tiny model loaded in float32 on CPU"""
+    import torch
+    from transformers import AutoModelForCausalLM
+    
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_path, torch_dtype=torch.float32)
+    return model.eval()
+
+@pytest.fixture(scope="session")
+def tiny_tokenizer(tiny_model_path):
+    """The tiny model's byte-level tokenizer"""
+    from transformers import AutoTokenizer
+    
+    return AutoTokenizer.from_pretrained(tiny_model_path)
@@ -0,0 +1,55 @@
+"""
+Benchmark tests: workload synthesis and an online run on the tiny model
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm import LLM
+from benchmarks.runner import percentile, run_benchmark
+from benchmarks.workload import WorkloadConfig, load_workload, save_workload, synthesize_workload
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert percentile([0.0, 10.0], 90) == pytest.approx(9.0)
+
+def test_synthesize_workload(tmp_path):
+    config = WorkloadConfig(
+        num_requests=20, input_length_range=(8, 16), output_length_range=(2, 5),
+        request_rate=10.0, shared_prefix_ratio=0.5, num_shared_prefixes=1, seed=3
+    )
+    requests = synthesize_workload(config, vocab_size=50, special_token_ids=[0, 1])
+    
+    assert requests == synthesize_workload(config, vocab_size=50, special_token_ids=[0, 1])
+    assert all(8 <= request.prompt_len <= 16 for request in requests)
+    assert all(2 <= request.output_len <= 5 for request in requests)
+    assert all(token not in (0, 1) for request in requests for token in request.prompt_token_ids)
+    arrivals = [request.arrival_time for request in requests]
+    assert arrivals == sorted(arrivals) and arrivals[-1] > 0
+    
+    # Every prompt starts with the head of the one shared prefix
+    shared = [request.prompt_token_ids[:request.prompt_len // 2] for request in requests]
+    longest = max(shared, key=len)
+    assert all(longest[:len(prefix)] == prefix for prefix in shared)
+    
+    path = str(tmp_path / "workload.jsonl")
+    save_workload(requests, path)
+    assert load_workload(path) == requests
+
+def test_run_benchmark_counts_real_tokens(tiny_model_path):
+    llm = LLM(tiny_model_path, max_model_len=128, max_num_kv_tokens=1024)
+    config = WorkloadConfig(num_requests=6, input_length_range=(4, 24), output_length_range=(1, 6), seed=1)
+    requests = synthesize_workload(config, len(llm.tokenizer), llm.tokenizer.all_special_ids)
+    report = run_benchmark(llm, requests, slo_ttft=60.0, slo_tpot=60.0)
+    llm.close()
+    
+    assert report['num_requests'] == report['completed'] == 6
+    assert report['total_input_tokens'] == sum(request.prompt_len for request in requests)
+    assert report['total_output_tokens'] == sum(request.output_len for request in requests)
+    assert report['goodput']['requests_within_slo'] == 6
+    for metric in ('ttft', 'e2e_latency'):
+        assert 0 < report[metric]['p50_ms'] <= report[metric]['p99_ms']
+    assert report['output_throughput'] > 0
@@ -0,0 +1,137 @@
+"""
+Paged KV cache tests: block refcounts, copy-on-write and gather cost
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm.cache_manager import KVCacheManager
+from nanovllm.model_runner import ModelRunner
+from nanovllm.sampling_params import SamplingParams
+from nanovllm.sequence import Sequence
+
+def _make_cache(num_blocks: int) -> KVCacheManager:
+    return KVCacheManager(
+        num_blocks=num_blocks, num_layers=2, num_kv_heads=1, head_dim=4, block_size=4, dtype=torch.float32
+    )
+
+def _write_positions(kv_cache: KVCacheManager, seq_id: int, start: int, end: int):
+    """Fill positions [start, end) with keys equal to the position and negated values"""
+    slots = torch.tensor(kv_cache.get_slots(seq_id, start, end))
+    keys = torch.arange(start, end, dtype=torch.float32).view(1, -1, 1, 1).expand(2, -1, 1, 4)
+    kv_cache.write(slots, keys, -keys)
+
+def test_allocate_and_free_recycle_blocks():
+    kv_cache = _make_cache(8)
+    kv_cache.allocate(0, 10)
+    kv_cache.allocate(1, 4)
+    
+    assert len(kv_cache.block_tables[0]) == 3
+    assert len(kv_cache.block_tables[1]) == 1
+    assert kv_cache.get_num_free_blocks() == 4
+    assert not kv_cache.can_allocate(17)
+    with pytest.raises(RuntimeError):
+        kv_cache.allocate(2, 17)
+        
+    kv_cache.free(0)
+    kv_cache.free(1)
+    assert kv_cache.get_num_free_blocks() == 8
+    assert all(count == 0 for count in kv_cache.ref_counts)
+
+def test_fork_shares_blocks_until_write():
+    """A forked child shares every block; its first append copies only the partial last block"""
+    kv_cache = _make_cache(8)
+    kv_cache.allocate(0, 6)
+    _write_positions(kv_cache, 0, 0, 6)
+    
+    kv_cache.fork(0, 1)
+    shared = kv_cache.block_tables[0]
+    assert kv_cache.block_tables[1] == shared
+    assert [kv_cache.ref_counts[block] for block in shared] == [2, 2]
+    assert kv_cache.get_num_free_blocks() == 6
+    
+    assert kv_cache.get_num_append_blocks(1) == 1
+    kv_cache.append_slot(1)
+    
+    child = kv_cache.block_tables[1]
+    assert child[0] == shared[0] and child[1] != shared[1]
+    assert kv_cache.ref_counts[shared[0]] == 2
+    assert kv_cache.ref_counts[shared[1]] == 1
+    assert kv_cache.total_cow_copies == 1
+    
+    # The copy carries the parent's tokens, and writes to it leave the parent untouched
+    parent_keys, parent_values = kv_cache.gather([0], [6], 6)
+    child_keys, child_values = kv_cache.gather([1], [6], 6)
+    torch.testing.assert_close(child_keys, parent_keys)
+    torch.testing.assert_close(child_values, parent_values)
+    _write_positions(kv_cache, 1, 6, 7)
+    assert kv_cache.gather([0], [6], 6)[0].equal(parent_keys)
+    
+    # The parent now owns its last block alone, so appending needs no copy
+    kv_cache.append_slot(0)
+    assert kv_cache.total_cow_copies == 1
+    
+    kv_cache.free(0)
+    assert kv_cache.ref_counts[shared[0]] == 1
+    kv_cache.free(1)
+    assert kv_cache.get_num_free_blocks() == 8
+
+def test_prefix_blocks_are_shared():
+    kv_cache = _make_cache(8)
+    prefix = [kv_cache.allocate_block(), kv_cache.allocate_block()]
+    kv_cache.allocate(0, 10, prefix_blocks=prefix)
+    
+    assert kv_cache.block_tables[0][:2] == prefix
+    assert [kv_cache.ref_counts[block] for block in prefix] == [2, 2]
+    assert kv_cache.get_num_free_blocks() == 5
+    
+    kv_cache.free(0)
+    assert [kv_cache.ref_counts[block] for block in prefix] == [1, 1]
+    for block in prefix:
+        kv_cache.release_block(block)
+    assert kv_cache.get_num_free_blocks() == 8
+
+def test_gather_pads_with_zeros():
+    kv_cache = _make_cache(8)
+    kv_cache.allocate(0, 3)
+    kv_cache.allocate(1, 5)
+    _write_positions(kv_cache, 0, 0, 3)
+    _write_positions(kv_cache, 1, 0, 5)
+    
+    keys, values = kv_cache.gather([0, 1], [3, 5], 5)
+    
+    assert keys.shape == (2, 2, 1, 5, 4)
+    assert keys[:, 0, :, :2].abs().sum() == 0
+    assert keys[0, 0, 0, 2:, 0].tolist() == [0.0, 1.0, 2.0]
+    assert keys[0, 1, 0, :, 0].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    torch.testing.assert_close(values, -keys)
+
+def test_decode_gathers_whole_context(tiny_model):
+    """Each decode step copies every sequence's full KV history, so its cost grows with context"""
+    kv_cache = KVCacheManager.from_model(tiny_model, block_size=4, max_num_tokens=256)
+    runner = ModelRunner(tiny_model, kv_cache, pad_token_id=0)
+    prompts = [[5, 17, 42, 8, 99], [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]]
+    seqs = [
+        Sequence("", prompt, SamplingParams(max_tokens=8), seq_id=index)
+        for index, prompt in enumerate(prompts)
+    ]
+    for seq in seqs:
+        kv_cache.allocate(seq.seq_id, seq.num_tokens)
+        seq.num_prefill_tokens = seq.num_tokens
+    logits = runner.prefill(seqs)
+    assert kv_cache.total_gathered_slots == 0
+    
+    gathered_per_step = []
+    for _ in range(8):
+        for seq, token in zip(seqs, logits.argmax(dim=-1).tolist()):
+            seq.append_token(token)
+            kv_cache.append_slot(seq.seq_id)
+        before = kv_cache.total_gathered_slots
+        logits = runner.decode(seqs)
+        gathered_per_step.append(kv_cache.total_gathered_slots - before)
+        
+    # Both rows are padded to the longest history, which starts at 11 tokens
+    assert gathered_per_step == [2 * (11 + step) for step in range(8)]
+    assert kv_cache.get_cache_stats()['total_gathered_slots'] == sum(gathered_per_step)
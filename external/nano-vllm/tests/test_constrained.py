@@ -0,0 +1,57 @@
+"""
+Constrained decoding tests on the tiny model's byte-level vocabulary
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm import LLM, SamplingParams
+from nanovllm.constrained import DEAD_STATE, GuideCompiler
+
+PATTERN = "(café|naïve) ☕"
+
+def test_non_ascii_regex_with_byte_tokens(tiny_tokenizer):
+    """Every non-ASCII character is split over byte tokens, yet the pattern is still satisfiable"""
+    tokenizer = tiny_tokenizer
+    compiler = GuideCompiler(tokenizer, len(tokenizer), torch.device('cpu'))
+    guide = compiler.create_guide(SamplingParams(regex=PATTERN))
+    generator = torch.Generator().manual_seed(0)
+    
+    # After the first byte of 'é' only its second byte may follow
+    fsm = guide.fsm
+    state = fsm.start_state
+    for token_id in tokenizer.encode("caf", add_special_tokens=False):
+        state = fsm.next_state(state, token_id)
+    lead, continuation = tokenizer.encode("é", add_special_tokens=False)
+    state = fsm.next_state(state, lead)
+    assert state != DEAD_STATE and not fsm.is_accepting(state)
+    assert fsm.get_mask(state).nonzero().flatten().tolist() == [continuation]
+    
+    for _ in range(3):
+        guide.state = fsm.start_state
+        output = []
+        while True:
+            mask = guide.allowed_mask().clone()
+            mask[tokenizer.eos_token_id] = False
+            if not mask.any():
+                break
+            token_id = torch.multinomial(mask.float(), 1, generator=generator).item()
+            output.append(token_id)
+            guide.advance(token_id)
+            
+        assert guide.is_complete
+        assert guide.allowed_mask()[tokenizer.eos_token_id]
+        assert tokenizer.decode(output) in ("café ☕", "naïve ☕")
+
+def test_finish_reason_reports_dead_end(tiny_model_path):
+    llm = LLM(tiny_model_path, max_model_len=128, max_num_kv_tokens=512, enable_prefix_caching=False)
+    outputs = llm.generate(["Order:"], SamplingParams(temperature=0.0, max_tokens=16, regex=PATTERN))
+    # A lone surrogate has no UTF-8 encoding: its lead byte is allowed, then nothing can follow
+    dead_end = llm.generate(["Order:"], SamplingParams(temperature=0.0, max_tokens=16, regex="\ud800"))
+    llm.close()
+    
+    assert outputs[0]['finish_reason'] == 'stop'
+    assert outputs[0]['text'] in ("café ☕", "naïve ☕")
+    assert dead_end[0]['finish_reason'] == 'constraint'
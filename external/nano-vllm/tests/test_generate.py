@@ -0,0 +1,47 @@
+"""
+LLM.generate tests on the tiny model
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm import LLM, SamplingParams
+
+LLM_KWARGS = dict(
+    max_model_len=256,
+    max_num_seqs=8,
+    max_num_batched_tokens=256,
+    prefill_chunk_size=None,
+    max_num_kv_tokens=2048,
+    enable_prefix_caching=False
+)
+
+def _padded_prefill_tokens(llm: LLM) -> int:
+    return sum(step['prefill_padded_tokens'] for step in llm.engine.scheduler.step_stats)
+
+def test_planned_batches_reduce_prefill_padding(tiny_model_path):
+    """Short and long prompts are prefilled in separate steps instead of padding shorts to the longs"""
+    short = [f"q{i}?" for i in range(4)]
+    long = [f"{i} " + "a long prompt " * 4 for i in range(4)]
+    prompts = [prompt for pair in zip(short, long) for prompt in pair]
+    sampling_params = SamplingParams(temperature=0.0, max_tokens=4)
+    
+    llm = LLM(tiny_model_path, **LLM_KWARGS)
+    outputs = llm.generate(prompts, sampling_params)
+    planned = _padded_prefill_tokens(llm)
+    llm.close()
+    
+    # Same prompts admitted in arrival order, bypassing the plan
+    llm = LLM(tiny_model_path, **LLM_KWARGS)
+    for prompt in prompts:
+        llm.engine.add_request(prompt, sampling_params)
+    while llm.engine.has_unfinished_requests():
+        llm.engine.step()
+    arrival = _padded_prefill_tokens(llm)
+    llm.close()
+    
+    # 4 x 3 + 4 x 58 when grouped, against two steps of 4 x 58 when interleaved
+    assert planned < arrival
+    assert [output['prompt'] for output in outputs] == prompts
@@ -0,0 +1,61 @@
+"""
+Persistent prefix store tests: index survival and checksum validation
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm.cache_manager import KVCacheManager
+from nanovllm.kv_offload import PersistentPrefixStore, block_digest
+
+def _make_cache() -> KVCacheManager:
+    kv_cache = KVCacheManager(
+        num_blocks=4, num_layers=1, num_kv_heads=1, head_dim=4, block_size=4, dtype=torch.float32
+    )
+    kv_cache.kv_pool.normal_()
+    return kv_cache
+
+def _open(path, kv_cache: KVCacheManager, num_blocks: int = 2) -> PersistentPrefixStore:
+    return PersistentPrefixStore(str(path), num_blocks, tuple(kv_cache.kv_pool[:, :, 0].shape), kv_cache.dtype)
+
+def _crash(store: PersistentPrefixStore):
+    """Release the directory without flushing, as a killed process would"""
+    store._lock_file.close()
+
+def test_index_survives_crash(tmp_path):
+    kv_cache = _make_cache()
+    digests = [block_digest(b'', [i] * 4) for i in range(2)]
+    store = _open(tmp_path, kv_cache)
+    store.save(digests, kv_cache, [0, 1])
+    store.flush()
+    _crash(store)
+    
+    # Opening and crashing again must not lose the flushed index
+    _crash(_open(tmp_path, kv_cache))
+    store = _open(tmp_path, kv_cache)
+    assert store.num_loaded == 2
+    assert store.load(digests[1], kv_cache, 3)
+    torch.testing.assert_close(kv_cache.kv_pool[:, :, 3], kv_cache.kv_pool[:, :, 1])
+    store.close()
+
+def test_overwritten_block_fails_checksum(tmp_path):
+    kv_cache = _make_cache()
+    old = [block_digest(b'', [i] * 4) for i in range(2)]
+    store = _open(tmp_path, kv_cache)
+    store.save(old, kv_cache, [0, 1])
+    store.flush()
+    
+    # Evict the oldest entry and reuse its block after the flush, then die
+    store.save([block_digest(b'', [9] * 4)], kv_cache, [2])
+    _crash(store)
+    
+    store = _open(tmp_path, kv_cache)
+    assert store.num_loaded == 2
+    assert not store.load(old[0], kv_cache, 3)
+    assert old[0] not in store
+    assert store.get_stats()['corrupt_blocks'] == 1
+    assert store.load(old[1], kv_cache, 3)
+    torch.testing.assert_close(kv_cache.kv_pool[:, :, 3], kv_cache.kv_pool[:, :, 1])
+    store.close()
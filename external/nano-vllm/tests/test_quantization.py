@@ -0,0 +1,67 @@
+"""
+Weight-only quantization tests: round-trip error and model accuracy
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm.quantization import QuantizedLinear, compare_quantization, quantize_model
+
+# Relative output error bounds of one layer with N(0, 1) weights (about 0.7% and 12% expected),
+# and of the tiny model's logits after every layer is quantized
+MAX_RELATIVE_ERROR = {8: 0.02, 4: 0.2}
+MAX_LOGITS_ERROR = {8: 0.05, 4: 0.3}
+
+def _load(path):
+    from transformers import AutoModelForCausalLM
+    
+    return AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch.float32).eval()
+
+def _relative_error(actual: torch.Tensor, expected: torch.Tensor) -> float:
+    return ((actual - expected).norm() / expected.norm()).item()
+
+@pytest.mark.parametrize("bits", [8, 4])
+def test_linear_round_trip(bits):
+    torch.manual_seed(0)
+    linear = torch.nn.Linear(256, 64)
+    layer = QuantizedLinear.from_linear(linear, bits, group_size=128)
+    
+    # Round-to-nearest: every weight is within half a step of its group's scale
+    weight = linear.weight.detach().view(64, -1, layer.group_size)
+    dequantized = layer.dequantize().view(64, -1, layer.group_size)
+    half_step = layer.scales.unsqueeze(-1) / 2
+    assert ((dequantized - weight).abs() <= half_step * (1 + 1e-5) + 1e-7).all()
+    
+    # Quantizing the dequantized weight is lossless
+    reference = torch.nn.Linear(256, 64)
+    reference.weight.data.copy_(layer.dequantize())
+    assert QuantizedLinear.from_linear(reference, bits, group_size=128).qweight.equal(layer.qweight)
+    
+    x = torch.randn(8, 256)
+    with torch.no_grad():
+        expected = linear(x)
+        assert _relative_error(layer(x), expected) < MAX_RELATIVE_ERROR[bits]
+        torch.testing.assert_close(layer(x), torch.nn.functional.linear(x, layer.dequantize(), linear.bias))
+
+@pytest.mark.parametrize("mode,bits", [("int8", 8), ("int4", 4)])
+def test_model_logits_close(tiny_model_path, mode, bits):
+    model = _load(tiny_model_path)
+    input_ids = torch.tensor([[5, 17, 42, 8, 99, 3, 1, 4]])
+    with torch.no_grad():
+        reference = model(input_ids=input_ids).logits
+        quantize_model(model, mode, group_size=32)
+        quantized = model(input_ids=input_ids).logits
+        
+    assert any(isinstance(module, QuantizedLinear) for module in model.modules())
+    assert _relative_error(quantized, reference) < MAX_LOGITS_ERROR[bits]
+
+def test_compare_quantization_report(tiny_model_path, tiny_tokenizer):
+    report = compare_quantization(_load(tiny_model_path), tiny_tokenizer, "int8")
+    
+    assert report['num_quantized_layers'] > 0
+    assert report['linear_bytes_quantized'] < report['linear_bytes_original']
+    assert report['compression_ratio'] > 1.0
+    assert abs(report['perplexity_delta_pct']) < 5.0
+    assert report['num_eval_tokens'] > 0
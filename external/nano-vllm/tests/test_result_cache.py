@@ -0,0 +1,52 @@
+"""
+Result cache tests: hits, LRU eviction and what generate() stores
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm import LLM, ResultCache, SamplingParams
+
+def _entry(key: bytes):
+    # 100 bytes of text plus 21 bytes of token JSON
+    return (key, "a" * 100, [1] * 10, 'stop')
+
+def test_hit_and_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_gb=300 / 1024**3)
+    cache.put_many([_entry(b'a')])
+    cache.put_many([_entry(b'b')])
+    assert cache.get(b'a') == ("a" * 100, [1] * 10, 'stop')
+    assert cache.get(b'missing') is None
+    
+    # Only two entries fit; 'b' was used least recently since 'a' was read
+    cache.put_many([_entry(b'c')])
+    
+    assert cache.get(b'b') is None
+    assert cache.get(b'a') is not None and cache.get(b'c') is not None
+    stats = cache.get_stats()
+    assert stats['entries'] == 2 and stats['evicted'] == 1
+    assert stats['hits'] == 3 and stats['misses'] == 2
+    cache.close()
+
+def test_generate_stores_only_complete_results(tiny_model_path, tmp_path):
+    llm = LLM(
+        tiny_model_path, max_model_len=128, max_num_kv_tokens=512, enable_prefix_caching=False,
+        cache_dir=str(tmp_path), result_cache_disk_space=0.01
+    )
+    params = SamplingParams(temperature=0.0, max_tokens=8)
+    first = llm.generate(["Hello", "Hello", "World"], params)
+    second = llm.generate(["World", "Hello"], params)
+    
+    stats = llm.result_cache.get_stats()
+    assert stats['entries'] == 2 and stats['hits'] == 2
+    assert [output['text'] for output in second] == [first[2]['text'], first[0]['text']]
+    assert first[1]['text'] == first[0]['text']
+    
+    # A constraint that dead-ends finishes with 'constraint' and is not stored
+    dead_end = SamplingParams(temperature=0.0, max_tokens=8, regex="\ud800")
+    assert llm.generate(["Hello"], dead_end)[0]['finish_reason'] == 'constraint'
+    assert llm.generate(["Hello"], dead_end)[0]['finish_reason'] == 'constraint'
+    assert llm.result_cache.get_stats()['entries'] == 2
+    llm.close()
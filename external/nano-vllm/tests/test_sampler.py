@@ -0,0 +1,144 @@
+"""
+Sampler tests: reference parity, seeding and constrained decoding
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm.constrained import GuideCompiler, apply_guides
+from nanovllm.sampler import Sampler, SamplingTensors
+from nanovllm.sampling_params import SamplingParams
+
+class CharTokenizer:
+    """One token per character, with EOS as token 0"""
+    
+    vocab = ['</s>', 'y', 'e', 's', 'n', 'o', '!']
+    eos_token_id = 0
+    all_special_ids = [0]
+    
+    def __len__(self):
+        return len(self.vocab)
+        
+    def convert_ids_to_tokens(self, ids):
+        return [self.vocab[i] for i in ids]
+        
+    def convert_tokens_to_string(self, tokens):
+        return "".join(tokens)
+
+@pytest.mark.parametrize("temperature", [0.0, 1.0])
+def test_min_tokens_does_not_break_constraint(temperature):
+    """EOS stays allowed when the constraint admits nothing else, even below min_tokens"""
+    tokenizer = CharTokenizer()
+    vocab_size = len(tokenizer)
+    compiler = GuideCompiler(tokenizer, vocab_size, torch.device('cpu'))
+    sampling_params = SamplingParams(temperature=temperature, regex="(yes|no)", min_tokens=6, seed=0)
+    guide = compiler.create_guide(sampling_params)
+    generator = torch.Generator().manual_seed(0)
+    sampler = Sampler(tokenizer.eos_token_id)
+    
+    # The model strongly prefers tokens the constraint forbids
+    logits = torch.zeros(1, vocab_size)
+    logits[0, tokenizer.vocab.index('!')] = 10.0
+    logits[0, tokenizer.vocab.index('n')] = 1.0
+    
+    output = []
+    for _ in range(10):
+        tensors = SamplingTensors.build(
+            [sampling_params], [generator], [len(output)], [output], [[]],
+            torch.device('cpu'), [guide]
+        )
+        probs = sampler.probs(logits, tensors)
+        assert not torch.isnan(probs).any()
+        token_id = sampler(logits, tensors)[0].item()
+        if token_id == tokenizer.eos_token_id:
+            break
+        output.append(token_id)
+        guide.advance(token_id)
+        
+    assert "".join(tokenizer.vocab[i] for i in output) in ("yes", "no")
+    assert guide.is_complete
+
+def _build(sampling_params, generators=None):
+    batch_size = len(sampling_params)
+    return SamplingTensors.build(
+        sampling_params, generators or [None] * batch_size, [0] * batch_size,
+        [[1, 2]] * batch_size, [[]] * batch_size, torch.device('cpu')
+    )
+
+def _reference_probs(logits: torch.Tensor, params: SamplingParams) -> torch.Tensor:
+    """One row's sampling distribution, computed token by token"""
+    if params.temperature == 0:
+        return torch.nn.functional.one_hot(logits.argmax(), logits.numel()).float()
+    probs = torch.softmax(logits / params.temperature, dim=-1)
+    order = probs.argsort(descending=True).tolist()
+    if params.top_k > 0:
+        order = order[:params.top_k]
+    kept_mass = probs[order].sum().item()
+    keep, mass = [], 0.0
+    for token in order:
+        if mass > params.top_p:
+            break
+        keep.append(token)
+        mass += probs[token].item() / kept_mass
+    reference = torch.zeros_like(probs)
+    reference[keep] = probs[keep]
+    return reference / reference.sum()
+
+def test_probs_match_reference():
+    torch.manual_seed(0)
+    sampling_params = [
+        SamplingParams(temperature=0.0),
+        SamplingParams(temperature=1.0),
+        SamplingParams(temperature=0.7, top_k=5),
+        SamplingParams(temperature=1.3, top_p=0.6),
+        SamplingParams(temperature=0.9, top_k=8, top_p=0.8),
+    ]
+    logits = torch.randn(len(sampling_params), 32)
+    
+    probs = Sampler(None).probs(logits, _build(sampling_params))
+    
+    for row, params in enumerate(sampling_params):
+        torch.testing.assert_close(probs[row], _reference_probs(logits[row], params))
+        
+def test_samples_follow_distribution():
+    """Batched exponential-race draws match the categorical distribution"""
+    torch.manual_seed(0)
+    params = SamplingParams(temperature=0.8, top_k=6)
+    logits = torch.randn(1, 16).expand(20000, -1)
+    sampler = Sampler(None)
+    tensors = _build([params] * logits.size(0))
+    
+    token_ids, _ = sampler(logits, tensors)
+    
+    frequencies = torch.bincount(token_ids, minlength=16).float() / token_ids.numel()
+    torch.testing.assert_close(frequencies, _reference_probs(logits[0], params), rtol=0, atol=0.02)
+    
+def test_seeded_rows_ignore_batch_neighbours():
+    """A seeded row draws the same tokens alone or next to unseeded and other seeded rows"""
+    torch.manual_seed(0)
+    logits = torch.randn(4, 64)
+    seeded = SamplingParams(temperature=1.0, seed=1234)
+    sampler = Sampler(None)
+    
+    def draw(batch_logits, params, seeds):
+        generators = [None if seed is None else torch.Generator().manual_seed(seed) for seed in seeds]
+        tensors = _build(params, generators)
+        return [sampler(batch_logits, tensors)[0].tolist() for _ in range(10)]
+        
+    alone = [tokens[0] for tokens in draw(logits[:1], [seeded], [1234])]
+    mixed_params = [SamplingParams(temperature=1.0), seeded, SamplingParams(temperature=0.0), SamplingParams(seed=7)]
+    mixed = [tokens[1] for tokens in draw(logits[[1, 0, 2, 3]], mixed_params, [None, 1234, None, 7])]
+    assert mixed == alone
+    
+def test_apply_guides_masks_only_constrained_rows():
+    tokenizer = CharTokenizer()
+    compiler = GuideCompiler(tokenizer, len(tokenizer), torch.device('cpu'))
+    guides = [None, compiler.create_guide(SamplingParams(regex="yes")), None]
+    logits = torch.zeros(3, len(tokenizer))
+    
+    masked = apply_guides(logits, guides)
+    
+    assert torch.isfinite(masked[[0, 2]]).all()
+    assert torch.isfinite(masked[1]).tolist() == [token == 'y' for token in tokenizer.vocab]
@@ -0,0 +1,96 @@
+"""
+Scheduler preemption tests
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from nanovllm.cache_manager import KVCacheManager
+from nanovllm.kv_offload import KVSwapper
+from nanovllm.sampling_params import SamplingParams
+from nanovllm.scheduler import Scheduler
+from nanovllm.sequence import Sequence
+
+def _make_cache(num_blocks: int) -> KVCacheManager:
+    return KVCacheManager(
+        num_blocks=num_blocks, num_layers=1, num_kv_heads=1, head_dim=4, block_size=4, dtype=torch.float32
+    )
+    
+def _execute(output):
+    """Stand in for the model: every scheduled sequence samples token 0 up to max_tokens"""
+    for seq, chunk in zip(output.prefill_seqs, output.prefill_chunks):
+        seq.num_computed_tokens += chunk
+        if not seq.is_prefilling:
+            seq.append_token(0)
+    for seq in output.decode_seqs:
+        seq.num_computed_tokens += 1
+        seq.append_token(0)
+    for seq in output.prefill_seqs + output.decode_seqs:
+        if not seq.is_finished and len(seq.output_token_ids) >= seq.sampling_params.max_tokens:
+            seq.finish('length')
+            
+def _run(scheduler: Scheduler, seqs, max_steps: int = 500) -> int:
+    """Drive the scheduler as the engine would until every sequence finishes"""
+    for seq in seqs:
+        scheduler.add_sequence(seq)
+        
+    for step in range(max_steps):
+        if not scheduler.has_unfinished():
+            return step
+        _execute(scheduler.schedule())
+        scheduler.update()
+    return max_steps
+    
+def test_batch_refills_as_sequences_finish():
+    """Waiting sequences join the running batch in the step after a slot frees up"""
+    scheduler = Scheduler(_make_cache(64), max_num_seqs=4)
+    seqs = [Sequence("", [1, 2, 3], SamplingParams(max_tokens=8)) for _ in range(6)]
+    for seq in seqs:
+        scheduler.add_sequence(seq)
+        
+    output = scheduler.schedule()
+    assert output.prefill_seqs == seqs[:4] and not output.decode_seqs
+    _execute(output)
+    seqs[0].finish('stop')
+    scheduler.update()
+    
+    output = scheduler.schedule()
+    assert output.decode_seqs == seqs[1:4]
+    assert output.prefill_seqs == [seqs[4]]
+    assert len(scheduler.waiting) == 1
+    
+def test_recompute_preemption_resumes():
+    """Sequences preempted for KV space are requeued, recomputed and still finish in full"""
+    kv_cache = _make_cache(6)
+    scheduler = Scheduler(kv_cache, max_num_seqs=4)
+    seqs = [Sequence("", list(range(8)), SamplingParams(max_tokens=12)) for _ in range(2)]
+    
+    steps = _run(scheduler, seqs)
+    
+    assert not scheduler.has_unfinished(), f"still unfinished after {steps} steps"
+    assert scheduler.num_preemptions > 0
+    assert seqs[1].num_preemptions > 0
+    assert all(len(seq.output_token_ids) == 12 for seq in seqs)
+    assert len(kv_cache.free_blocks) == kv_cache.num_blocks
+    
+@pytest.mark.parametrize("swap", [True, False])
+def test_sequence_outgrowing_pool_finishes(swap):
+    """A preempted sequence too long to ever resume is finished instead of waiting forever"""
+    kv_cache = _make_cache(8)
+    kv_swapper = KVSwapper(kv_cache, num_host_blocks=16) if swap else None
+    scheduler = Scheduler(kv_cache, max_num_seqs=4, kv_swapper=kv_swapper)
+    
+    # The short sequence is admitted first, so the long one is the preemption victim
+    short = Sequence("", list(range(4)), SamplingParams(max_tokens=4))
+    long = Sequence("", list(range(24)), SamplingParams(max_tokens=100))
+    
+    steps = _run(scheduler, [short, long])
+    
+    assert not scheduler.has_unfinished(), f"still unfinished after {steps} steps"
+    assert short.finish_reason == 'length' and len(short.output_token_ids) == 4
+    assert long.finish_reason == 'length'
+    assert long.num_tokens <= kv_cache.num_blocks * kv_cache.block_size + 1
+    if kv_swapper is not None:
+        assert not kv_swapper.swapped
@@ -0,0 +1,53 @@
+"""
+Tensor parallelism test: two gloo ranks on CPU against a single process
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+if not torch.distributed.is_available() or not torch.distributed.is_gloo_available():
+    pytest.skip("gloo backend is not available", allow_module_level=True)
+
+from nanovllm import LLM, SamplingParams, Sequence
+
+PROMPTS = [[5, 17, 42, 8, 99], [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]]
+
+def _logits(llm: LLM, num_steps: int = 6):
+    """Prefill logits, then the logits of greedy decode steps, straight from the model runner"""
+    seqs = [
+        Sequence("", prompt, SamplingParams(max_tokens=num_steps), seq_id=10_000 + index)
+        for index, prompt in enumerate(PROMPTS)
+    ]
+    for seq in seqs:
+        llm.kv_cache.allocate(seq.seq_id, seq.num_tokens)
+        seq.num_prefill_tokens = seq.num_tokens
+    logits = [llm.model_runner.prefill(seqs)]
+    
+    for _ in range(num_steps):
+        for seq, token in zip(seqs, logits[-1].argmax(dim=-1).tolist()):
+            seq.append_token(token)
+            llm.kv_cache.append_slot(seq.seq_id)
+        logits.append(llm.model_runner.decode(seqs))
+        
+    for seq in seqs:
+        llm.kv_cache.free(seq.seq_id)
+    return logits
+
+def test_two_ranks_match_single_process(tiny_model_path):
+    kwargs = dict(max_model_len=128, max_num_kv_tokens=512, enable_prefix_caching=False, dtype=torch.float32)
+    
+    llm = LLM(tiny_model_path, **kwargs)
+    reference = _logits(llm)
+    llm.close()
+    
+    llm = LLM(tiny_model_path, tensor_parallel_size=2, **kwargs)
+    assert llm.model_runner.workers is not None
+    parallel = _logits(llm)
+    llm.close()
+    
+    # Both runs decode their own argmax tokens, so matching logits also means matching tokens
+    for expected, actual in zip(reference, parallel):
+        torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
+        assert actual.argmax(dim=-1).equal(expected.argmax(dim=-1))
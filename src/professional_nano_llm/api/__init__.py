@@ -1,5 +1,16 @@
 """
 API components
+
+- AsyncLLMEngine: Shared continuous-batching loop for concurrent requests
+- create_app: OpenAI-compatible FastAPI server with SSE streaming
 """
 
-# API components will be implemented during development
+from .async_engine import AsyncLLMEngine, QueueFullError, RequestOutput
+from .server import create_app
+
+__all__ = [
+    "AsyncLLMEngine",
+    "QueueFullError",
+    "RequestOutput",
+    "create_app"
+]
@@ -0,0 +1,269 @@
+"""
+Async front end for the nano-vLLM engine
+Feeds concurrent HTTP requests into one shared continuous-batching loop
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import count
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from nanovllm import LLM, SamplingParams, Sequence
+from nanovllm.constrained import TokenGuide
+
+class QueueFullError(Exception):
+    """Raised when the engine already holds max_queue_depth requests"""
+
+@dataclass(frozen=True)
+class RequestOutput:
+    """Snapshot of a request taken between two engine steps"""
+    request_id: int
+    prompt_token_ids: Tuple[int, ...]
+    output_token_ids: Tuple[int, ...]
+    finished: bool
+    finish_reason: Optional[str]
+    # Text before the first stop string, set only for requests with stop strings
+    output_text: Optional[str] = None
+    
+    @classmethod
+    def from_sequence(cls, request_id: int, seq: Sequence) -> 'RequestOutput':
+        """Copy the current state of a sequence"""
+        return cls(
+            request_id=request_id,
+            prompt_token_ids=tuple(seq.prompt_token_ids),
+            output_token_ids=tuple(seq.output_token_ids),
+            finished=seq.is_finished,
+            finish_reason=seq.finish_reason,
+            output_text=None if seq.detokenizer is None else seq.detokenizer.output_text
+        )
+
+class _RequestStream:
+    """
+    Latest output of one request, read by its HTTP handler
+    
+    Only the newest snapshot is kept: a slow reader receives several tokens
+    at once instead of an unbounded backlog of single-token updates.
+    """
+    
+    def __init__(self, request_id: int):
+        self.request_id = request_id
+        self.seq: Optional[Sequence] = None
+        self.num_published = -1
+        self.latest: Optional[RequestOutput] = None
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+        self._ready = asyncio.Event()
+        
+    def publish(self, output: RequestOutput):
+        self.latest = output
+        self._ready.set()
+        
+    def fail(self, error: BaseException):
+        self.error = error
+        self._ready.set()
+        
+    async def next(self) -> RequestOutput:
+        """Wait for an output newer than the last one read"""
+        await self._ready.wait()
+        self._ready.clear()
+        if self.error is not None:
+            raise self.error
+        return self.latest
+
+class AsyncLLMEngine:
+    """
+    Shares one LLMEngine between many asyncio callers
+    
+    Features:
+    - A single background task steps the engine; each step runs in a worker
+      thread so the event loop keeps serving requests
+    - Requests are added and aborted only between steps
+    - Prompts are tokenized on the LLM's tokenizer pool, and regex/JSON
+      constraints compiled on a worker thread, off both the event loop and
+      the engine thread
+    - Bounded queue depth: callers wait up to queue_timeout for a slot and
+      are rejected with QueueFullError after that
+    - A caller that stops iterating (e.g. client disconnect) aborts its
+      request and frees its KV blocks at the next step boundary
+    """
+    
+    def __init__(self, llm: LLM, max_queue_depth: int = 256, queue_timeout: float = 5.0):
+        self.llm = llm
+        self.engine = llm.engine
+        self.tokenizer = llm.tokenizer
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        
+        self._request_ids = count()
+        self._streams: Dict[int, _RequestStream] = {}
+        self._pending: Deque[Tuple[_RequestStream, str, SamplingParams, Optional[List[int]], Optional[TokenGuide]]] = deque()
+        self._aborted: Set[int] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nanovllm-engine")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._work: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        
+        self.num_rejected = 0
+        self.num_aborted = 0
+        
+    @property
+    def is_running(self) -> bool:
+        return self._loop_task is not None and not self._loop_task.done()
+        
+    @property
+    def num_requests(self) -> int:
+        """Requests that are queued, waiting or running"""
+        return len(self._pending) + len(self._streams)
+        
+    async def start(self):
+        """Start the engine loop on the running event loop"""
+        if self.is_running:
+            return
+            
+        self._slots = asyncio.Semaphore(self.max_queue_depth)
+        self._work = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run_loop())
+        
+    async def shutdown(self):
+        """Stop the engine loop and fail outstanding requests"""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+            
+        for stream in list(self._streams.values()) + [item[0] for item in self._pending]:
+            stream.fail(RuntimeError("Engine shut down"))
+        self._executor.shutdown(wait=True)
+        
+    async def generate(
+        self,
+        prompt: str,
+        sampling_params: SamplingParams,
+        prompt_token_ids: Optional[List[int]] = None
+    ) -> AsyncIterator[RequestOutput]:
+        """
+        Submit a request and iterate over its outputs
+        
+        Each yielded RequestOutput holds all tokens generated so far; the last
+        one has finished=True. Closing the iterator early aborts the request.
+        
+        Raises:
+            QueueFullError: No slot became free within queue_timeout
+            ValueError: The regex or JSON schema is unsupported
+        """
+        if not self.is_running:
+            raise RuntimeError("AsyncLLMEngine.start() has not been called")
+            
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.num_rejected += 1
+            raise QueueFullError(f"Request queue is full ({self.max_queue_depth} requests)")
+            
+        guide = None
+        try:
+            if prompt_token_ids is None:
+                max_length = self.llm.max_model_len - sampling_params.max_tokens
+                prompt_token_ids = (await asyncio.wrap_future(
+                    self.llm.tokenizer_pool.submit([prompt], max_length)
+                ))[0]
+            if sampling_params.regex is not None or sampling_params.json_schema is not None:
+                # Compiling a new pattern can take seconds; repeats hit the compiler's LRU
+                loop = asyncio.get_running_loop()
+                guide = await loop.run_in_executor(None, self.engine.create_guide, sampling_params)
+        except BaseException:
+            self._slots.release()
+            raise
+            
+        stream = _RequestStream(next(self._request_ids))
+        self._pending.append((stream, prompt, sampling_params, prompt_token_ids, guide))
+        self._work.set()
+        
+        finished = False
+        try:
+            while not finished:
+                output = await stream.next()
+                finished = output.finished
+                yield output
+        finally:
+            # A failed request is already out of the engine; only client aborts count
+            if not finished and stream.error is None:
+                self._abort(stream)
+            self._slots.release()
+            
+    def _abort(self, stream: _RequestStream):
+        """Cancel a request at the next step boundary"""
+        stream.cancelled = True
+        if stream.seq is not None:
+            self._aborted.add(stream.seq.seq_id)
+        self.num_aborted += 1
+        self._work.set()
+        
+    def _apply_pending(self):
+        """Add new requests and drop aborted ones; runs while no step is in flight"""
+        for seq_id in self._aborted:
+            self.engine.abort_request(seq_id)
+            self._streams.pop(seq_id, None)
+        self._aborted.clear()
+        
+        while self._pending:
+            stream, prompt, sampling_params, prompt_token_ids, guide = self._pending.popleft()
+            if stream.cancelled:
+                continue
+            try:
+                stream.seq = self.engine.add_request(prompt, sampling_params, prompt_token_ids, guide=guide)
+            except Exception as e:
+                stream.fail(e)
+                continue
+            self._streams[stream.seq.seq_id] = stream
+            
+    def _publish(self):
+        """Hand every request with new tokens or a new state its latest output"""
+        for seq_id, stream in list(self._streams.items()):
+            seq = stream.seq
+            if seq.is_finished or len(seq.output_token_ids) != stream.num_published:
+                stream.num_published = len(seq.output_token_ids)
+                stream.publish(RequestOutput.from_sequence(stream.request_id, seq))
+            if seq.is_finished:
+                del self._streams[seq_id]
+                
+    async def _run_loop(self):
+        """Step the engine while there is work, sleep otherwise"""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            self._apply_pending()
+            if not self.engine.has_unfinished_requests():
+                self._publish()
+                self._work.clear()
+                if not self._pending and not self._aborted:
+                    await self._work.wait()
+                continue
+                
+            try:
+                await loop.run_in_executor(self._executor, self.engine.step)
+            except Exception as e:
+                # A failed step leaves batch state unknown: fail everything in it
+                for seq_id, stream in list(self._streams.items()):
+                    self.engine.abort_request(seq_id)
+                    stream.fail(e)
+                self._streams.clear()
+                continue
+                
+            self._publish()
+            
+    def get_stats(self) -> Dict[str, float]:
+        """Get queue and engine statistics"""
+        stats = dict(self.engine.get_stats())
+        stats.update({
+            'num_requests': self.num_requests,
+            'max_queue_depth': self.max_queue_depth,
+            'num_rejected': self.num_rejected,
+            'num_aborted': self.num_aborted
+        })
+        return stats
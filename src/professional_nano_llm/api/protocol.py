@@ -0,0 +1,69 @@
+"""
+OpenAI-compatible request schemas
+Validates /v1/completions and /v1/chat/completions bodies and maps them to SamplingParams
+"""
+
+from typing import Any, Dict, List, Optional, Union
+from pydantic import BaseModel, Field
+
+from nanovllm import SamplingParams
+
+class _SamplingRequest(BaseModel):
+    """Sampling fields shared by both endpoints"""
+    model: Optional[str] = None
+    max_tokens: int = Field(default=256, gt=0)
+    temperature: float = Field(default=1.0, ge=0.0)
+    top_p: float = Field(default=1.0, ge=0.0, le=1.0)
+    top_k: int = Field(default=0, ge=0)
+    min_tokens: int = Field(default=0, ge=0)
+    repetition_penalty: float = Field(default=1.0, ge=0.0)
+    stop: Optional[Union[str, List[str]]] = None
+    seed: Optional[int] = None
+    stream: bool = False
+    user: Optional[str] = None
+    # Constrained decoding: OpenAI response_format of type "json_schema", or regex / schema directly
+    response_format: Optional[Dict[str, Any]] = None
+    guided_regex: Optional[str] = None
+    guided_json: Optional[Dict[str, Any]] = None
+    
+    def _json_schema(self) -> Optional[Dict[str, Any]]:
+        if self.response_format is None or self.response_format.get('type', 'text') == 'text':
+            return self.guided_json
+        if self.response_format.get('type') != 'json_schema':
+            raise ValueError(f"Unsupported response_format type {self.response_format.get('type')!r}")
+        return self.response_format.get('json_schema', {}).get('schema')
+        
+    def to_sampling_params(self) -> SamplingParams:
+        """
+        Convert to nano-vLLM SamplingParams
+        
+        Raises:
+            ValueError: If the response_format type is not supported
+        """
+        stop = [self.stop] if isinstance(self.stop, str) else list(self.stop or [])
+        return SamplingParams(
+            temperature=self.temperature,
+            top_k=self.top_k,
+            top_p=self.top_p,
+            max_tokens=self.max_tokens,
+            min_tokens=self.min_tokens,
+            repetition_penalty=self.repetition_penalty,
+            stop_sequences=stop,
+            seed=self.seed,
+            regex=self.guided_regex,
+            json_schema=self._json_schema()
+        )
+
+class CompletionRequest(_SamplingRequest):
+    """Body of POST /v1/completions"""
+    prompt: Union[str, List[str]]
+    echo: bool = False
+
+class ChatMessage(BaseModel):
+    """A single chat turn"""
+    role: str
+    content: str
+
+class ChatCompletionRequest(_SamplingRequest):
+    """Body of POST /v1/chat/completions"""
+    messages: List[ChatMessage] = Field(min_length=1)
@@ -0,0 +1,334 @@
+"""
+OpenAI-compatible HTTP server
+Serves /v1/completions and /v1/chat/completions with optional SSE token streaming
+"""
+
+import argparse
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from nanovllm import LLM
+from nanovllm.tokenization import IncrementalDetokenizer
+from .async_engine import AsyncLLMEngine, QueueFullError, RequestOutput
+from .protocol import ChatCompletionRequest, ChatMessage, CompletionRequest
+
+def _error(status_code: int, message: str, error_type: str) -> JSONResponse:
+    """OpenAI-style error body"""
+    return JSONResponse(
+        status_code=status_code,
+        content={'error': {'message': message, 'type': error_type, 'code': status_code}}
+    )
+
+def _sse(payload: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class _TextDecoder:
+    """Turns growing token ID snapshots into text deltas"""
+    
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.detokenizer: Optional[IncrementalDetokenizer] = None
+        self.num_streamed = 0
+        
+    def delta(self, output: RequestOutput) -> str:
+        """New text since the last call; incomplete UTF-8 is held back until finished"""
+        if output.output_text is not None:
+            # The engine matched stop strings while detokenizing; reuse its text
+            delta = output.output_text[self.num_streamed:]
+            self.num_streamed = len(output.output_text)
+            return delta
+        if self.detokenizer is None:
+            self.detokenizer = IncrementalDetokenizer(self.tokenizer, output.prompt_token_ids)
+        delta = self.detokenizer.step(output.output_token_ids)
+        if output.finished:
+            delta += self.detokenizer.flush()
+        return delta
+
+def _usage(output: RequestOutput) -> Dict[str, int]:
+    prompt_tokens = len(output.prompt_token_ids)
+    completion_tokens = len(output.output_token_ids)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens
+    }
+
+def _finish_reason(output: RequestOutput) -> Optional[str]:
+    # 'constraint': the regex or schema reached a dead end and the output is not a full match
+    return output.finish_reason if output.finish_reason in ('stop', 'length', 'constraint') else None
+
+def create_app(engine: AsyncLLMEngine, model_name: str) -> FastAPI:
+    """
+    Build the FastAPI application around a shared AsyncLLMEngine
+    
+    Args:
+        engine: Engine shared by all requests; started and stopped with the app
+        model_name: Name reported by /v1/models and in responses
+    """
+    
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await engine.start()
+        yield
+        await engine.shutdown()
+        
+    app = FastAPI(title="Professional Nano-LLM API", lifespan=lifespan)
+    tokenizer = engine.tokenizer
+    
+    def check_request(request_body) -> Optional[JSONResponse]:
+        if request_body.model is not None and request_body.model != model_name:
+            return _error(404, f"Model '{request_body.model}' not found", 'invalid_request_error')
+        if request_body.max_tokens >= engine.llm.max_model_len:
+            return _error(
+                400, f"max_tokens must be below the model length ({engine.llm.max_model_len})",
+                'invalid_request_error'
+            )
+        return None
+        
+    async def run(
+        request: Request,
+        prompt: str,
+        request_body
+    ) -> AsyncIterator[RequestOutput]:
+        """Engine outputs for one request; aborts it if the client goes away"""
+        outputs = engine.generate(prompt, request_body.to_sampling_params())
+        try:
+            async for output in outputs:
+                # StreamingResponse cancels the stream itself when the client disconnects
+                if not request_body.stream and await request.is_disconnected():
+                    break
+                yield output
+        finally:
+            await outputs.aclose()
+            
+    async def respond(request: Request, request_body, prompt: str, build_response, build_chunks):
+        """Shared streaming / non-streaming response handling"""
+        outputs = run(request, prompt, request_body)
+        
+        # Wait for the first output so a full queue is reported as 429, not a broken stream
+        try:
+            first = await outputs.__anext__()
+        except QueueFullError as e:
+            return _error(429, str(e), 'rate_limit_error')
+        except StopAsyncIteration:
+            return _error(499, "Client disconnected", 'request_cancelled')
+        except ValueError as e:
+            # Invalid sampling parameters, or a regex / JSON schema that cannot be compiled
+            return _error(400, str(e), 'invalid_request_error')
+        except Exception as e:
+            return _error(500, str(e), 'server_error')
+            
+        request_id = uuid.uuid4().hex
+        created = int(time.time())
+        decoder = _TextDecoder(tokenizer)
+        
+        if not request_body.stream:
+            last = first
+            try:
+                async for output in outputs:
+                    last = output
+            except Exception as e:
+                return _error(500, str(e), 'server_error')
+            if not last.finished:
+                return _error(499, "Client disconnected", 'request_cancelled')
+            return build_response(request_id, created, decoder.delta(last), last)
+            
+        async def event_stream():
+            try:
+                for chunk in build_chunks(request_id, created, None, None):
+                    yield _sse(chunk)
+                output = first
+                while True:
+                    for chunk in build_chunks(request_id, created, decoder.delta(output), output):
+                        yield _sse(chunk)
+                    if output.finished:
+                        break
+                    output = await outputs.__anext__()
+                yield "data: [DONE]\n\n"
+            except StopAsyncIteration:
+                pass
+            except Exception as e:
+                yield _sse({'error': {'message': str(e), 'type': 'server_error', 'code': 500}})
+            finally:
+                await outputs.aclose()
+                
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    @app.post("/v1/completions")
+    async def completions(request: Request, request_body: CompletionRequest):
+        error = check_request(request_body)
+        if error is not None:
+            return error
+            
+        prompt = request_body.prompt
+        if isinstance(prompt, list):
+            if len(prompt) != 1:
+                return _error(400, "Only a single prompt per request is supported", 'invalid_request_error')
+            prompt = prompt[0]
+            
+        def build_response(request_id, created, text, output):
+            return {
+                'id': f"cmpl-{request_id}",
+                'object': 'text_completion',
+                'created': created,
+                'model': model_name,
+                'choices': [{
+                    'index': 0,
+                    'text': prompt + text if request_body.echo else text,
+                    'logprobs': None,
+                    'finish_reason': _finish_reason(output)
+                }],
+                'usage': _usage(output)
+            }
+            
+        def build_chunks(request_id, created, text, output):
+            if output is None:
+                if request_body.echo:
+                    yield _completion_chunk(request_id, created, model_name, prompt, None)
+                return
+            if text or output.finished:
+                yield _completion_chunk(request_id, created, model_name, text, _finish_reason(output))
+                
+        return await respond(request, request_body, prompt, build_response, build_chunks)
+        
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request, request_body: ChatCompletionRequest):
+        error = check_request(request_body)
+        if error is not None:
+            return error
+            
+        prompt = _apply_chat_template(tokenizer, request_body.messages)
+        
+        def build_response(request_id, created, text, output):
+            return {
+                'id': f"chatcmpl-{request_id}",
+                'object': 'chat.completion',
+                'created': created,
+                'model': model_name,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': text},
+                    'finish_reason': _finish_reason(output)
+                }],
+                'usage': _usage(output)
+            }
+            
+        def build_chunks(request_id, created, text, output):
+            if output is None:
+                yield _chat_chunk(request_id, created, model_name, {'role': 'assistant'}, None)
+                return
+            if text or output.finished:
+                delta = {'content': text} if text else {}
+                yield _chat_chunk(request_id, created, model_name, delta, _finish_reason(output))
+                
+        return await respond(request, request_body, prompt, build_response, build_chunks)
+        
+    @app.get("/v1/models")
+    async def list_models():
+        return {
+            'object': 'list',
+            'data': [{'id': model_name, 'object': 'model', 'owned_by': 'professional-nano-llm'}]
+        }
+        
+    @app.get("/health")
+    async def health():
+        return {'status': 'ok' if engine.is_running else 'stopped', **engine.get_stats()}
+        
+    return app
+
+def _completion_chunk(request_id: str, created: int, model: str, text: str, finish_reason: Optional[str]):
+    return {
+        'id': f"cmpl-{request_id}",
+        'object': 'text_completion',
+        'created': created,
+        'model': model,
+        'choices': [{'index': 0, 'text': text, 'logprobs': None, 'finish_reason': finish_reason}]
+    }
+
+def _chat_chunk(request_id: str, created: int, model: str, delta: Dict[str, str], finish_reason: Optional[str]):
+    return {
+        'id': f"chatcmpl-{request_id}",
+        'object': 'chat.completion.chunk',
+        'created': created,
+        'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+
+def _apply_chat_template(tokenizer, messages: List[ChatMessage]) -> str:
+    """Render chat messages with the tokenizer's template, or a plain fallback"""
+    conversation = [{'role': m.role, 'content': m.content} for m in messages]
+    if getattr(tokenizer, 'chat_template', None):
+        return tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+        
+    lines = [f"{m['role']}: {m['content']}" for m in conversation]
+    return "\n".join(lines) + "\nassistant:"
+
+def main():
+    parser = argparse.ArgumentParser(description="Professional Nano-LLM OpenAI-compatible server")
+    parser.add_argument("--model", required=True, help="Model path or HuggingFace ID")
+    parser.add_argument("--served-model-name", default=None, help="Model name exposed by the API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-model-len", type=int, default=None)
+    parser.add_argument("--max-num-seqs", type=int, default=32)
+    parser.add_argument("--max-num-batched-tokens", type=int, default=8192, help="Token budget per engine step")
+    parser.add_argument("--prefill-chunk-size", type=int, default=512, help="Prompt tokens prefilled per request per step")
+    parser.add_argument("--gpu-memory-utilization", type=float, default=0.8)
+    parser.add_argument("--swap-space", type=float, default=None, help="GiB of host memory for preempted KV (default 4 on GPU)")
+    parser.add_argument("--disk-swap-space", type=float, default=0.0, help="GiB of disk for preempted KV once host swap is full")
+    parser.add_argument("--prefix-cache-disk-space", type=float, default=0.0, help="GiB of prefix cache persisted under --cache-dir")
+    parser.add_argument("--load-format", default="auto", choices=["auto", "safetensors", "hf"])
+    parser.add_argument("--cache-dir", default=None, help="Local tokenizer/config cache shared by replicas")
+    parser.add_argument("--quantization", default=None, choices=["int8", "int4"], help="Weight-only quantization")
+    parser.add_argument("--max-queue-depth", type=int, default=256, help="Max queued plus running requests")
+    parser.add_argument("--queue-timeout", type=float, default=5.0, help="Seconds to wait for a queue slot before 429")
+    parser.add_argument("--config", default=None, help="Project config.yaml; enables metrics per monitoring.metrics")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Overrides monitoring.metrics.export_port")
+    args = parser.parse_args()
+    
+    import uvicorn
+    from ..monitoring.metrics import create_stats_recorder
+    
+    model_name = args.served_model_name or args.model
+    stats_recorder = None
+    if args.config is not None or args.metrics_port is not None:
+        stats_recorder = create_stats_recorder(args.config, model_name, args.metrics_port)
+        
+    llm = LLM(
+        args.model,
+        max_model_len=args.max_model_len,
+        max_num_seqs=args.max_num_seqs,
+        max_num_batched_tokens=args.max_num_batched_tokens,
+        prefill_chunk_size=args.prefill_chunk_size,
+        gpu_memory_utilization=args.gpu_memory_utilization,
+        stats_recorder=stats_recorder,
+        load_format=args.load_format,
+        cache_dir=args.cache_dir,
+        quantization=args.quantization,
+        swap_space=args.swap_space,
+        disk_swap_space=args.disk_swap_space,
+        prefix_cache_disk_space=args.prefix_cache_disk_space
+    )
+    engine = AsyncLLMEngine(llm, max_queue_depth=args.max_queue_depth, queue_timeout=args.queue_timeout)
+    if stats_recorder is not None:
+        stats_recorder.track_queue(engine)
+    app = create_app(engine, model_name)
+    
+    print(f"🌐 Serving {args.model} on http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port)
+    # Persists the prefix cache for the next start
+    llm.close()
+
+if __name__ == "__main__":
+    main()
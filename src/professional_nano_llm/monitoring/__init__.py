@@ -1,5 +1,14 @@
 """
 Monitoring components
+
+- PrometheusStatsRecorder: Engine latency and utilization histograms
+- create_stats_recorder: Build a recorder from config.yaml monitoring.metrics
 """
 
-# Monitoring components will be implemented during development
+from .metrics import PrometheusStatsRecorder, create_stats_recorder, load_metrics_config
+
+__all__ = [
+    "PrometheusStatsRecorder",
+    "create_stats_recorder",
+    "load_metrics_config"
+]
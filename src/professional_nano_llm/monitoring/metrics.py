@@ -0,0 +1,190 @@
+"""
+Prometheus metrics for the nano-vLLM engine
+Records TTFT, inter-token latency, queue wait, step times, batch size and KV cache usage
+"""
+
+from typing import Any, Dict, Optional
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+from nanovllm import Sequence, StatsRecorder, StepStats
+
+DEFAULT_EXPORT_PORT = 8000
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.15, 0.2,
+    0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 24, 32, 48, 64, 96, 128, 256)
+UTILIZATION_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+TOKEN_BUCKETS = (0, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+class PrometheusStatsRecorder(StatsRecorder):
+    """
+    StatsRecorder that exports engine metrics to Prometheus
+    
+    Features:
+    - Histograms for time to first token, inter-token latency, queue wait,
+      prefill and decode step time, batch size, KV block utilization and
+      prefix cache tokens saved
+    - Counters for tokens, preemptions and finished requests
+    - Every series carries a model_name label; children are bound up front
+      so recording is a single observe() call
+    """
+    
+    def __init__(self, model_name: str = "", namespace: str = "nanovllm", registry=None):
+        if prometheus_client is None:
+            raise ImportError("prometheus-client is required for metrics: pip install prometheus-client")
+            
+        self.model_name = model_name
+        self.namespace = namespace
+        self.registry = registry if registry is not None else prometheus_client.CollectorRegistry()
+        labels = ['model_name']
+        
+        def histogram(name, documentation, buckets):
+            return prometheus_client.Histogram(
+                name, documentation, labels, namespace=namespace,
+                buckets=buckets, registry=self.registry
+            ).labels(model_name)
+            
+        def counter(name, documentation):
+            return prometheus_client.Counter(
+                name, documentation, labels, namespace=namespace, registry=self.registry
+            ).labels(model_name)
+            
+        def gauge(name, documentation):
+            return prometheus_client.Gauge(
+                name, documentation, labels, namespace=namespace, registry=self.registry
+            ).labels(model_name)
+            
+        # Request latency
+        self.time_to_first_token = histogram(
+            'time_to_first_token_seconds', 'Time from arrival to the first generated token', LATENCY_BUCKETS
+        )
+        self.inter_token_latency = histogram(
+            'inter_token_latency_seconds', 'Time between consecutive generated tokens', LATENCY_BUCKETS
+        )
+        self.queue_wait = histogram(
+            'queue_wait_seconds', 'Time from arrival to first scheduling', LATENCY_BUCKETS
+        )
+        self.e2e_latency = histogram(
+            'e2e_request_latency_seconds', 'Time from arrival to finish', LATENCY_BUCKETS
+        )
+        
+        # Step execution
+        self.prefill_time = histogram(
+            'prefill_step_seconds', 'Prefill time of steps that admitted sequences', LATENCY_BUCKETS
+        )
+        self.decode_time = histogram(
+            'decode_step_seconds', 'Decode time of steps with running sequences', LATENCY_BUCKETS
+        )
+        self.batch_size = histogram(
+            'batch_size', 'Sequences run per engine step', BATCH_SIZE_BUCKETS
+        )
+        self.kv_utilization = histogram(
+            'kv_cache_block_utilization', 'Fraction of KV cache blocks in use after each step', UTILIZATION_BUCKETS
+        )
+        self.prefix_tokens_saved = histogram(
+            'prefix_cache_tokens_saved', 'Prompt tokens served from the prefix cache per request', TOKEN_BUCKETS
+        )
+        
+        # Totals and current state
+        self.prompt_tokens = counter('prompt_tokens', 'Prompt tokens prefilled')
+        self.generation_tokens = counter('generation_tokens', 'Tokens generated')
+        self.cached_tokens = counter('prefix_cache_tokens', 'Prompt tokens read from the prefix cache')
+        self.preemptions = counter('preemptions', 'Sequences preempted for lack of KV blocks')
+        self.requests_finished = prometheus_client.Counter(
+            'requests_finished', 'Finished requests by reason', labels + ['finish_reason'],
+            namespace=namespace, registry=self.registry
+        )
+        self.num_running = gauge('num_requests_running', 'Sequences in the last step')
+        self.num_waiting = gauge('num_requests_waiting', 'Sequences waiting for admission')
+        self.kv_usage = gauge('kv_cache_usage', 'Fraction of KV cache blocks in use')
+        
+    def record_step(self, stats: StepStats):
+        if stats.num_prefill_seqs:
+            self.prefill_time.observe(stats.prefill_time)
+            self.prompt_tokens.inc(stats.num_prefill_tokens)
+            self.cached_tokens.inc(stats.num_cached_tokens)
+        if stats.num_decode_seqs:
+            self.decode_time.observe(stats.decode_time)
+        if stats.num_preempted:
+            self.preemptions.inc(stats.num_preempted)
+            
+        self.batch_size.observe(stats.batch_size)
+        self.kv_utilization.observe(stats.kv_utilization)
+        self.kv_usage.set(stats.kv_utilization)
+        self.num_running.set(stats.batch_size)
+        self.num_waiting.set(stats.num_waiting)
+        
+    def record_scheduled(self, seq: Sequence):
+        self.queue_wait.observe(seq.first_scheduled_time - seq.arrival_time)
+        self.prefix_tokens_saved.observe(seq.num_computed_tokens)
+        
+    def record_first_token(self, seq: Sequence):
+        self.time_to_first_token.observe(seq.first_token_time - seq.arrival_time)
+        self.generation_tokens.inc()
+        
+    def record_inter_token(self, seq: Sequence, latency: float):
+        self.inter_token_latency.observe(latency)
+        self.generation_tokens.inc()
+        
+    def record_finished(self, seq: Sequence):
+        self.e2e_latency.observe(seq.finish_time - seq.arrival_time)
+        self.requests_finished.labels(self.model_name, seq.finish_reason or 'unknown').inc()
+        
+    def track_queue(self, async_engine):
+        """Export the request queue depth of an AsyncLLMEngine, read at scrape time"""
+        gauge = prometheus_client.Gauge(
+            'api_queue_depth', 'Requests queued or running in the API server',
+            ['model_name'], namespace=self.namespace, registry=self.registry
+        )
+        gauge.labels(self.model_name).set_function(lambda: async_engine.num_requests)
+        
+    def start_server(self, port: int = DEFAULT_EXPORT_PORT, addr: str = "0.0.0.0"):
+        """Serve /metrics for this recorder's registry on a background thread"""
+        prometheus_client.start_http_server(port, addr=addr, registry=self.registry)
+        print(f"📊 Metrics exported on http://{addr}:{port}/metrics")
+
+def load_metrics_config(config_path: str = "config.yaml") -> Dict[str, Any]:
+    """Read monitoring.metrics from the project config"""
+    import yaml
+    
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+        
+    metrics_config = config.get('monitoring', {}).get('metrics', {}) or {}
+    return {
+        'enabled': bool(metrics_config.get('enabled', False)),
+        'export_port': int(metrics_config.get('export_port', DEFAULT_EXPORT_PORT))
+    }
+
+def create_stats_recorder(
+    config_path: Optional[str] = "config.yaml",
+    model_name: str = "",
+    export_port: Optional[int] = None
+) -> Optional[PrometheusStatsRecorder]:
+    """
+    Build and start a recorder if metrics are enabled
+    
+    Args:
+        config_path: Project config with monitoring.metrics; None enables metrics
+        model_name: Value of the model_name label
+        export_port: Overrides monitoring.metrics.export_port
+        
+    Returns:
+        The recorder to pass to LLM(stats_recorder=...), or None when metrics
+        are disabled so the engine skips instrumentation entirely
+    """
+    config = {'enabled': True, 'export_port': DEFAULT_EXPORT_PORT}
+    if config_path is not None:
+        config = load_metrics_config(config_path)
+    if not config['enabled']:
+        return None
+        
+    recorder = PrometheusStatsRecorder(model_name=model_name)
+    recorder.start_server(export_port or config['export_port'])
+    return recorder